@@ -0,0 +1,88 @@
+import os
+import time
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+import pygame  # noqa: E402
+
+from twitchchat_display.cache import SurfaceCache  # noqa: E402
+from twitchchat_display.display import (  # noqa: E402
+    ChatScreen,
+    FontHelper,
+    TwitchChatDisplay,
+)
+from twitchchat_display.images import ImageAtlas  # noqa: E402
+from twitchchat_display.layout import Badge, Emote, TextRun, Username  # noqa: E402
+
+SIZE = (1280, 720)
+WHITE = (255, 255, 255)
+FRAMES = 200
+
+
+def pixel_bytes(surface):
+    # atlas slots are subsurfaces, so count their own pixels not the page's
+    return surface.get_width() * surface.get_height() * surface.get_bytesize()
+
+
+def make_lines(display, images):
+    lines = []
+    for i in range(40):
+        spans = [
+            Badge(images[0], "subscriber/12"),
+            Username(f"chatter{i}", (0, 255, 127)),
+            TextRun(" : ", WHITE),
+            TextRun("that play was ", WHITE),
+            Emote(images[1], "25", "Kappa"),
+            TextRun(" clip it ", WHITE),
+            Emote(images[1], "25", "Kappa"),
+        ]
+        for line in display.wraptext(spans, SIZE[0]):
+            lines.append(display.render_line(line))
+    return lines
+
+
+def run(flatten):
+    screen = ChatScreen(*SIZE, (0x28, 0x25, 0x38), flatten_lines=flatten)
+    display = TwitchChatDisplay.__new__(TwitchChatDisplay)
+    display.font_helper = FontHelper()
+    display.font_helper.load_font("FreeSans.ttf")
+    display.font_helper.load_font("FreeSansBold.ttf", bold=True)
+    display.surface_cache = SurfaceCache(8 * 1024 * 1024)
+    screen.set_line_height(display.font_helper.font_height)
+    height = display.font_helper.font_height
+    images = [pygame.Surface((height, height), pygame.SRCALPHA) for _ in range(2)]
+    atlas_bytes = 0
+    if flatten:
+        atlas = ImageAtlas(height)
+        images = [atlas.add(image) for image in images]
+        atlas_bytes = atlas.bytes
+    screen.add_chatlines(make_lines(display, images))
+    screen.blit_count = 0
+    started = time.perf_counter()
+    for _ in range(FRAMES):
+        screen.request_repaint()
+        screen.render_frame()
+    elapsed = time.perf_counter() - started
+    stats = screen.surface_stats()
+    parts = {
+        id(part): part for line in screen.lines for span in line for part in span.parts
+    }
+    return {
+        "blits/frame": stats["blits"] / FRAMES,
+        "ms/frame": elapsed * 1000 / FRAMES,
+        "span KB": sum(pixel_bytes(part) for part in parts.values()) / 1024,
+        "flat KB": stats["flat_bytes"] / 1024,
+        "atlas KB": atlas_bytes / 1024,
+    }
+
+
+def main():
+    pygame.init()
+    results = {"spans": run(False), "flattened": run(True)}
+    print(f"{'':<14}" + "".join(f"{name:>12}" for name in results))
+    for key in results["spans"]:
+        print(f"{key:<14}" + "".join(f"{r[key]:>12.1f}" for r in results.values()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+import os
+import tempfile
+import time
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+import pygame  # noqa: E402
+
+from twitchchat_display.display import (  # noqa: E402
+    BOLD_FONT_PATHS,
+    FONT_PATHS,
+    FontHelper,
+)
+
+
+def load_all(cache_dir):
+    font_helper = FontHelper(cache_dir=cache_dir)
+    timings = {}
+    for font_path in FONT_PATHS + BOLD_FONT_PATHS:
+        if not os.path.exists(font_path):
+            continue
+        started = time.perf_counter()
+        font_helper.load_font(font_path, bold=font_path in BOLD_FONT_PATHS)
+        timings[font_path] = time.perf_counter() - started
+    return timings
+
+
+def main():
+    pygame.font.init()
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cold = load_all(cache_dir)
+        warm = load_all(cache_dir)
+    print(f"{'font':<20} {'cold ms':>10} {'warm ms':>10}")
+    for font_path in cold:
+        print(
+            f"{font_path:<20} {cold[font_path] * 1000:>10.1f} "
+            f"{warm[font_path] * 1000:>10.1f}"
+        )
+    print(
+        f"{'total':<20} {sum(cold.values()) * 1000:>10.1f} "
+        f"{sum(warm.values()) * 1000:>10.1f}"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+import os
+import statistics
+import sys
+import time
+from functools import partial
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+from twitchchat_display.bench import (  # noqa: E402
+    LocalBadges,
+    LocalEmotes,
+    SyntheticChat,
+)
+from twitchchat_display.display import TwitchChatDisplay  # noqa: E402
+from twitchchat_display.ingest import DROP_OLDEST  # noqa: E402
+
+SIZE = (1280, 720)
+WORKLOAD = "raid_500hz"
+MESSAGES = 3000
+TIMEOUT = 120
+
+
+def processed(display):
+    if display.layout_process:
+        return display.layout_process.stats()["read"]
+    return display.message_queue.stats()["processed"]
+
+
+def run(layout_process, workload, messages):
+    display = TwitchChatDisplay(
+        *SIZE,
+        "benchmark",
+        image_cache_mb=0,
+        emote_source=LocalEmotes,
+        badge_source=LocalBadges,
+        queue_size=messages,
+        overload_policy=DROP_OLDEST,
+        layout_process=layout_process,
+    )
+    source = partial(SyntheticChat, workload, messages)
+    display.start()
+    try:
+        if layout_process:
+            display.start_layout_process(source)
+        else:
+            chat = source()
+            chat.subscribeChatMessage(display.new_twitchmessage)
+            chat.start()
+        # frames drawn while the worker process was still loading fonts
+        # aren't under any load
+        while not processed(display):
+            time.sleep(0.01)
+        display.chatscreen.frame_time.samples.clear()
+        started = time.monotonic()
+        deadline = started + TIMEOUT
+        while processed(display) < messages and time.monotonic() < deadline:
+            time.sleep(0.01)
+        elapsed = time.monotonic() - started
+        frames = [sample * 1000 for sample in display.chatscreen.frame_time.samples]
+        latency = display.chatscreen.message_latency.summary()
+    finally:
+        display.stop()
+    frames.sort()
+    return {
+        "msgs/s": messages / elapsed,
+        "frames": len(frames),
+        "mean ms": statistics.mean(frames),
+        "stdev ms": statistics.pstdev(frames),
+        "p99 ms": frames[min(len(frames) - 1, int(len(frames) * 0.99))],
+        "max ms": frames[-1],
+        "p95 lat ms": latency["p95"] * 1000,
+    }
+
+
+def main():
+    workload = sys.argv[1] if len(sys.argv) > 1 else WORKLOAD
+    messages = int(sys.argv[2]) if len(sys.argv) > 2 else MESSAGES
+    results = {
+        "threads": run(False, workload, messages),
+        "process": run(True, workload, messages),
+    }
+    print(f"{workload}, {messages} messages, frame render times")
+    print(f"{'':<12}" + "".join(f"{name:>12}" for name in results))
+    for key in results["threads"]:
+        print(f"{key:<12}" + "".join(f"{r[key]:>12.1f}" for r in results.values()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+import os
+import timeit
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+import pygame  # noqa: E402
+
+from twitchchat_display.display import FontHelper, TwitchChatDisplay  # noqa: E402
+from twitchchat_display.layout import TextRun, Username  # noqa: E402
+
+WIDTH = 1280
+WHITE = (255, 255, 255)
+MESSAGES = {
+    "short": "hello chat",
+    "sentence": "that was an absolutely insane play, clip it " * 2,
+    "copypasta": "THIS IS A COPYPASTA PogChamp spam it in chat " * 12,
+    "unbroken": "A" * 300,
+}
+
+
+def legacy_wraptext(font_helper, text, maxwidth):
+    # the per-character algorithm wraptext replaced, kept for comparison
+    lines = []
+    cut_i = len(text) - 1
+    while text:
+        width = sum(font_helper.get_text_width(item) for item in text[: cut_i + 1])
+        if width > maxwidth:
+            cut_i -= 1
+        else:
+            if text[: cut_i + 1]:
+                lines.append(text[: cut_i + 1])
+                text = text[cut_i + 1 :]
+            else:
+                lines.append(text[: cut_i + 2])
+                text = text[cut_i + 2 :]
+            if text:
+                cut_i = len(text) - 1
+    return lines
+
+
+def main():
+    pygame.font.init()
+    font_helper = FontHelper()
+    font_helper.load_font("FreeSans.ttf")
+    font_helper.load_font("FreeSansBold.ttf", bold=True)
+    display = TwitchChatDisplay.__new__(TwitchChatDisplay)
+    display.font_helper = font_helper
+    print(
+        f"{'message':<10} {'chars':>6} {'legacy ms':>10} {'spans ms':>10} {'speedup':>8}"
+    )
+    for name, text in MESSAGES.items():
+        chars = ["bob", " : "] + list(text)
+        spans = [Username("bob", WHITE), TextRun(" : ", WHITE), TextRun(text, WHITE)]
+        legacy_ms = min(
+            timeit.repeat(
+                lambda: legacy_wraptext(font_helper, chars, WIDTH), number=1, repeat=5
+            )
+        )
+        new_ms = min(
+            timeit.repeat(lambda: display.wraptext(spans, WIDTH), number=1, repeat=5)
+        )
+        print(
+            f"{name:<10} {len(text):>6} {legacy_ms * 1000:>10.2f} "
+            f"{new_ms * 1000:>10.2f} {legacy_ms / new_ms:>7.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
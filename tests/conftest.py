@@ -0,0 +1,4 @@
+import os
+
+# everything runs headless, on SDL's dummy video driver
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
@@ -0,0 +1,69 @@
+import time
+
+import pygame
+import pytest
+
+from twitchchat_display import display
+from twitchchat_display.animation import Animator
+from twitchchat_display.display import ChatScreen
+from twitchchat_display.images import Animation
+from twitchchat_display.layout import ImageSpan, Line
+
+LINE_HEIGHT = 20
+
+
+def frames():
+    surfaces = []
+    for color in ((255, 0, 0), (0, 0, 255)):
+        surface = pygame.Surface((LINE_HEIGHT, LINE_HEIGHT))
+        surface.fill(color)
+        surfaces.append(surface)
+    return Animation(surfaces, [0.05, 0.05])
+
+
+@pytest.fixture
+def animator(monkeypatch):
+    monkeypatch.setattr(display, "turn_screen_on", lambda: None)
+    monkeypatch.setattr(display, "turn_screen_off", lambda: None)
+    pygame.display.init()
+    screen = ChatScreen(320, 240, (0, 0, 0))
+    screen.set_line_height(LINE_HEIGHT)
+    animations = {}
+    animator = Animator(screen, lambda span: animations.get(span.parts[0]))
+    animator.animations = animations
+    screen.on_frame = animator.wake
+    ticks = []
+    tick = animator.tick
+
+    def counted_tick():
+        ticks.append(time.monotonic())
+        return tick()
+
+    animator.tick = counted_tick
+    animator.ticks = ticks
+    animator.start()
+    yield animator
+    animator.stop()
+    pygame.quit()
+
+
+def test_idle_animator_sleeps_until_a_frame_is_drawn(animator):
+    screen = animator.chatscreen
+    time.sleep(0.5)
+    assert len(animator.ticks) == 1
+    screen.add_chatlines([Line([ImageSpan(pygame.Surface((30, 16)))])])
+    screen.render_frame()
+    time.sleep(0.3)
+    # looked once at the new frame, found nothing animated and went back
+    assert len(animator.ticks) == 2
+
+
+def test_animates_while_on_screen(animator):
+    screen = animator.chatscreen
+    surface = pygame.Surface((LINE_HEIGHT, LINE_HEIGHT))
+    animator.animations[surface] = frames()
+    screen.add_chatlines([Line([ImageSpan(surface)])])
+    screen.render_frame()
+    time.sleep(0.5)
+    assert len(animator.ticks) > 3
+    assert animator.repaints
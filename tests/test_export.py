@@ -0,0 +1,109 @@
+import os
+import socket
+import time
+from threading import Event
+
+import pytest
+
+from twitchchat_display.export import MjpegSink, PipeSink
+
+SIZE = (64, 64)
+FRAME_BYTES = SIZE[0] * SIZE[1] * 4
+
+
+def frame(value):
+    return bytes([value]) * FRAME_BYTES
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def fifo(tmp_path):
+    path = str(tmp_path / "chat.rgba")
+    os.mkfifo(path)
+    return path
+
+
+def read_frame(fd):
+    data = b""
+    while len(data) < FRAME_BYTES:
+        chunk = os.read(fd, FRAME_BYTES - len(data))
+        assert chunk
+        data += chunk
+    return data
+
+
+def test_frames_without_a_reader_are_dropped(fifo):
+    sink = PipeSink(fifo)
+    try:
+        sink.send(frame(1), SIZE)
+        wait_for(lambda: sink.stats()["dropped"] == 1)
+        assert sink.stats()["written"] == 0
+    finally:
+        sink.close()
+
+
+def test_stalled_reader_never_blocks_send(fifo):
+    reader = os.open(fifo, os.O_RDONLY | os.O_NONBLOCK)
+    sink = PipeSink(fifo)
+    try:
+        started = time.monotonic()
+        # far more than the pipe buffers, nobody reads yet
+        for value in range(100):
+            sink.send(frame(value), SIZE)
+        assert time.monotonic() - started < 1
+        wait_for(lambda: sink.stats()["written"] >= 1)
+        stats = sink.stats()
+        assert stats["dropped"] >= 90
+        os.set_blocking(reader, True)
+        # whatever got through is whole frames, and the last one sent is
+        # still waiting its turn rather than lost
+        frames = []
+        while not frames or frames[-1] != frame(99):
+            frames.append(read_frame(reader))
+        assert all(data == bytes([data[0]]) * FRAME_BYTES for data in frames)
+        wait_for(lambda: sink.stats()["written"] == len(frames))
+        assert sink.stats()["written"] + sink.stats()["dropped"] == 100
+    finally:
+        sink.close()
+        os.close(reader)
+
+
+def test_stalled_mjpeg_encoder_never_blocks_send():
+    sink = MjpegSink(0)
+    gate = Event()
+    encode = sink.encode
+
+    def slow_encode(pixels, size):
+        gate.wait(5)
+        return encode(pixels, size)
+
+    sink.encode = slow_encode
+    client = socket.create_connection(sink.server.server_address)
+    try:
+        client.sendall(b"GET / HTTP/1.0\r\n\r\n")
+        wait_for(lambda: sink.clients == 1)
+        started = time.monotonic()
+        for value in range(100):
+            sink.send(frame(value), SIZE)
+        assert time.monotonic() - started < 1
+        gate.set()
+        wait_for(
+            lambda: sum(sink.stats()[key] for key in ("encoded", "dropped")) == 100
+        )
+        # the one being encoded when the rest arrived, and the newest
+        assert sink.stats()["encoded"] in (1, 2)
+        received = b""
+        while b"\xff\xd8" not in received:
+            chunk = client.recv(65536)
+            assert chunk
+            received += chunk
+        assert b"Content-Type: image/jpeg" in received
+    finally:
+        client.close()
+        sink.close()
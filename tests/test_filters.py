@@ -0,0 +1,99 @@
+import pygame
+import pytest
+
+from twitchchat_display import display
+from twitchchat_display.bench import LocalBadges, LocalEmotes
+from twitchchat_display.display import TwitchChatDisplay
+from twitchchat_display.filters import MessageFilter
+from twitchchat_display.layout import Counter
+
+
+def message(text, username="viewer", channel="#chan"):
+    return {
+        "username": username,
+        "display-name": username,
+        "color": "#FF0000",
+        "badges": "",
+        "emotes": "",
+        "channel": channel,
+        "room-id": "1",
+        "message": text,
+    }
+
+
+def visible(marker):
+    return True
+
+
+def test_duplicates_collapse_into_committed_record():
+    message_filter = MessageFilter()
+    record = message_filter.check(message("LUL"), visible)
+    record.lines = ["line"]
+    record.committed = True
+    assert message_filter.check(message("lul!!"), visible) is record
+    assert record.count == 2
+
+
+def test_dropped_message_takes_no_duplicates():
+    # the queue dropped this one, or it failed to render, so it never got
+    # lines on screen
+    message_filter = MessageFilter()
+    dropped = message_filter.check(message("copypasta"), visible)
+    record = message_filter.check(message("copypasta"), visible)
+    assert record is not dropped
+    assert record.count == 1 and dropped.count == 1
+    record.lines = ["line"]
+    record.committed = True
+    assert message_filter.check(message("copypasta"), visible) is record
+
+
+def test_scrolled_off_record_takes_no_duplicates():
+    message_filter = MessageFilter()
+    record = message_filter.check(message("gg"), visible)
+    record.lines = ["line"]
+    record.committed = True
+    assert message_filter.check(message("gg"), lambda marker: False) is not record
+
+
+@pytest.fixture
+def chat(monkeypatch, tmp_path):
+    monkeypatch.setattr(display, "turn_screen_on", lambda: None)
+    chat = TwitchChatDisplay(
+        400,
+        600,
+        "test",
+        image_cache_mb=0,
+        queue_size=0,
+        scrollback_messages=0,
+        emote_source=LocalEmotes,
+        badge_source=LocalBadges,
+        offscreen=True,
+        animate_emotes=False,
+        cache_dir=str(tmp_path),
+    )
+    yield chat
+    chat.stop()
+    display.clear_fonts()
+
+
+def test_counter_wraps_instead_of_overflowing(chat):
+    pane = chat.chatscreen.default_pane
+    text = " ".join(["word"] * 12)
+    chat.new_twitchmessage(message(text))
+    lines = list(pane.lines)
+    last_width = sum(span.width for span in lines[-1])
+    assert last_width > pane.rect.width // 2
+    record = chat.message_filter.recent[("#chan", text)]
+    record.count = 10**12
+    chat.update_counter(record)
+    assert len(pane.lines) == len(lines) + 1
+    assert all(
+        sum(span.width for span in line) <= pane.rect.width for line in pane.lines
+    )
+    assert isinstance(pane.lines[-1][-1], Counter)
+    assert record.lines[-1] is pane.lines[-1]
+    # the next duplicate updates the new last line
+    chat.new_twitchmessage(message(text))
+    assert pane.lines[-1][-1].text == " ×{0}".format(10**12 + 1)
+    assert len(pane.lines) == len(lines) + 1
+    pygame.quit()
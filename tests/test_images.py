@@ -0,0 +1,318 @@
+import gc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from threading import Event, Lock, Thread
+
+import pygame
+import pytest
+from PIL import Image
+
+from twitchchat_display.cache import MemoryManager, surface_bytes
+from twitchchat_display.images import (
+    PLACEHOLDER_COLOR,
+    ImageAtlas,
+    ImageStore,
+    TwitchEmotes,
+    fill_placeholder,
+)
+
+HEIGHT = 28
+
+
+def png(color, size=(HEIGHT, HEIGHT)):
+    surface = pygame.Surface(size, pygame.SRCALPHA)
+    surface.fill(color)
+    out = BytesIO()
+    pygame.image.save(surface, out, "png")
+    return out.getvalue()
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests.append(self.path)
+            queued = server.responses.get(self.path, [])
+            status, body = queued.pop(0) if len(queued) > 1 else queued[0]
+        server.release.wait(5)
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def stub():
+    # paths -> responses, served in order with the last one repeating
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    server.daemon_threads = True
+    server.lock = Lock()
+    server.requests = []
+    server.responses = {}
+    server.release = Event()
+    server.release.set()
+    thread = Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield server
+    server.release.set()
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def emotes(stub, monkeypatch):
+    monkeypatch.setattr(
+        TwitchEmotes,
+        "EMOTE_URL",
+        f"http://127.0.0.1:{stub.server_port}/{{emote_id}}/{{scale}}",
+    )
+    loaded = []
+    done = Event()
+
+    def on_loaded(placeholder, surface):
+        # as ChatScreen.image_loaded does, minus the repaint
+        fill_placeholder(placeholder, surface)
+        loaded.append((placeholder, surface))
+        done.set()
+
+    source = TwitchEmotes("test", HEIGHT, on_loaded=on_loaded)
+    source.results = loaded
+    source.done = done
+    yield source
+    source.close()
+
+
+def stub_url(stub, emote_id):
+    return f"http://127.0.0.1:{stub.server_port}/{emote_id}/1.0"
+
+
+def wait_loaded(source, count=1):
+    while len(source.results) < count:
+        assert source.done.wait(5), "image never finished loading"
+        source.done.clear()
+    # the pending entry goes away just after on_loaded returns
+    for _ in range(500):
+        with source.lock:
+            if not source.pending:
+                return
+        Event().wait(0.01)
+
+
+def test_placeholder_returned_at_once(stub, emotes):
+    stub.responses["/25/1.0"] = [(200, png((255, 0, 0, 255)))]
+    stub.release.clear()
+    placeholder = emotes.get("25")
+    assert placeholder.get_size() == (HEIGHT, HEIGHT)
+    assert tuple(placeholder.get_at((0, 0))) == PLACEHOLDER_COLOR
+    assert not emotes.results
+    stub.release.set()
+    wait_loaded(emotes)
+    shown, surface = emotes.results[0]
+    assert shown is placeholder
+    assert tuple(surface.get_at((HEIGHT // 2, HEIGHT // 2))) == (255, 0, 0, 255)
+    assert emotes.get("25") is surface
+
+
+def test_concurrent_lookups_make_one_request(stub, emotes):
+    stub.responses["/25/1.0"] = [(200, png((0, 255, 0, 255)))]
+    stub.release.clear()
+    results = []
+    threads = [
+        Thread(target=lambda: results.append(emotes.get("25"))) for _ in range(8)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert all(result is results[0] for result in results)
+    stub.release.set()
+    wait_loaded(emotes)
+    emotes.get("25")
+    assert stub.requests == ["/25/1.0"]
+
+
+def test_missing_image_leaves_blank_placeholder(stub, emotes):
+    stub.responses["/404/1.0"] = [(404, b"")]
+    placeholder = emotes.get("404")
+    wait_loaded(emotes)
+    assert emotes.results == [(placeholder, None)]
+    assert tuple(placeholder.get_at((0, 0))) == (0, 0, 0, 0)
+    emotes.get("404")
+    assert stub.requests == ["/404/1.0"]
+
+
+def test_failed_fetch_is_retried(stub, emotes):
+    stub.responses["/25/1.0"] = [(500, b""), (200, png((0, 0, 255, 255)))]
+    emotes.get("25")
+    wait_loaded(emotes)
+    assert emotes.results[0][1] is None
+    emotes.get("25")
+    wait_loaded(emotes, 2)
+    surface = emotes.results[1][1]
+    assert tuple(surface.get_at((HEIGHT // 2, HEIGHT // 2))) == (0, 0, 255, 255)
+    assert stub.requests == ["/25/1.0", "/25/1.0"]
+    assert emotes.get("25") is surface
+
+
+def test_store_trims_blobs_with_their_meta(tmp_path):
+    blob_bytes = HEIGHT * HEIGHT * 4
+    store = ImageStore(tmp_path, max_bytes=blob_bytes * 3)
+    for i in range(5):
+        surface = pygame.Surface((HEIGHT, HEIGHT), pygame.SRCALPHA)
+        surface.fill((i, 0, 0, 255))
+        store.save(f"key{i}", surface)
+    assert store.current_bytes == blob_bytes * 3
+    assert len(list(store.blob_dir.glob("*.rgba"))) == 3
+    assert len(list(store.meta_dir.glob("*.json"))) == 3
+    assert store.load("key0") == (None, None)
+    assert tuple(store.load("key4")[0].get_at((0, 0))) == (4, 0, 0, 255)
+    # a new run picks the same picture up from disk
+    reopened = ImageStore(tmp_path, max_bytes=blob_bytes * 3)
+    assert reopened.load("key2")[0] is not None
+    assert reopened.current_bytes == blob_bytes * 3
+
+
+def test_stored_image_shown_then_revalidated(stub, emotes, tmp_path):
+    stub.responses["/25/1.0"] = [(304, b"")]
+    emotes.store = ImageStore(tmp_path)
+    stored = pygame.Surface((HEIGHT, HEIGHT), pygame.SRCALPHA)
+    stored.fill((9, 9, 9, 255))
+    emotes.store.save(emotes.store_key("25"), stored, etag="v1")
+    placeholder = emotes.get("25")
+    wait_loaded(emotes)
+    assert emotes.results[0][0] is placeholder
+    assert tuple(placeholder.get_at((0, 0))) == (9, 9, 9, 255)
+    assert tuple(emotes.get("25").get_at((0, 0))) == (9, 9, 9, 255)
+    assert stub.requests == ["/25/1.0"]
+
+
+def test_atlas_slot_reused_once_unreferenced():
+    atlas = ImageAtlas(HEIGHT)
+    slot = atlas.alloc((HEIGHT, HEIGHT))
+    offset = slot.get_offset()
+    line = [slot]
+    del slot
+    # still drawn by a line, so not handed out again
+    other = atlas.alloc((HEIGHT, HEIGHT))
+    assert other.get_offset() != offset
+    del line
+    gc.collect()
+    assert atlas.alloc((HEIGHT, HEIGHT)).get_offset() == offset
+
+
+def test_failed_fetch_frees_placeholder_slot(stub, emotes):
+    stub.responses["/25/1.0"] = [(500, b"")]
+    emotes.atlas = ImageAtlas(HEIGHT)
+    offset = emotes.get("25").get_offset()
+    wait_loaded(emotes)
+    emotes.results.clear()
+    gc.collect()
+    assert emotes.atlas.free == [
+        (emotes.atlas.pages[0], pygame.Rect(offset, (HEIGHT, HEIGHT)))
+    ]
+
+
+def test_atlas_rejects_double_release():
+    atlas = ImageAtlas(HEIGHT)
+    slot = atlas.alloc((HEIGHT, HEIGHT))
+    page, rect = slot.get_parent(), pygame.Rect(slot.get_offset(), slot.get_size())
+    del slot
+    gc.collect()
+    atlas.release(page, rect)
+    assert atlas.free == [(page, rect)]
+    first, second = atlas.alloc((HEIGHT, HEIGHT)), atlas.alloc((HEIGHT, HEIGHT))
+    assert first.get_offset() != second.get_offset()
+
+
+def test_revalidated_image_of_another_size_frees_one_slot(stub, emotes, tmp_path):
+    stub.responses["/25/1.0"] = [(200, png((0, 0, 255, 255), (HEIGHT * 2, HEIGHT)))]
+    emotes.atlas = ImageAtlas(HEIGHT)
+    emotes.store = ImageStore(tmp_path)
+    stored = pygame.Surface((HEIGHT, HEIGHT), pygame.SRCALPHA)
+    stored.fill((9, 9, 9, 255))
+    emotes.store.save(emotes.store_key("25"), stored, etag="v1")
+    placeholder = emotes.get("25")
+    offset = placeholder.get_offset()
+    wait_loaded(emotes, 2)
+    fresh = emotes.get("25")
+    assert fresh.get_size() == (HEIGHT * 2, HEIGHT)
+    del placeholder
+    emotes.results.clear()
+    gc.collect()
+    assert emotes.atlas.free == [
+        (emotes.atlas.pages[0], pygame.Rect(offset, (HEIGHT, HEIGHT)))
+    ]
+    slots = [emotes.atlas.alloc((HEIGHT, HEIGHT)) for _ in range(2)]
+    assert slots[0].get_offset() != slots[1].get_offset()
+    assert (
+        not slots[0]
+        .get_rect(topleft=slots[0].get_offset())
+        .colliderect(fresh.get_rect(topleft=fresh.get_offset()))
+    )
+
+
+def test_decoded_image_counted_once(stub, emotes):
+    stub.responses["/25/1.0"] = [(200, png((0, 0, 255, 255)))]
+    memory = MemoryManager()
+    memory.register("decoded", emotes.decoder.images)
+    memory.register("emotes", emotes.images)
+    emotes.get("25")
+    wait_loaded(emotes)
+    surface = emotes.get("25")
+    assert emotes.decoder.lookup(stub_url(stub, "25"), HEIGHT) is surface
+    assert memory.used() == surface_bytes(surface)
+    # once the decoder lets go of it, it's the emote cache's to count
+    emotes.decoder.images.clear()
+    emotes.images.clear()
+    emotes.cache_image("25", surface)
+    assert memory.used() == surface_bytes(surface)
+
+
+def gif(colors):
+    frames = [Image.new("RGBA", (HEIGHT, HEIGHT), color) for color in colors]
+    out = BytesIO()
+    frames[0].save(
+        out, "GIF", save_all=True, append_images=frames[1:], duration=100, loop=0
+    )
+    return out.getvalue()
+
+
+def test_evicted_animation_is_decoded_again(stub, emotes):
+    stub.responses["/99/1.0"] = [(200, gif([(255, 0, 0, 255), (0, 0, 255, 255)]))]
+    emotes.get("99")
+    wait_loaded(emotes)
+    assert emotes.animation("99") is not None
+    emotes.decoder.animations.clear()
+    # rather than leave it frozen on its first frame
+    assert emotes.animation("99") is None
+    assert len(emotes.animated) == 0
+    emotes.get("99")
+    wait_loaded(emotes, 2)
+    assert stub.requests == ["/99/1.0", "/99/1.0"]
+    assert len(emotes.animation("99").frames) == 2
+
+
+def test_revalidated_image_redraws_every_copy_shown(stub, emotes, tmp_path):
+    stub.responses["/25/1.0"] = [(200, png((0, 255, 0, 255), (HEIGHT * 2, HEIGHT)))]
+    emotes.store = ImageStore(tmp_path)
+    stored = pygame.Surface((HEIGHT * 2, HEIGHT), pygame.SRCALPHA)
+    stored.fill((9, 9, 9, 255))
+    emotes.store.save(emotes.store_key("25"), stored, etag="v1")
+    stub.release.clear()
+    placeholder = emotes.get("25")
+    while not emotes.results:
+        assert emotes.done.wait(5)
+    # laid out after the stored copy was shown, before the fresh one arrived
+    shown_stored = emotes.get("25")
+    assert shown_stored is not placeholder
+    assert tuple(shown_stored.get_at((1, 1))) == (9, 9, 9, 255)
+    stub.release.set()
+    wait_loaded(emotes, 3)
+    for shown in (placeholder, shown_stored):
+        center = (shown.get_width() // 2, shown.get_height() // 2)
+        assert tuple(shown.get_at(center)) == (0, 255, 0, 255)
+    assert not emotes.revalidating
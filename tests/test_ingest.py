@@ -0,0 +1,61 @@
+from twitchchat_display.ingest import DROP_OLDEST, SKIP_OFFSCREEN, MessageQueue
+
+LINES = {"busy": 5, "quiet": 5}
+
+
+def queue(policy=SKIP_OFFSCREEN, capacity=100):
+    # messages are (pane, number), and each pane shows LINES of them
+    return MessageQueue(
+        None,
+        None,
+        capacity=capacity,
+        policy=policy,
+        visible=lambda message: (message[0], LINES[message[0]]),
+    )
+
+
+def drain(message_queue):
+    # what the render workers would be handed, in order
+    message_queue.running = True
+    taken = []
+    while message_queue.stats()["depth"]:
+        taken.append(message_queue.take()[1])
+    return taken
+
+
+def test_burst_on_one_pane_keeps_the_others_messages():
+    message_queue = queue()
+    message_queue.put(("quiet", 0))
+    message_queue.put(("quiet", 1))
+    for i in range(50):
+        message_queue.put(("busy", i))
+    assert drain(message_queue) == [("quiet", 0), ("quiet", 1)] + [
+        ("busy", i) for i in range(45, 50)
+    ]
+    assert message_queue.stats()["dropped"][SKIP_OFFSCREEN] == 45
+
+
+def test_each_pane_keeps_its_newest_screenful():
+    message_queue = queue()
+    for i in range(20):
+        message_queue.put(("quiet" if i % 4 == 0 else "busy", i))
+    taken = drain(message_queue)
+    assert [i for pane, i in taken if pane == "quiet"] == [0, 4, 8, 12, 16]
+    assert [i for pane, i in taken if pane == "busy"] == [14, 15, 17, 18, 19]
+    assert [i for _, i in taken] == sorted(i for _, i in taken)
+
+
+def test_long_burst_doesnt_keep_skipped_entries():
+    message_queue = queue(capacity=10)
+    for i in range(10000):
+        message_queue.put(("busy", i))
+    assert len(message_queue.queue) <= 2 * 5 + 10 + 1
+    assert drain(message_queue) == [("busy", i) for i in range(9995, 10000)]
+
+
+def test_capacity_still_drops_oldest():
+    message_queue = queue(policy=DROP_OLDEST, capacity=3)
+    for i in range(5):
+        message_queue.put(("busy", i))
+    assert drain(message_queue) == [("busy", 2), ("busy", 3), ("busy", 4)]
+    assert message_queue.stats()["dropped"][DROP_OLDEST] == 2
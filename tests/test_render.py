@@ -0,0 +1,154 @@
+import threading
+import time
+
+import pygame
+import pytest
+
+from twitchchat_display import display
+from twitchchat_display.display import ROWS, ChatScreen
+from twitchchat_display.layout import ImageSpan, Line
+
+LINE_HEIGHT = 20
+COLORS = [(200, 40, 40), (40, 200, 40), (40, 40, 200), (200, 200, 40)]
+
+
+def line(i):
+    # blocks of colour stand in for rendered text, no fonts needed
+    spans = []
+    for j in range(1 + i % 3):
+        surface = pygame.Surface((30 + 10 * j, LINE_HEIGHT - 4))
+        surface.fill(COLORS[(i + j) % len(COLORS)])
+        spans.append(ImageSpan(surface))
+    return Line(spans)
+
+
+@pytest.fixture
+def make_screen(monkeypatch):
+    monkeypatch.setattr(display, "turn_screen_on", lambda: None)
+    monkeypatch.setattr(display, "turn_screen_off", lambda: None)
+    pygame.init()
+
+    def make_screen(**kwargs):
+        screen = ChatScreen(320, 240, (0x28, 0x25, 0x38), **kwargs)
+        screen.set_line_height(LINE_HEIGHT)
+        return screen
+
+    yield make_screen
+    pygame.quit()
+    display.clear_fonts()
+
+
+def pixels(screen):
+    return pygame.image.tostring(screen.screen, "RGB")
+
+
+def assert_matches_full_repaint(screen):
+    incremental = pixels(screen)
+    screen.request_repaint()
+    screen.render_frame()
+    assert incremental == pixels(screen)
+
+
+@pytest.mark.parametrize(
+    "kwargs",
+    [
+        {},
+        {"flatten_lines": True},
+        {"panes": [["a"], ["*"]]},
+        {"panes": [["a"], ["b"], ["*"]], "pane_layout": ROWS},
+    ],
+)
+def test_scrolled_frames_match_full_repaint(make_screen, kwargs):
+    screen = make_screen(**kwargs)
+    screen.render_frame()
+    count = 0
+    for batch in (1, 3, 1, 7, 2, 25, 1):
+        for pane in screen.panes:
+            screen.add_chatlines([line(count + i) for i in range(batch)], pane)
+            count += batch
+        screen.set_viewers("chan", count)
+        dirty = []
+        update_display = screen.update_display
+        screen.update_display = lambda rects=None: (
+            dirty.append(rects),
+            update_display(rects),
+        )
+        screen.render_frame()
+        screen.update_display = update_display
+        # only the changed rects went to the display
+        assert dirty and dirty[0] is not None
+        assert_matches_full_repaint(screen)
+
+
+def test_quiet_pane_is_left_alone(make_screen):
+    screen = make_screen(panes=[["a"], ["*"]])
+    screen.add_chatlines([line(i) for i in range(5)], screen.panes[0])
+    screen.add_chatlines([line(i) for i in range(3)], screen.panes[1])
+    screen.render_frame()
+    rects = []
+    screen.update_display = lambda rects_=None: rects.append(rects_)
+    screen.add_chatlines([line(9)], screen.panes[1])
+    screen.render_frame()
+    assert rects and all(
+        not rect.colliderect(screen.panes[0].rect) for rect in rects[0]
+    )
+
+
+def test_repaint_requested_during_snapshot_is_kept(make_screen, monkeypatch):
+    screen = make_screen()
+    screen.render_frame()
+    assert not screen.full_repaint
+    display_off = screen.display_off
+    requester = threading.Thread(target=screen.request_repaint)
+
+    def display_off_then_request():
+        # runs inside render_frame's snapshot, with the lock held
+        if not requester.is_alive() and requester.ident is None:
+            requester.start()
+            time.sleep(0.05)
+        return display_off()
+
+    monkeypatch.setattr(screen, "display_off", display_off_then_request)
+    screen.render_frame()
+    requester.join()
+    assert screen.full_repaint
+
+
+def test_flatten_waits_for_animated_frames(make_screen):
+    # render workers flatten lines without display_lock, so they must not
+    # copy an emote while the Animator is halfway through drawing into it
+    screen = make_screen(flatten_lines=True)
+    flattened = []
+    with screen.image_lock:
+        worker = threading.Thread(
+            target=lambda: flattened.append(screen.flatten(line(0)))
+        )
+        worker.start()
+        worker.join(0.1)
+        assert not flattened
+    worker.join()
+    assert flattened
+
+
+def test_lines_are_flattened_outside_the_lock(make_screen, monkeypatch):
+    # render_frame snapshots under the lock, compositing a batch of lines
+    # mustn't hold it up
+    screen = make_screen(flatten_lines=True)
+    flatten = screen.flatten
+    held = []
+
+    def checked_flatten(line):
+        held.append(screen.lock.locked())
+        return flatten(line)
+
+    monkeypatch.setattr(screen, "flatten", checked_flatten)
+    placeholder = pygame.Surface((LINE_HEIGHT, LINE_HEIGHT))
+    added = Line([ImageSpan(placeholder)])
+    screen.add_chatlines([line(i) for i in range(5)] + [added])
+    screen.update_line(screen.lines[0], list(line(7)))
+    image = pygame.Surface((LINE_HEIGHT, LINE_HEIGHT))
+    image.fill(COLORS[0])
+    screen.image_loaded(placeholder, image)
+    assert len(held) == 8 and not any(held)
+    screen.render_frame()
+    assert tuple(added.surface.get_at((1, 1)))[:3] == COLORS[0]
@@ -0,0 +1,90 @@
+import gc
+import random
+import tracemalloc
+
+from twitchchat_display.bench import synthetic_message
+from twitchchat_display.scrollback import Scrollback, ScrollRecord
+
+
+def fresh(message):
+    # copies of the strings a record keeps, as if the message had just been
+    # parsed and will be thrown away
+    message = dict(message, message=message["message"] + " ")
+    if message["emotes"]:
+        message["emotes"] = message["emotes"] + " "
+    return message
+
+
+def messages(count, channels=("#a", "#b", "#c")):
+    rng = random.Random(1)
+    for i in range(count):
+        message = synthetic_message(rng, i, 3, 15, 0.3, 0.1)
+        message["channel"] = channels[i % len(channels)]
+        yield message
+
+
+def layout(record, layout_key):
+    layout.calls += 1
+    return [record.text]
+
+
+def test_accounted_bytes_match_measured():
+    for group in (None, lambda record: record.channel):
+        source = list(messages(20000))
+        # names and channels are interned once and shared from then on, the
+        # intern table growing isn't what a record costs
+        interned = [ScrollRecord(message) for message in source]
+        scrollback = Scrollback(layout, 10**9, 10**12, group=group)
+        gc.collect()
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        for message in source:
+            scrollback.append(ScrollRecord(fresh(message)))
+        gc.collect()
+        used = tracemalloc.get_traced_memory()[0] - before
+        tracemalloc.stop()
+        assert 0.9 < used / scrollback.current_bytes < 1.1
+        del interned
+
+
+def test_byte_cap_holds():
+    scrollback = Scrollback(layout, 10**9, 1024 * 1024)
+    for message in messages(20000):
+        scrollback.append(ScrollRecord(message))
+    assert 0 < scrollback.current_bytes <= 1024 * 1024
+    assert scrollback.first_seq + len(scrollback) == 20000
+
+
+def test_group_pages_only_touch_their_group():
+    rng = random.Random(2)
+    channels = ["#busy"] * 999 + ["#quiet"]
+    scrollback = Scrollback(layout, 50000, 10**9, group=lambda r: r.channel)
+    expected = []
+    for i in range(50000):
+        message = synthetic_message(rng, i, 1, 3, 0, 0)
+        message["channel"] = channels[i % len(channels)]
+        scrollback.append(ScrollRecord(message))
+        if message["channel"] == "#quiet":
+            expected.append(message["message"])
+    layout.calls = 0
+    lines, start = scrollback.page(scrollback.end, 10, None, "#quiet")
+    assert lines == expected[-10:]
+    assert layout.calls == 10
+    older, _ = scrollback.page(start, 10, None, "#quiet")
+    assert older == expected[-20:-10]
+    end = scrollback.page_end(start, 10, None, "#quiet")
+    assert end == scrollback.end
+    assert scrollback.page_end(0, 10, None, "#quiet") == 10 * 1000
+
+
+def test_group_index_follows_the_ring():
+    scrollback = Scrollback(layout, 100, 10**9, group=lambda r: r.channel)
+    sent = list(messages(1000))
+    for message in sent:
+        scrollback.append(ScrollRecord(message))
+    lines, start = scrollback.page(scrollback.end, 1000, None, "#b")
+    assert lines == [m["message"] for m in sent[-100:] if m["channel"] == "#b"]
+    assert start >= scrollback.first_seq
+    for seqs, first in scrollback.groups.values():
+        assert len(seqs) - first <= 34
+        assert len(seqs) <= 2 * 34 + 1
@@ -0,0 +1,147 @@
+import threading
+
+import pygame
+import pytest
+
+from twitchchat_display import display
+from twitchchat_display.display import ChatScreen
+
+STANDBY_DELAY = 60 * 10
+START = 1000.0
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = START
+
+    def __call__(self):
+        return self.now
+
+
+class ScriptedStop(object):
+    # stands in for the watchdog's stop event: every wait moves the clock on
+    # by its timeout instead of sleeping, running whatever the test scheduled
+    # for the times it passes, and the watchdog is stopped once the screen
+    # has gone to standby and waited again
+    def __init__(self, clock, screen):
+        self.clock = clock
+        self.screen = screen
+        self.scheduled = []
+        self.stopped = False
+
+    def at(self, when, action):
+        self.scheduled.append((when, action))
+        self.scheduled.sort(key=lambda item: item[0])
+
+    def is_set(self):
+        return self.stopped
+
+    def set(self):
+        self.stopped = True
+
+    def clear(self):
+        self.stopped = False
+
+    def wait(self, timeout=None):
+        assert timeout is not None, "the watchdog must never wait unbounded"
+        end = self.clock.now + timeout
+        while self.scheduled and self.scheduled[0][0] <= end:
+            when, action = self.scheduled.pop(0)
+            self.clock.now = when
+            action()
+        self.clock.now = end
+        if self.screen.standby_at:
+            self.stopped = True
+        return self.stopped
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(display.time, "monotonic", clock)
+    return clock
+
+
+@pytest.fixture
+def screen(clock, monkeypatch):
+    calls = []
+    monkeypatch.setattr(display, "turn_screen_on", lambda: calls.append("on"))
+    monkeypatch.setattr(display, "turn_screen_off", lambda: calls.append("off"))
+    pygame.display.init()
+    screen = ChatScreen(320, 240, (0, 0, 0))
+    screen.set_line_height(20)
+    screen.screen_calls = calls
+    screen.standby_at = None
+    disable_display = screen.disable_display
+
+    def recording_disable():
+        screen.standby_at = clock.now
+        disable_display()
+
+    screen.disable_display = recording_disable
+    screen.watchdog_stop = ScriptedStop(clock, screen)
+    yield screen
+    pygame.quit()
+
+
+def test_standby_after_idle_timeout(clock, screen):
+    assert screen.standby_delay == STANDBY_DELAY
+    screen.new_activity()
+    screen.idle_watchdog()
+    assert screen.standby_at == START + STANDBY_DELAY
+    assert not pygame.display.get_init()
+    assert screen.screen_calls == ["off"]
+
+
+def test_activity_postpones_standby(clock, screen):
+    screen.new_activity()
+    stop = screen.watchdog_stop
+    stop.at(START + 300, screen.new_activity)
+    stop.at(START + 650, screen.new_activity)
+    screen.idle_watchdog()
+    # exactly one idle timeout after the last activity, as a timer restarted
+    # on every message would have done
+    assert screen.standby_at == START + 650 + STANDBY_DELAY
+
+
+def test_no_standby_while_active(clock, screen):
+    screen.new_activity()
+    stop = screen.watchdog_stop
+    for minute in range(1, 60):
+        stop.at(START + minute * 60, screen.new_activity)
+    screen.idle_watchdog()
+    assert screen.standby_at == START + 59 * 60 + STANDBY_DELAY
+
+
+def test_wakes_on_new_activity(clock, screen):
+    screen.new_activity()
+    screen.idle_watchdog()
+    assert not pygame.display.get_init()
+    clock.now += 5
+    screen.new_activity()
+    assert screen.changed
+    screen.render_frame()
+    assert pygame.display.get_init()
+    assert screen.screen_calls == ["off", "on"]
+    assert pygame.display.get_surface() is screen.screen
+
+
+def test_activity_starts_no_threads(clock, screen):
+    before = threading.active_count()
+    for _ in range(100):
+        screen.new_activity()
+    assert threading.active_count() == before
+
+
+def test_viewer_count_does_not_wake_display(clock, screen):
+    screen.new_activity()
+    screen.idle_watchdog()
+    last_activity = screen.last_activity
+    clock.now += 5
+    screen.set_viewers("chan", 42)
+    assert screen.last_activity == last_activity
+    screen.render_frame()
+    assert not pygame.display.get_init()
+    assert screen.screen_calls == ["off"]
+    # still drawn once something else wakes it
+    assert screen.viewers_changed
@@ -0,0 +1,95 @@
+import marshal
+import os
+
+import pygame
+import pytest
+
+from twitchchat_display import display
+from twitchchat_display.display import BOLD_FONT_PATHS, FONT_PATHS, FontHelper
+from twitchchat_display.worker import COUNT, MESSAGE, LayoutWorker, SharedRing
+
+
+def message(text, username="viewer", channel="#chan"):
+    return {
+        "username": username,
+        "display-name": username,
+        "color": "#FF0000",
+        "badges": "",
+        "emotes": "",
+        "channel": channel,
+        "room-id": "1",
+        "message": text,
+    }
+
+
+@pytest.fixture
+def ring():
+    ring = SharedRing(size=4096)
+    # the worker's side of it, as run_worker opens it
+    writer = SharedRing(ring.name, ready=ring.ready)
+    yield ring, writer
+    writer.close()
+    ring.close()
+
+
+def test_counts_are_shared_through_the_header(ring):
+    ring, writer = ring
+    assert writer.put(b"record")
+    assert ring.get(timeout=1) == b"record"
+    stats = ring.stats()
+    assert stats["written"] == 1 and stats["read"] == 1
+    assert stats["dropped"] == 0 and stats["bytes"] == 0
+
+
+def test_full_ring_counts_drops(ring):
+    ring, writer = ring
+    while writer.put(b"x" * 100, wait=0):
+        pass
+    writer.put(b"x" * 100, wait=0)
+    stats = ring.stats()
+    assert stats["dropped"] == 2
+    assert stats["written"] > 0 and stats["read"] == 0
+
+
+class FullRing(object):
+    def __init__(self):
+        self.sent = []
+        self.full = True
+
+    def put(self, data):
+        if self.full:
+            return False
+        self.sent.append(data)
+        return True
+
+
+@pytest.fixture
+def worker(tmp_path):
+    pygame.font.init()
+    font_helper = FontHelper(cache_dir=str(tmp_path))
+    for font_path in FONT_PATHS + BOLD_FONT_PATHS:
+        if os.path.exists(font_path):
+            font_helper.load_font(font_path, bold=font_path in BOLD_FONT_PATHS)
+    options = {
+        "ignored_users": [],
+        "banned_patterns": [],
+        "dedupe_window": 30,
+        "record_path": None,
+        "panes": [(["*"], 400, 20)],
+        "source": lambda: None,
+    }
+    yield LayoutWorker(FullRing(), None, font_helper, options)
+    pygame.quit()
+    display.clear_fonts()
+
+
+def test_dropped_message_is_not_committed(worker):
+    worker.new_twitchmessage(message("copypasta"))
+    assert worker.pane_lines == [0]
+    # a duplicate isn't collapsed into a message the display never got
+    worker.ring.full = False
+    worker.new_twitchmessage(message("copypasta"))
+    worker.new_twitchmessage(message("copypasta"))
+    kinds = [marshal.loads(data)[0] for data in worker.ring.sent]
+    assert kinds == [MESSAGE, COUNT]
+    assert worker.pane_lines[0] > 0
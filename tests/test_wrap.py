@@ -0,0 +1,125 @@
+import os
+
+import pygame
+import pytest
+
+from twitchchat_display import display
+from twitchchat_display.display import BOLD_FONT_PATHS, FONT_PATHS, FontHelper
+from twitchchat_display.layout import Emote, TextRun, find_break
+
+# not in FreeSans, only in the OpenSansEmoji fallback
+FALLBACK = "\U0001f600"
+
+
+@pytest.fixture(scope="module")
+def font_helper(tmp_path_factory):
+    pygame.font.init()
+    font_helper = FontHelper(cache_dir=str(tmp_path_factory.mktemp("fonts")))
+    for font_path in FONT_PATHS + BOLD_FONT_PATHS:
+        if os.path.exists(font_path):
+            font_helper.load_font(font_path, bold=font_path in BOLD_FONT_PATHS)
+    yield font_helper
+    pygame.quit()
+    display.clear_fonts()
+
+
+def emote(width):
+    return Emote(pygame.Surface((width, 10)), "25", "Kappa")
+
+
+def widths(font_helper, lines):
+    return [
+        sum(
+            (
+                font_helper.get_text_width(span.text, span.bold)
+                if isinstance(span, TextRun)
+                else span.width
+            )
+            for span in line
+        )
+        for line in lines
+    ]
+
+
+def texts(lines):
+    return ["".join(span.text for span in line) for line in lines]
+
+
+def test_find_break_prefers_the_last_space():
+    text = "one two three"
+    # the space the limit falls on is dropped
+    assert find_break(text, 0, 3) == (3, 4)
+    assert find_break(text, 0, 9) == (8, 8)
+    # no space to break at, so the word is split
+    assert find_break(text, 8, 11) == (11, 11)
+    # unless the run starts a new word and can move down whole
+    assert find_break(text, 8, 11, at_word_start=True) == (8, 8)
+
+
+def test_over_long_word_is_split_across_lines(font_helper):
+    word = "a" * 200
+    lines = font_helper.wrap([TextRun(word, None)], 100)
+    assert len(lines) > 1
+    assert "".join(texts(lines)) == word
+    assert all(0 < width <= 100 for width in widths(font_helper, lines))
+
+
+def test_single_character_wider_than_line_still_progresses(font_helper):
+    lines = font_helper.wrap([TextRun("WW", None)], 1)
+    assert texts(lines) == ["W", "W"]
+
+
+def test_emote_only_lines(font_helper):
+    lines = font_helper.wrap([emote(30) for _ in range(10)], 100)
+    assert [len(line) for line in lines] == [3, 3, 3, 1]
+    assert all(width <= 100 for width in widths(font_helper, lines))
+
+
+def test_emote_wider_than_line_gets_a_line_of_its_own(font_helper):
+    spans = [emote(30), emote(150), emote(30)]
+    lines = font_helper.wrap(spans, 100)
+    assert [[span.width for span in line] for line in lines] == [[30], [150], [30]]
+
+
+def test_break_at_exact_width(font_helper):
+    word = "wrap"
+    width = font_helper.get_text_width(word)
+    # a run exactly as wide as the line fits on it
+    assert texts(font_helper.wrap([TextRun(word, None)], width)) == [word]
+    # and the space right after the limit is where it breaks
+    lines = font_helper.wrap([TextRun(f"{word} {word}", None)], width)
+    assert texts(lines) == [word, word]
+    # one pixel less and the word has to be split
+    lines = font_helper.wrap([TextRun(word, None)], width - 1)
+    assert texts(lines) == [word[:-1], word[-1]]
+
+
+def test_word_after_emote_moves_down_whole(font_helper):
+    word = "wrapped"
+    width = font_helper.get_text_width(word)
+    lines = font_helper.wrap([emote(30), TextRun(word, None)], width)
+    assert texts(lines) == ["Kappa", word]
+
+
+def test_mixed_font_fallback_glyphs(font_helper):
+    text = f"hi {FALLBACK}{FALLBACK} there {FALLBACK}"
+    runs = font_helper.segment(text)
+    assert [run for _, run in runs] == [
+        "hi ",
+        FALLBACK * 2,
+        " there ",
+        FALLBACK,
+    ]
+    assert runs[0][0][2] == "FreeSans.ttf"
+    assert runs[1][0][2] == "OpenSansEmoji.ttf"
+    fallback = runs[1][0][0].size(FALLBACK)[0]
+    assert font_helper.get_char_widths(FALLBACK) == [fallback]
+    # the break lands on the space in the regular font's run between them,
+    # which still fits on the first line
+    line_width = font_helper.get_text_width(f"there {FALLBACK}")
+    lines = font_helper.wrap([TextRun(text, None)], line_width)
+    assert texts(lines) == [f"hi {FALLBACK}{FALLBACK} ", f"there {FALLBACK}"]
+    assert all(width <= line_width for width in widths(font_helper, lines))
+    # and a run of them wider than the line splits between glyphs
+    lines = font_helper.wrap([TextRun(FALLBACK * 5, None)], fallback * 2)
+    assert texts(lines) == [FALLBACK * 2, FALLBACK * 2, FALLBACK]
@@ -0,0 +1,104 @@
+import logging
+import time
+from threading import Event, Thread
+
+from .images import fill_placeholder
+
+ANIMATION_FPS = 20
+
+
+class Animator(object):
+    # steps every animated emote on screen off one clock, so copies of the
+    # same emote stay in step, and repaints just their rects. Nothing runs
+    # for emotes that scrolled off or while the display is in standby; they
+    # pick up wherever the clock is once they are shown again. With nothing
+    # animated on screen it sleeps until the next frame is drawn, which is
+    # how anything new, loaded or scrolled into view gets there
+    def __init__(self, chatscreen, animation_for, fps=ANIMATION_FPS):
+        self.logger = logging.getLogger(name=__name__)
+        self.chatscreen = chatscreen
+        # span -> its Animation, or None if it isn't animated
+        self.animation_for = animation_for
+        self.interval = 1.0 / fps
+        self.epoch = time.monotonic()
+        # image surface on screen -> index of the frame drawn into it
+        self.shown = {}
+        self.stopped = Event()
+        self.woken = Event()
+        self.thread = None
+        self.visible = 0
+        self.frames = 0
+        self.repaints = 0
+
+    def tick(self):
+        chatscreen = self.chatscreen
+        with chatscreen.display_lock:
+            if chatscreen.display_off():
+                self.visible = 0
+                return None
+            images = chatscreen.visible_images(self.animation_for)
+            self.visible = len(images)
+            if not images:
+                self.shown.clear()
+                return None
+            clock = time.monotonic() - self.epoch
+            shown = {}
+            changed = []
+            wait = None
+            for surface, animation, pos, rect in images:
+                index, remaining = animation.frame_at(clock)
+                wait = remaining if wait is None else min(wait, remaining)
+                if surface not in shown:
+                    shown[surface] = index
+                    if self.shown.get(surface) != index:
+                        with chatscreen.image_lock:
+                            fill_placeholder(surface, animation.frames[index])
+                        self.frames += 1
+                if shown[surface] != self.shown.get(surface):
+                    changed.append((surface, pos, rect))
+            # forgets whatever went off screen, it is redrawn when it's back
+            self.shown = shown
+            if changed:
+                chatscreen.repaint_images(changed)
+                self.repaints += len(changed)
+        return max(wait, self.interval)
+
+    def wake(self):
+        self.woken.set()
+
+    def run(self):
+        wait = None
+        while not self.stopped.is_set():
+            if wait is None:
+                self.woken.wait()
+            else:
+                self.stopped.wait(wait)
+            # cleared before looking, so a frame drawn meanwhile isn't missed
+            self.woken.clear()
+            if self.stopped.is_set():
+                break
+            try:
+                wait = self.tick()
+            except Exception:
+                self.logger.exception("Error animating emotes")
+                wait = None
+
+    def start(self):
+        self.stopped.clear()
+        self.woken.set()
+        self.thread = Thread(target=self.run, name="animator")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.woken.set()
+        if self.thread:
+            self.thread.join()
+
+    def stats(self):
+        return {
+            "visible": self.visible,
+            "frames": self.frames,
+            "repaints": self.repaints,
+        }
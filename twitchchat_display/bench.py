@@ -0,0 +1,247 @@
+#!/usr/bin/env python
+# Headless throughput/latency benchmark: replays synthetic twitchchat message
+# dicts through TwitchChatDisplay with local stand-ins for emotes and badges
+
+import logging.config
+import multiprocessing
+import os
+import random
+import resource
+import time
+from pathlib import Path
+from threading import Event, Thread
+
+import click
+
+from .config import logging_config
+from .images import ChatImage
+from .ingest import DROP_OLDEST, OVERLOAD_POLICIES, RENDER_WORKERS
+
+LOCAL_IMAGE = Path(__file__).resolve().parent.parent / "yt_icon.png"
+WORDS = (
+    "the of and to in is you that it he was for on are as with his they at be "
+    "this from have or by one had not but what all were when we there can an "
+    "your which their said if do will each about how up out them then she many"
+).split()
+EMOTE_IDS = ["25", "354", "1902", "88", "41", "86", "30259", "58765"]
+EMOJI = "😀😂🔥👀💀🎉❤👍🙏✨"
+CJK = "日本語中文한국어漢字平仮名片仮名"
+BADGES = ["", "subscriber/12", "moderator/1", "subscriber/0,premium/1", "vip/1"]
+WORKLOADS = {
+    # name: (min words, max words, emote ratio, emoji/cjk ratio, msgs/s or None)
+    "short": (1, 6, 0.0, 0.0, None),
+    "long": (40, 90, 0.0, 0.0, None),
+    "emotes": (4, 20, 0.5, 0.0, None),
+    "emoji_cjk": (4, 20, 0.0, 0.4, None),
+    "mixed_50hz": (2, 30, 0.15, 0.1, 50),
+    "raid_500hz": (2, 30, 0.15, 0.1, 500),
+}
+
+
+class LocalImages(ChatImage):
+    def load_from_url(self, url, key=None, meta=None):
+        surface = self.decode(url, Path(url).read_bytes())
+        return self.find_animation(key, url, surface)[0]
+
+
+class LocalEmotes(LocalImages):
+    ANIMATED = True
+
+    def get(self, code):
+        return self.fetch(code, lambda: str(LOCAL_IMAGE))
+
+
+class LocalBadges(LocalImages):
+    def get(self, channel_id, badge_type):
+        return self.fetch((channel_id, badge_type), lambda: str(LOCAL_IMAGE))
+
+
+def synthetic_message(rng, index, min_words, max_words, emote_ratio, glyph_ratio):
+    words = []
+    emotes = {}
+    position = 0
+    for _ in range(rng.randint(min_words, max_words)):
+        roll = rng.random()
+        if roll < emote_ratio:
+            word = "Emote" + str(rng.randint(0, 9))
+            emote_id = rng.choice(EMOTE_IDS)
+            emotes.setdefault(emote_id, []).append(
+                f"{position}-{position + len(word) - 1}"
+            )
+        elif roll < emote_ratio + glyph_ratio:
+            word = "".join(rng.choice(EMOJI + CJK) for _ in range(rng.randint(1, 4)))
+        else:
+            word = rng.choice(WORDS)
+        words.append(word)
+        position += len(word) + 1
+    username = f"chatter{rng.randint(0, 5000)}"
+    return {
+        "badges": rng.choice(BADGES),
+        "emotes": "/".join(f"{k}:{','.join(v)}" for k, v in emotes.items()),
+        "color": rng.choice(["", "#FF4500", "#1E90FF", "#9ACD32"]),
+        "display-name": username.title(),
+        "username": username,
+        "channel": "#benchmark",
+        "room-id": "1",
+        # a serial keeps the spam filter from folding messages together
+        "message": " ".join(words) + f" #{index}",
+    }
+
+
+class SyntheticChat(object):
+    # stands in for twitch_chat, sending a workload's messages at its rate
+    def __init__(self, workload, messages, seed=1):
+        self.workload = workload
+        self.messages = messages
+        self.seed = seed
+        self.chat_subscribers = []
+        self.stopped = Event()
+        self.thread = None
+
+    def subscribeChatMessage(self, callback):
+        self.chat_subscribers.append(callback)
+
+    def run(self):
+        min_words, max_words, emote_ratio, glyph_ratio, rate = WORKLOADS[self.workload]
+        rng = random.Random(self.seed)
+        interval = 1.0 / rate if rate else 0
+        started = time.monotonic()
+        for i in range(self.messages):
+            if interval:
+                delay = started + i * interval - time.monotonic()
+                if delay > 0 and self.stopped.wait(delay):
+                    return
+            elif self.stopped.is_set():
+                return
+            message = synthetic_message(
+                rng, i, min_words, max_words, emote_ratio, glyph_ratio
+            )
+            for callback in self.chat_subscribers:
+                callback(message)
+
+    def start(self):
+        self.thread = Thread(target=self.run, name="synthetic-chat")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread:
+            self.thread.join()
+
+
+def run_workload(name, messages, options, seed, verbosity=0):
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    logging.config.dictConfig(logging_config(verbosity))
+    from .display import TwitchChatDisplay
+
+    min_words, max_words, emote_ratio, glyph_ratio, rate = WORKLOADS[name]
+    rng = random.Random(seed)
+    batch = [
+        synthetic_message(rng, i, min_words, max_words, emote_ratio, glyph_ratio)
+        for i in range(messages)
+    ]
+    display = TwitchChatDisplay(
+        1280,
+        720,
+        "benchmark",
+        image_cache_mb=0,
+        emote_source=LocalEmotes,
+        badge_source=LocalBadges,
+        **options,
+    )
+    display.start()
+    try:
+        interval = 1.0 / rate if rate else 0
+        started = time.monotonic()
+        for i, message in enumerate(batch):
+            if interval:
+                delay = started + i * interval - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            display.new_twitchmessage(message)
+        queue = display.message_queue
+        while queue.stats()["depth"] or queue.commit_seq < queue.next_seq:
+            time.sleep(0.01)
+        elapsed = time.monotonic() - started
+        # let the last frame land so its latency is counted
+        time.sleep(display.chatscreen.frame_interval * 3)
+        queue_stats = queue.stats()
+        latency = display.chatscreen.message_latency.summary()
+    finally:
+        display.stop()
+    return {
+        "workload": name,
+        "msgs/s": queue_stats["processed"] / elapsed,
+        "dropped": sum(queue_stats["dropped"].values()),
+        "p50 ms": latency["p50"] * 1000,
+        "p95 ms": latency["p95"] * 1000,
+        "p99 ms": latency["p99"] * 1000,
+        "max ms": latency["max"] * 1000,
+        "peak RSS MB": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+@click.command()
+@click.option("-v", "--verbosity", count=True)
+@click.option(
+    "-w",
+    "--workload",
+    "workloads",
+    multiple=True,
+    type=click.Choice(list(WORKLOADS)),
+    help="Workloads to run, all of them by default",
+)
+@click.option("-n", "--messages", default=2000, show_default=True)
+@click.option("--flatten-lines/--no-flatten-lines", default=False)
+@click.option("--render-workers", default=RENDER_WORKERS, show_default=True)
+@click.option(
+    "--queue-size",
+    type=int,
+    help="Ingest queue size, defaults to --messages so nothing is dropped",
+)
+@click.option(
+    "--overload-policy",
+    type=click.Choice(OVERLOAD_POLICIES),
+    default=DROP_OLDEST,
+    show_default=True,
+)
+@click.option("--seed", default=1, show_default=True)
+def main(
+    verbosity,
+    workloads,
+    messages,
+    flatten_lines,
+    render_workers,
+    queue_size,
+    overload_policy,
+    seed,
+):
+    options = {
+        "flatten_lines": flatten_lines,
+        "render_workers": render_workers,
+        "queue_size": queue_size or messages,
+        "overload_policy": overload_policy,
+    }
+    # every workload gets a fresh interpreter so peak RSS is its own
+    context = multiprocessing.get_context("spawn")
+    columns = None
+    for name in workloads or WORKLOADS:
+        with context.Pool(1) as pool:
+            result = pool.apply(
+                run_workload,
+                (name, messages, options, seed, verbosity),
+            )
+        if columns is None:
+            columns = list(result)
+            click.echo("".join(f"{column:>13}" for column in columns))
+        click.echo(
+            "".join(
+                f"{value:>13.1f}" if isinstance(value, float) else f"{value:>13}"
+                for value in result.values()
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,234 @@
+import logging
+import time
+from collections import OrderedDict
+from threading import Event, Lock, Thread
+
+MEMORY_BUDGET_MB = 96
+MEMORY_TTL = 60 * 60
+# rough cost of a small dict entry: key, value and the entry itself
+ENTRY_BYTES = 200
+MISSING = object()
+
+
+def surface_bytes(surface):
+    if surface.get_parent() is not None:
+        # a subsurface shares its parent's pitch, count only its own pixels
+        return surface.get_bytesize() * surface.get_width() * surface.get_height()
+    return surface.get_pitch() * surface.get_height()
+
+
+class ByteLRU(object):
+    # an LRU map that knows what its entries cost, so a MemoryManager can
+    # weigh it against every other cache
+    def __init__(self, max_bytes=None, max_entries=None, sizeof=None, on_evict=None):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.sizeof = sizeof or (lambda value: ENTRY_BYTES)
+        self.on_evict = on_evict
+        self.manager = None
+        # key -> [value, size, last used]
+        self.entries = OrderedDict()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.lock = Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def lookup(self, key, default=MISSING):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            self.entries.move_to_end(key)
+            entry[2] = time.monotonic()
+            self.hits += 1
+            return entry[0]
+
+    def insert(self, key, value, size=None):
+        if size is None:
+            size = self.sizeof(value)
+        evicted = []
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.current_bytes -= old[1]
+                if old[0] is not value:
+                    evicted.append(old[0])
+            self.entries[key] = [value, size, time.monotonic()]
+            self.current_bytes += size
+            while self.entries and self.over_limit():
+                evicted.append(self.pop_oldest())
+                self.evictions += 1
+        self.evicted(evicted)
+        if self.manager:
+            self.manager.enforce()
+        return value
+
+    def remove(self, key):
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is None:
+                return
+            self.current_bytes -= entry[1]
+        self.evicted([entry[0]])
+
+    def over_limit(self):
+        if self.max_bytes is not None and self.current_bytes > self.max_bytes:
+            return True
+        return self.max_entries is not None and len(self.entries) > self.max_entries
+
+    def pop_oldest(self):
+        _, (value, size, _) = self.entries.popitem(last=False)
+        self.current_bytes -= size
+        return value
+
+    def evicted(self, values):
+        if self.on_evict:
+            for value in values:
+                self.on_evict(value)
+
+    def oldest(self):
+        with self.lock:
+            if not self.entries:
+                return None
+            return next(iter(self.entries.values()))[2]
+
+    def evict_oldest(self):
+        with self.lock:
+            if not self.entries:
+                return False
+            value = self.pop_oldest()
+            self.evictions += 1
+        self.evicted([value])
+        return True
+
+    def expire(self, cutoff):
+        expired = []
+        with self.lock:
+            while self.entries and next(iter(self.entries.values()))[2] < cutoff:
+                expired.append(self.pop_oldest())
+            self.expirations += len(expired)
+        self.evicted(expired)
+
+    def clear(self):
+        with self.lock:
+            values = [entry[0] for entry in self.entries.values()]
+            self.entries.clear()
+            self.current_bytes = 0
+        self.evicted(values)
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "bytes": self.current_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+class SurfaceCache(ByteLRU):
+    def __init__(self, max_bytes):
+        super().__init__(max_bytes=max_bytes, sizeof=surface_bytes)
+        # anything bigger than this would just flush the cache for a one-off
+        self.max_entry_bytes = max_bytes // 8
+
+    def get(self, key, render):
+        surface = self.lookup(key)
+        if surface is not MISSING:
+            return surface
+        surface = render()
+        size = surface_bytes(surface)
+        if size > self.max_entry_bytes:
+            return surface
+        return self.insert(key, surface, size)
+
+    def stats(self):
+        stats = super().stats()
+        stats["max_bytes"] = self.max_bytes
+        return stats
+
+
+class MemoryManager(object):
+    # one byte budget across every registered cache. Over budget, the least
+    # recently used entry of any cache goes first; entries nobody has looked
+    # at for ttl seconds are dropped regardless
+    def __init__(self, max_bytes=MEMORY_BUDGET_MB * 1024 * 1024, ttl=MEMORY_TTL):
+        self.logger = logging.getLogger(name=__name__)
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.caches = {}
+        self.lock = Lock()
+        self.sweep_stop = Event()
+        self.sweep_thread = None
+
+    def register(self, name, cache):
+        cache.manager = self
+        self.caches[name] = cache
+        return cache
+
+    def used(self):
+        return sum(cache.current_bytes for cache in self.caches.values())
+
+    def enforce(self):
+        if self.used() <= self.max_bytes:
+            return
+        with self.lock:
+            while self.used() > self.max_bytes:
+                candidates = [
+                    (oldest, cache)
+                    for oldest, cache in (
+                        (cache.oldest(), cache) for cache in self.caches.values()
+                    )
+                    if oldest is not None
+                ]
+                if not candidates:
+                    break
+                min(candidates, key=lambda candidate: candidate[0])[1].evict_oldest()
+
+    def expire(self):
+        if self.ttl:
+            cutoff = time.monotonic() - self.ttl
+            for cache in self.caches.values():
+                cache.expire(cutoff)
+
+    def sweep(self):
+        interval = min(self.ttl / 4, 60) if self.ttl else 60
+        while not self.sweep_stop.wait(interval):
+            self.expire()
+            self.enforce()
+            self.logger.debug(
+                "Memory {0:.1f}MB of {1:.1f}MB".format(
+                    self.used() / 1024 / 1024, self.max_bytes / 1024 / 1024
+                )
+            )
+
+    def start(self):
+        self.sweep_stop.clear()
+        self.sweep_thread = Thread(target=self.sweep, name="memory-sweep")
+        self.sweep_thread.daemon = True
+        self.sweep_thread.start()
+
+    def stop(self):
+        self.sweep_stop.set()
+        if self.sweep_thread and self.sweep_thread.is_alive():
+            self.sweep_thread.join()
+
+    def stats(self):
+        stats = {"bytes": self.used(), "max_bytes": self.max_bytes}
+        stats["cache_bytes"] = {
+            name: cache.current_bytes for name, cache in self.caches.items()
+        }
+        stats["cache_entries"] = {
+            name: len(cache) for name, cache in self.caches.items()
+        }
+        return stats
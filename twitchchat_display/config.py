@@ -1,10 +1,16 @@
 import logging
+import os
 import sys
+from pathlib import Path
 
 import click
 import yaml
 
 LOG_MAP = {0: logging.WARNING, 1: logging.INFO, 2: logging.DEBUG}
+CACHE_DIR = (
+    Path(os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache"))
+    / "twitchchat_display"
+)
 
 
 def get_config(config_path):
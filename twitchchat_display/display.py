@@ -1,20 +1,68 @@
 import logging
 import os
 import random
-import re
 import time
 import unicodedata
-from threading import Lock, Thread, Timer
+from bisect import bisect_right
+from collections import OrderedDict
+from itertools import accumulate
+from threading import Event, Lock, Thread
 
 import pygame.ftfont
 import webcolors
 from fontTools.ttLib import TTFont
 
-from .images import TwitchBadges, TwitchEmotes
+from .animation import ANIMATION_FPS, Animator
+from .cache import (
+    MEMORY_BUDGET_MB,
+    MEMORY_TTL,
+    MISSING,
+    ByteLRU,
+    MemoryManager,
+    SurfaceCache,
+    surface_bytes,
+)
+from .fonts import CoverageCache, FontCoverage, clear_fonts, get_font
+from .images import (
+    ANIMATION_MB,
+    DECODE_PROCESSES,
+    IMAGE_STORE_MB,
+    ImageAtlas,
+    ImageDecoder,
+    ImageStore,
+    TwitchBadges,
+    TwitchEmotes,
+    fill_placeholder,
+)
+from .filters import DEDUPE_WINDOW, Collapsed, MessageFilter
+from .ingest import QUEUE_SIZE, RENDER_WORKERS, SKIP_OFFSCREEN, MessageQueue
+from .layout import (
+    Badge,
+    Counter,
+    Emote,
+    Line,
+    TextRun,
+    Username,
+    ends_word,
+    find_break,
+    parse_emote_index,
+    tokenize_message,
+)
+from .export import (
+    FrameExporter,
+    MjpegSink,
+    PipeSink,
+    SharedMemorySink,
+    rgba_surface,
+)
+from .metrics import Metrics, MetricsServer
+from .replay import ChatRecorder
+from .scrollback import SCROLLBACK_MB, SCROLLBACK_MESSAGES, Scrollback, ScrollRecord
+from .stats import LatencyStats
+from .worker import BADGE, COUNT, EMOTE, USERNAME, LayoutProcess
 
 logging.getLogger("PIL").setLevel(logging.WARNING)
 
-string_types = (str,)
 pygame.font = pygame.ftfont
 
 FONT_PATHS = ["FreeSans.ttf", "OpenSansEmoji.ttf", "Cyberbit.ttf", "unifont.ttf"]
@@ -30,6 +78,22 @@ BADGE_TYPES = [
 ]
 WIDTH = 0
 HEIGHT = 1
+TVSERVICE = "/opt/vc/bin/tvservice"
+RENDER_CACHE_MB = 8
+MAX_FPS = 30
+STATS_REPORT_INTERVAL = 60
+QUICKTEXT_FONT_SIZE = 72
+STATUS_FONT_SIZE = 48
+STATUS_COLOR = (255, 255, 255)
+OVERLAY_FONT_SIZE = 18
+OVERLAY_COLOR = (255, 255, 0)
+OVERLAY_BG_COLOR = (0, 0, 0)
+COLUMNS = "columns"
+ROWS = "rows"
+PANE_LAYOUTS = (COLUMNS, ROWS)
+PANE_GAP = 4
+PANE_DIVIDER_COLOR = (0x50, 0x4B, 0x66)
+CATCH_ALL = "*"
 
 TWITCH_COLORS = [
     "Blue",
@@ -55,102 +119,471 @@ def strip_unsupported_chars(msg):
 
 
 def turn_screen_off():
-    os.system("/opt/vc/bin/tvservice -o")
+    if os.path.exists(TVSERVICE):
+        os.system(f"{TVSERVICE} -o")
 
 
 def turn_screen_on():
-    os.system("/opt/vc/bin/tvservice -p ;fbset -depth 8; fbset -depth 16;")
+    if os.path.exists(TVSERVICE):
+        os.system(f"{TVSERVICE} -p ;fbset -depth 8; fbset -depth 16;")
+
+
+class Pane(object):
+    # a region of the screen with its own lines, for one channel or a group
+    # of them; only panes that got new lines or changed are redrawn
+    def __init__(self, channels=None):
+        if isinstance(channels, str):
+            channels = [channels]
+        self.channels = {str(c).lstrip("#").lower() for c in channels or ()}
+        self.rect = None
+        self.max_lines = 0
+        self.lines = []
+        self.new_line_count = 0
+        self.dirty = True
+        # lines from the scrollback while paging through it, None when live
+        self.history = None
+        self.scroll_start = None
+        self.scroll_end = None
+        # the lines as they were last drawn, bottom aligned in rect
+        self.drawn = []
+
+    @property
+    def shown(self):
+        return self.lines if self.history is None else self.history
+
+    def matches(self, channel, room_id=None):
+        return channel in self.channels or room_id in self.channels
+
+    def add_lines(self, lines):
+        self.lines.extend(lines)
+        self.lines = self.lines[-(self.max_lines) : len(self.lines)]
+        self.new_line_count += len(lines)
+
+    def __repr__(self):
+        return f"Pane({sorted(self.channels)!r}, {self.rect})"
+
+
+class StatusBar(object):
+    # viewer counts along the bottom of the screen, only re-rendered when a
+    # count actually changes
+    def __init__(self, font_path=FONT_PATHS[0], size=STATUS_FONT_SIZE):
+        self.font_path = font_path
+        self.size = size
+        self.counts = ()
+        self.surface = None
+
+    def update(self, viewers):
+        counts = tuple((name, count) for name, count in viewers.items() if count > 0)
+        if counts == self.counts:
+            return False
+        self.counts = counts
+        text = "".join(" {0} : {1}".format(name, count) for name, count in counts)
+        self.surface = None
+        if text:
+            font = get_font(self.font_path, self.size)
+            self.surface = font.render(text, True, STATUS_COLOR)
+        return True
+
+    def blit(self, surface, pos):
+        if self.surface is not None:
+            surface.blit(self.surface, pos)
 
 
 class ChatScreen(object):
-    def __init__(self, screen_width, screen_height, bg_color):
+    def __init__(
+        self,
+        screen_width,
+        screen_height,
+        bg_color,
+        max_fps=MAX_FPS,
+        flatten_lines=False,
+        panes=None,
+        pane_layout=COLUMNS,
+        offscreen=False,
+        exporter=None,
+    ):
+        if pane_layout not in PANE_LAYOUTS:
+            raise ValueError(
+                f"Unknown pane layout {pane_layout!r}, use one of {PANE_LAYOUTS}"
+            )
         self.logger = logging.getLogger(name=__name__)
-        if not pygame.display.get_init():
+        # offscreen there is no window at all, frames only go to the exporter
+        self.offscreen = offscreen
+        self.exporter = exporter
+        if offscreen:
+            pygame.font.init()
+        elif not pygame.display.get_init():
             turn_screen_on()
             pygame.init()
         self.standby_delay = 60 * 10
         self.bg_color = bg_color
-        self.lines = []
-        self.screen = pygame.display.set_mode((screen_width, screen_height))
+        self.panes = [Pane(group) for group in panes or [None]]
+        self.pane_layout = pane_layout
+        self.default_pane = next(
+            (pane for pane in self.panes if CATCH_ALL in pane.channels), self.panes[0]
+        )
+        if offscreen:
+            self.screen = rgba_surface((screen_width, screen_height))
+        else:
+            self.screen = pygame.display.set_mode((screen_width, screen_height))
         self.rect = pygame.Rect(self.screen.get_rect())
         self.rect.size = self.screen.get_size()
         self.size = self.screen.get_size()
         self.txt_layer = pygame.Surface(self.size)
-        self.idle_timer = Timer(self.standby_delay, self.disable_display)
+        self.last_activity = time.monotonic()
+        self.watchdog_stop = Event()
+        self.watchdog_thread = None
         self.changed = True
+        self.changed_at = time.monotonic()
+        self.full_repaint = True
+        self.status_bar = StatusBar()
+        self.viewers_changed = False
+        self.flatten_lines = flatten_lines
+        self.blit_count = 0
+        self.wakeup = Event()
+        self.frame_interval = 1.0 / max_fps
+        self.frame_latency = LatencyStats()
+        self.frame_time = LatencyStats()
+        self.message_latency = LatencyStats()
+        self.rendering = False
+        # lock guards lines/viewers, display_lock the surfaces and the display,
+        # image_lock the pixels of images drawn into while they are on screen.
+        # When nested they are taken display_lock first, then lock, then
+        # image_lock, never the other way round
         self.lock = Lock()
+        self.display_lock = Lock()
+        self.image_lock = Lock()
         self.viewers = {}
+        # callable returning lines of debug text to draw in the corner
+        self.overlay = None
+        # called after each frame is drawn
+        self.on_frame = None
+        self.overlay_font = None
+        self.overlay_rect = None
 
     def set_line_height(self, lheight):
         self.line_height = lheight
         self.max_lines = int((self.size[HEIGHT] / self.line_height) - 1)
+        self.layout_panes()
+
+    def resize(self, screen_width, screen_height):
+        with self.display_lock:
+            self.size = (screen_width, screen_height)
+            if self.offscreen:
+                self.screen = rgba_surface(self.size)
+            elif pygame.display.get_init():
+                self.screen = pygame.display.set_mode(self.size)
+            self.rect = pygame.Rect((0, 0), self.size)
+            self.txt_layer = pygame.Surface(self.size)
+            for pane in self.panes:
+                pane.drawn = []
+            with self.lock:
+                self.set_line_height(self.line_height)
+        self.request_repaint()
+
+    def layout_panes(self):
+        # the bottom line is the viewer bar, panes split the rest
+        count = len(self.panes)
+        gaps = PANE_GAP * (count - 1)
+        bar_top = self.size[HEIGHT] - self.line_height
+        if self.pane_layout == COLUMNS:
+            width = (self.size[WIDTH] - gaps) // count
+            for i, pane in enumerate(self.panes):
+                pane.rect = pygame.Rect(i * (width + PANE_GAP), 0, width, bar_top)
+                pane.max_lines = self.max_lines
+        else:
+            total = max(int((bar_top - gaps) / self.line_height), count)
+            top = bar_top - total * self.line_height - gaps
+            for i, pane in enumerate(self.panes):
+                pane.max_lines = total // count + (i < total % count)
+                height = pane.max_lines * self.line_height
+                pane.rect = pygame.Rect(0, top, self.size[WIDTH], height)
+                top += height + PANE_GAP
+            self.max_lines = total
+        if count > 1:
+            self.logger.info(f"Pane layout {self.panes}")
+
+    def pane_for(self, channel=None, room_id=None):
+        if len(self.panes) > 1 and channel is not None:
+            channel = channel.lstrip("#").lower()
+            for pane in self.panes:
+                if pane.matches(channel, room_id):
+                    return pane
+        return self.default_pane
+
+    @property
+    def lines(self):
+        if len(self.panes) == 1:
+            return self.panes[0].lines
+        return [line for pane in self.panes for line in pane.lines]
 
     def new_activity(self):
+        # called per message, so no locks or threads here: the render loop
+        # wakes the display and the watchdog reads last_activity
+        self.last_activity = time.monotonic()
+        if not self.changed:
+            self.changed_at = self.last_activity
+        self.changed = True
+        self.wakeup.set()
+
+    def idle(self):
+        return time.monotonic() - self.last_activity >= self.standby_delay
+
+    def idle_watchdog(self):
+        while not self.watchdog_stop.is_set():
+            remaining = self.last_activity + self.standby_delay - time.monotonic()
+            if remaining > 0:
+                self.watchdog_stop.wait(remaining)
+                continue
+            with self.display_lock:
+                if self.idle():
+                    self.disable_display()
+            # nothing to do until new activity, which can't expire sooner
+            self.watchdog_stop.wait(self.standby_delay)
+
+    def start_watchdog(self):
+        self.watchdog_stop.clear()
+        self.watchdog_thread = Thread(target=self.idle_watchdog)
+        self.watchdog_thread.daemon = True
+        self.watchdog_thread.start()
+
+    def stop_watchdog(self):
+        self.watchdog_stop.set()
+        if self.watchdog_thread and self.watchdog_thread.is_alive():
+            self.watchdog_thread.join()
+
+    def is_visible(self, line):
         with self.lock:
-            if self.idle_timer.is_alive():
-                self.idle_timer.cancel()
-            self.enable_display()
-            self.idle_timer = Timer(self.standby_delay, self.disable_display)
-            self.idle_timer.daemon = True
-            self.idle_timer.start()
-            self.changed = True
+            return any(visible is line for pane in self.panes for visible in pane.shown)
+
+    def show_history(self, pane, lines, start, end):
+        if self.flatten_lines:
+            for line in lines:
+                if line.surface is None:
+                    line.surface = self.flatten(line)
+        with self.lock:
+            pane.history = lines
+            pane.scroll_start = start
+            pane.scroll_end = end
+            pane.dirty = True
+        self.new_activity()
+
+    def show_live(self, pane, lines=None):
+        # lines replaces what the pane holds, after a re-layout
+        if lines is not None and self.flatten_lines:
+            for line in lines:
+                line.surface = self.flatten(line)
+        with self.lock:
+            pane.history = pane.scroll_start = pane.scroll_end = None
+            if lines is not None:
+                pane.lines = lines[-pane.max_lines :]
+            pane.dirty = True
+        self.new_activity()
 
-    def add_chatlines(self, lines):
+    def update_line(self, line, spans):
+        # composited before taking the lock render_frame snapshots under
+        flat = self.flatten(spans) if line.surface is not None else None
         with self.lock:
-            self.lines.extend(lines)
-            self.lines = self.lines[-(self.max_lines) : len(self.lines)]
+            line[:] = spans
+            if flat is not None:
+                line.surface = flat
+            for pane in self.panes:
+                if any(visible is line for visible in pane.shown):
+                    pane.dirty = True
         self.new_activity()
 
+    def pane_showing(self, line):
+        with self.lock:
+            for pane in self.panes:
+                if any(shown is line for shown in pane.shown):
+                    return pane
+        return None
+
+    def replace_line(self, line, lines):
+        # swaps one line for several, e.g. when it has to wrap again
+        lines = [new if isinstance(new, Line) else Line(new) for new in lines]
+        for new in lines:
+            new.received = line.received
+            if self.flatten_lines:
+                new.surface = self.flatten(new)
+        with self.lock:
+            for pane in self.panes:
+                for shown in (pane.lines, pane.history):
+                    if shown is None:
+                        continue
+                    for i, old in enumerate(shown):
+                        if old is line:
+                            shown[i : i + 1] = lines
+                            pane.dirty = True
+                            break
+                pane.lines = pane.lines[-(pane.max_lines) :]
+        self.new_activity()
+
+    def add_chatlines(self, lines, pane=None):
+        lines = [line if isinstance(line, Line) else Line(line) for line in lines]
+        if self.flatten_lines:
+            for line in lines:
+                line.surface = self.flatten(line)
+        with self.lock:
+            (pane or self.default_pane).add_lines(lines)
+        self.new_activity()
+
+    def image_loaded(self, placeholder, surface):
+        with self.display_lock, self.image_lock:
+            fill_placeholder(placeholder, surface)
+        with self.lock:
+            using = [
+                (pane, line, list(line))
+                for pane in self.panes
+                for line in pane.shown
+                if line.uses(placeholder)
+            ]
+            if not self.flatten_lines:
+                for pane, _, _ in using:
+                    pane.dirty = True
+        if self.flatten_lines and using:
+            flat = [self.flatten(spans) for _, _, spans in using]
+            with self.lock:
+                for (pane, line, spans), surface in zip(using, flat):
+                    # unless update_line changed it meanwhile, flattening it
+                    # again itself
+                    if len(line) == len(spans) and all(
+                        span is old for span, old in zip(line, spans)
+                    ):
+                        line.surface = surface
+                    pane.dirty = True
+        self.new_activity()
+
+    def flatten(self, line):
+        width = sum(span.width for span in line)
+        surface = pygame.Surface((max(width, 1), self.line_height))
+        surface.fill(self.bg_color)
+        # runs on render workers, without display_lock, while the Animator
+        # may be drawing the next frame into an emote on the line
+        with self.image_lock:
+            self.blit_line(line, surface, 0)
+        if pygame.display.get_init():
+            surface = surface.convert()
+        return surface
+
+    def surface_stats(self):
+        with self.lock:
+            lines = self.lines
+            flat = [line.surface for line in lines if line.surface is not None]
+        return {
+            "lines": len(lines),
+            "flat_lines": len(flat),
+            "flat_bytes": sum(surface_bytes(surface) for surface in flat),
+            "blits": self.blit_count,
+        }
+
     def blit_quicktext(self, text, color=(255, 255, 255)):
         self.new_activity()
-        font = pygame.font.Font("FreeSans.ttf", 72)
+        font = get_font(FONT_PATHS[0], QUICKTEXT_FONT_SIZE)
         surf = font.render(text, True, color)
-        self.txt_layer.fill(self.bg_color)
-        self.txt_layer.blit(
-            surf,
-            (
-                self.rect.width / 2 - surf.get_rect().width / 2,
-                self.rect.height / 2 - surf.get_rect().height / 2,
-                0,
-                0,
-            ),
-        )
-        self.screen.blit(self.txt_layer, self.rect)
-        pygame.display.update()
-
-    def blit_lines(self, lines, surface):
-        y_pos = self.size[HEIGHT] - (self.line_height * (len(lines) + 1))
-        viewerstring = ""
-        for name in self.viewers:
-            if self.viewers[name] > 0:
-                viewerstring = viewerstring + " {0} : {1}".format(
-                    name, self.viewers[name]
-                )
-        if viewerstring:
-            font = pygame.font.Font("FreeSans.ttf", 48)
-            surf = font.render(viewerstring, True, (255, 255, 255))
-            y = self.size[HEIGHT] - self.line_height
-            surface.blit(surf, (0, y, 0, 0))
+        with self.display_lock:
+            self.enable_display()
+            for pane in self.panes:
+                pane.drawn = []
+            self.txt_layer.fill(self.bg_color)
+            self.txt_layer.blit(
+                surf,
+                (
+                    self.rect.width / 2 - surf.get_rect().width / 2,
+                    self.rect.height / 2 - surf.get_rect().height / 2,
+                    0,
+                    0,
+                ),
+            )
+            self.screen.blit(self.txt_layer, self.rect)
+            self.update_display()
+        with self.lock:
+            self.full_repaint = True
+
+    def blit_lines(self, pane, lines, surface):
+        y_pos = pane.rect.bottom - self.line_height * len(lines)
+        surface.set_clip(pane.rect)
         for line in lines:
-            x_pos = 0
-            for part in line:
+            self.blit_line(line, surface, y_pos, pane.rect.x)
+            y_pos += self.line_height
+        surface.set_clip(None)
+
+    def blit_dividers(self, surface):
+        for pane in self.panes[1:]:
+            if self.pane_layout == COLUMNS:
+                rect = (pane.rect.x - PANE_GAP, 0, PANE_GAP, pane.rect.height)
+            else:
+                rect = (0, pane.rect.y - PANE_GAP, self.size[WIDTH], PANE_GAP)
+            surface.fill(PANE_DIVIDER_COLOR, rect)
+
+    def set_viewers(self, name, count):
+        # redraws the status bar, but isn't activity: it neither holds off
+        # standby nor wakes the display from it
+        with self.lock:
+            if self.viewers.get(name) == count:
+                return
+            self.viewers[name] = count
+            self.viewers_changed = True
+            if not self.changed:
+                self.changed_at = time.monotonic()
+            self.changed = True
+        self.wakeup.set()
+
+    def blit_line(self, line, surface, y_pos, x_pos=0):
+        if getattr(line, "surface", None) is not None:
+            surface.blit(line.surface, (x_pos, y_pos, 0, 0))
+            self.blit_count += 1
+            return
+        for span in line:
+            for part in span.parts:
                 surface.blit(part, (x_pos, y_pos, 0, 0))
                 x_pos += part.get_width()
+                self.blit_count += 1
+
+    def scroll_lines(self, pane, lines, new_count, surface):
+        # shift what is already drawn in the pane up by new_count lines and
+        # draw only the new ones underneath, returning the area that changed
+        area = pane.rect.copy()
+        top = area.bottom - self.line_height * len(lines)
+        surface.set_clip(area)
+        surface.scroll(0, -self.line_height * new_count)
+        surface.fill(self.bg_color, (area.x, area.y, area.width, top - area.y))
+        y_pos = area.bottom - self.line_height * new_count
+        surface.fill(self.bg_color, (area.x, y_pos, area.width, area.bottom - y_pos))
+        for line in lines[-new_count:]:
+            self.blit_line(line, surface, y_pos, area.x)
             y_pos += self.line_height
+        surface.set_clip(None)
+        if len(lines) < pane.max_lines:
+            area.height = area.bottom - top
+            area.top = top
+        return area
+
+    def viewers_area(self):
+        bar_top = self.size[HEIGHT] - self.line_height
+        return pygame.Rect(0, bar_top, self.size[WIDTH], self.line_height)
+
+    def request_repaint(self):
+        # render_frame reads and clears this under the lock, so a request
+        # made while it takes its snapshot is never lost
+        with self.lock:
+            self.full_repaint = True
+        self.new_activity()
 
     def start(self):
         self.new_activity()
+        if not self.offscreen:
+            self.start_watchdog()
         self.start_rendering()
 
     def stop(self):
-        turn_screen_on()
-        if self.idle_timer.is_alive():
-            self.idle_timer.cancel()
+        if not self.offscreen:
+            turn_screen_on()
+        self.stop_watchdog()
         if self.rendering:
-            self.rendering = False
-            if self.render_thread.is_alive():
-                self.render_thread.join()
+            self.stop_rendering()
         pygame.quit()
+        clear_fonts()
 
     def start_rendering(self):
         self.rendering = True
@@ -160,54 +593,238 @@ class ChatScreen(object):
 
     def stop_rendering(self):
         self.rendering = False
+        self.wakeup.set()
         if self.render_thread.is_alive():
             self.render_thread.join()
 
     def render_loop(self):
+        last_frame = 0.0
+        last_report = time.monotonic()
         while self.rendering:
-            time.sleep(0.1)
+            held = self.exporter.due() if self.exporter else None
+            if held is None:
+                self.wakeup.wait()
+            elif not self.wakeup.wait(max(held - time.monotonic(), 0)):
+                # a frame the exporter held back and nothing newer since
+                with self.display_lock:
+                    self.exporter.frame(self.screen)
+                continue
+            # anything arriving before the next frame slot joins this frame
+            delay = last_frame + self.frame_interval - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            self.wakeup.clear()
+            if not self.rendering:
+                break
+            last_frame = time.monotonic()
             if self.changed:
-                with self.lock:
-                    self.enable_display()
-                    self.txt_layer.fill(self.bg_color)
-                    self.blit_lines(self.lines, self.txt_layer)
-                    self.screen.blit(self.txt_layer, self.rect)
-                    pygame.display.update()
-                    self.changed = False
+                self.render_frame()
+            if last_frame - last_report > STATS_REPORT_INTERVAL:
+                last_report = last_frame
+                self.logger.debug(f"Frame latency {self.frame_latency.format()}")
+                self.logger.debug(f"Frame time {self.frame_time.format()}")
+                self.logger.debug(f"Message latency {self.message_latency.format()}")
+
+    def render_frame(self):
+        with self.lock:
+            if self.display_off() and self.idle():
+                # nothing but the viewer count changed since standby, it is
+                # drawn once something wakes the display
+                self.changed = False
+                return
+            full_repaint = self.full_repaint or self.display_off()
+            self.full_repaint = False
+            # quiet panes aren't even looked at
+            panes = [
+                (
+                    pane,
+                    list(pane.shown),
+                    pane.new_line_count if pane.history is None else 0,
+                    pane.dirty,
+                )
+                for pane in self.panes
+                if full_repaint or pane.dirty or pane.new_line_count
+            ]
+            viewers = dict(self.viewers) if self.viewers_changed else None
+            self.viewers_changed = False
+            changed_at = self.changed_at
+            self.changed = False
+            for pane in self.panes:
+                pane.new_line_count = 0
+                pane.dirty = False
+        started = time.monotonic()
+        with self.display_lock:
+            if self.enable_display() and not full_repaint:
+                # the display went to standby since the snapshot, which
+                # skipped the quiet panes, so draw everything next frame
+                self.request_repaint()
+            dirty = []
+            if full_repaint:
+                self.txt_layer.fill(self.bg_color)
+                self.blit_dividers(self.txt_layer)
+            for pane, lines, new_count, pane_dirty in panes:
+                if not (full_repaint or pane_dirty or new_count):
+                    continue
+                pane.drawn = lines
+                if full_repaint or pane_dirty or new_count >= len(lines):
+                    self.txt_layer.fill(self.bg_color, pane.rect)
+                    self.blit_lines(pane, lines, self.txt_layer)
+                    dirty.append(pane.rect)
+                else:
+                    dirty.append(
+                        self.scroll_lines(pane, lines, new_count, self.txt_layer)
+                    )
+            status_changed = viewers is not None and self.status_bar.update(viewers)
+            if status_changed or full_repaint:
+                dirty.append(self.viewers_area())
+                self.txt_layer.fill(self.bg_color, dirty[-1])
+                self.status_bar.blit(self.txt_layer, dirty[-1].topleft)
+            if full_repaint:
+                self.screen.blit(self.txt_layer, self.rect)
+                self.overlay_rect = None
+                if self.overlay:
+                    self.blit_overlay()
+                self.update_display()
+            else:
+                for rect in dirty:
+                    self.screen.blit(self.txt_layer, rect, rect)
+                if self.overlay:
+                    dirty.extend(self.blit_overlay())
+                self.update_display(dirty)
+        finished = time.monotonic()
+        if self.on_frame:
+            self.on_frame()
+        self.frame_time.add(finished - started)
+        self.frame_latency.add(finished - changed_at)
+        for _, lines, new_count, _ in panes:
+            for line in lines[-new_count:] if new_count else ():
+                if line.received is not None:
+                    self.message_latency.add(finished - line.received)
+
+    def visible_images(self, lookup):
+        # (surface, lookup(span), position, clipped rect) of each image span
+        # drawn on screen that lookup returns something for
+        images = []
+        for pane in self.panes:
+            y_pos = pane.rect.bottom - self.line_height * len(pane.drawn)
+            for line in pane.drawn:
+                x_pos = pane.rect.x
+                for span in line:
+                    value = lookup(span)
+                    if value is None:
+                        x_pos += span.width
+                        continue
+                    for part in span.parts:
+                        rect = part.get_rect(topleft=(x_pos, y_pos)).clip(pane.rect)
+                        if rect.width and rect.height:
+                            images.append((part, value, (x_pos, y_pos), rect))
+                        x_pos += part.get_width()
+                y_pos += self.line_height
+        return images
+
+    def repaint_images(self, images):
+        # draws (surface, position, clipped rect) over what is on screen
+        # without touching anything else; the caller holds display_lock
+        dirty = []
+        for surface, pos, rect in images:
+            self.txt_layer.fill(self.bg_color, rect)
+            self.txt_layer.set_clip(rect)
+            self.txt_layer.blit(surface, pos)
+            self.txt_layer.set_clip(None)
+            self.screen.blit(self.txt_layer, rect, rect)
+            dirty.append(rect)
+        if self.overlay_rect and self.overlay_rect.collidelist(dirty) != -1:
+            dirty.extend(self.blit_overlay())
+        self.update_display(dirty)
+
+    def update_display(self, rects=None):
+        if not self.offscreen:
+            if rects is None:
+                pygame.display.update()
+            else:
+                pygame.display.update(rects)
+        if self.exporter:
+            self.exporter.frame(self.screen)
+
+    def blit_overlay(self):
+        # drawn on the screen rather than txt_layer so it is never scrolled
+        # along with the chat; the old one is restored from txt_layer
+        dirty = []
+        if self.overlay_rect:
+            self.screen.blit(self.txt_layer, self.overlay_rect, self.overlay_rect)
+            dirty.append(self.overlay_rect)
+        if self.overlay_font is None:
+            self.overlay_font = get_font(FONT_PATHS[0], OVERLAY_FONT_SIZE)
+        surfs = [
+            self.overlay_font.render(text, True, OVERLAY_COLOR)
+            for text in self.overlay()
+        ]
+        if not surfs:
+            self.overlay_rect = None
+            return dirty
+        width = max(surf.get_width() for surf in surfs)
+        height = sum(surf.get_height() for surf in surfs)
+        rect = pygame.Rect(self.size[WIDTH] - width, 0, width, height)
+        self.screen.fill(OVERLAY_BG_COLOR, rect)
+        y_pos = 0
+        for surf in surfs:
+            self.screen.blit(surf, (rect.x, y_pos))
+            y_pos += surf.get_height()
+        self.overlay_rect = rect
+        dirty.append(rect)
+        return dirty
+
+    def display_off(self):
+        return not self.offscreen and not pygame.display.get_init()
 
     def enable_display(self):
-        if not pygame.display.get_init():
+        if self.display_off():
             turn_screen_on()
             pygame.display.init()
             self.screen = pygame.display.set_mode((self.size[WIDTH], self.size[HEIGHT]))
             self.rect = pygame.Rect(self.screen.get_rect())
+            return True
+        return False
 
     def disable_display(self):
-        if pygame.display.get_init():
+        if not self.offscreen and pygame.display.get_init():
             turn_screen_off()
             pygame.display.quit()
 
 
 class FontHelper(object):
-    def __init__(self):
+    def __init__(self, cache_dir=None):
         self.logger = logging.getLogger(name=__name__)
         self.logger.info("Fonthelper init")
         self.font_size = 48
         self.font_height = 0
         self.fonts = []
         self.bold_fonts = []
+        self.advances = {}
+        self.coverage = {False: FontCoverage(), True: FontCoverage()}
+        self.missing_codepoints = set()
+        self.coverage_cache = CoverageCache(cache_dir)
 
     def load_font(self, font_path, bold=False):
         self.logger.info("Loading font {0}".format(font_path))
-        pg_font = pygame.font.Font(font_path, self.font_size)
-        fontinfo = self.get_font_details(font_path)
+        started = time.perf_counter()
+        pg_font = get_font(font_path, self.font_size)
+        fontinfo, cached = self.coverage_cache.get(font_path, self.get_font_details)
+        self.advances[font_path] = {}
+        self.coverage[bold].add_font(fontinfo)
         if pg_font.get_linesize() > self.font_height:
             self.font_height = pg_font.get_linesize()
         if bold:
             self.bold_fonts.append((pg_font, fontinfo, font_path))
         else:
             self.fonts.append((pg_font, fontinfo, font_path))
-        self.logger.info("Loaded {0}".format(font_path))
+        self.logger.info(
+            "Loaded {0} in {1:.3f}s ({2} coverage cache)".format(
+                font_path,
+                time.perf_counter() - started,
+                "warm" if cached else "cold",
+            )
+        )
 
     def get_font_details(self, font_path):
         ttf = TTFont(
@@ -218,84 +835,373 @@ class FontHelper(object):
         finally:
             ttf.close()
 
-    def required_font(self, char, bold=False):
-        if bold:
-            fontlist = self.bold_fonts
-        else:
-            fontlist = self.fonts
+    def font_index(self, char, bold=False):
+        codepoint = ord(char)
         # probably dont need a crazy font for ascii range
-        if ord(char) > 128:
-            for font in fontlist:
-                if ord(char) in font[1]:
-                    return font
-            self.logger.critical(
-                "Couldn't find font for character {0}".format(repr(char))
-            )
-            return fontlist[0]
-        else:
-            return fontlist[0]
+        if codepoint <= 128:
+            return 0
+        index = self.coverage[bold].font_for(codepoint)
+        if index is None:
+            if codepoint not in self.missing_codepoints:
+                self.missing_codepoints.add(codepoint)
+                self.logger.warning(
+                    "Couldn't find font for character {0}".format(repr(char))
+                )
+            return 0
+        return index
+
+    def required_font(self, char, bold=False):
+        fontlist = self.bold_fonts if bold else self.fonts
+        return fontlist[self.font_index(char, bold)]
+
+    def segment(self, text, bold=False):
+        fontlist = self.bold_fonts if bold else self.fonts
+        runs = []
+        run_start = 0
+        current = 0
+        for i, char in enumerate(text):
+            index = self.font_index(char, bold)
+            if index != current:
+                if i > run_start:
+                    runs.append((fontlist[current], text[run_start:i]))
+                run_start = i
+                current = index
+        if run_start < len(text):
+            runs.append((fontlist[current], text[run_start:]))
+        return runs
+
+    def glyph_width(self, font, char):
+        advances = self.advances[font[2]]
+        try:
+            return advances[char]
+        except KeyError:
+            width = advances[char] = font[0].size(char)[WIDTH]
+            return width
+
+    def get_char_widths(self, text, bold=False):
+        widths = []
+        for font, run in self.segment(text, bold):
+            widths.extend(self.glyph_width(font, char) for char in run)
+        return widths
+
+    def get_prefix_widths(self, text, bold=False):
+        return [0, *accumulate(self.get_char_widths(text, bold))]
 
     def get_text_width(self, text, bold=False):
-        current_font = self.required_font("a", bold)
-        i = 0
-        total_width = 0
-        while i < len(text):
-            rq_font = self.required_font(text[i], bold)
-            if rq_font != current_font:
-                if text[:i]:
-                    width = current_font[0].size(text[:i])[WIDTH]
-                    total_width += width
-                    text = text[i:]
-                    i = 0
-                current_font = rq_font
-            else:
-                i += 1
-        width = current_font[0].size(text)[WIDTH]
-        total_width += width
-        return total_width
+        return sum(self.get_char_widths(text, bold))
+
+    def wrap(self, spans, maxwidth):
+        lines = []
+        line = []
+        line_width = 0
+        for span in spans:
+            if not isinstance(span, TextRun) or isinstance(span, Counter):
+                # a counter moves down whole rather than splitting at its space
+                if isinstance(span, Counter):
+                    width = self.get_text_width(span.text, span.bold)
+                else:
+                    width = span.width
+                if line and line_width + width > maxwidth:
+                    lines.append(line)
+                    line, line_width = [], 0
+                line.append(span)
+                line_width += width
+                continue
+            text = span.text
+            prefix = self.get_prefix_widths(text, span.bold)
+            start = 0
+            while start < len(text):
+                limit = prefix[start] + maxwidth - line_width
+                end = max(bisect_right(prefix, limit, lo=start) - 1, start)
+                if end == len(text):
+                    line.append(span.slice(start, end))
+                    line_width += prefix[end] - prefix[start]
+                    break
+                at_word_start = start == 0 and line and ends_word(line[-1])
+                cut, resume = find_break(text, start, end, at_word_start)
+                if cut == start and not line:
+                    cut = resume = max(end, start + 1)
+                if cut > start:
+                    line.append(span.slice(start, cut))
+                lines.append(line)
+                line, line_width = [], 0
+                start = resume
+        if line:
+            lines.append(line)
+        return lines
 
 
 class TwitchChatDisplay(object):
-    def __init__(self, screen_width, screen_height, client_id):
+    def __init__(
+        self,
+        screen_width,
+        screen_height,
+        client_id,
+        render_cache_mb=RENDER_CACHE_MB,
+        image_cache_mb=IMAGE_STORE_MB,
+        max_fps=MAX_FPS,
+        flatten_lines=False,
+        queue_size=QUEUE_SIZE,
+        overload_policy=SKIP_OFFSCREEN,
+        render_workers=RENDER_WORKERS,
+        banned_patterns=(),
+        dedupe_window=DEDUPE_WINDOW,
+        emote_source=TwitchEmotes,
+        badge_source=TwitchBadges,
+        record_path=None,
+        metrics_port=None,
+        debug_overlay=False,
+        memory_budget_mb=MEMORY_BUDGET_MB,
+        cache_ttl=MEMORY_TTL,
+        panes=None,
+        pane_layout=COLUMNS,
+        scrollback_messages=SCROLLBACK_MESSAGES,
+        scrollback_mb=SCROLLBACK_MB,
+        offscreen=False,
+        export_pipe=None,
+        export_shm=None,
+        export_mjpeg_port=None,
+        export_fps=None,
+        layout_process=False,
+        decode_processes=DECODE_PROCESSES,
+        animate_emotes=True,
+        animation_mb=ANIMATION_MB,
+        animation_fps=ANIMATION_FPS,
+        cache_dir=None,
+    ):
+        self.logger = logging.getLogger(name=__name__)
+        # with a layout process, chat arrives there and is recorded there
+        self.layout_process = None
+        self.layout_options = None
+        if layout_process:
+            self.layout_options = {
+                "banned_patterns": banned_patterns,
+                "dedupe_window": dedupe_window,
+                "record_path": record_path,
+                "cache_dir": cache_dir,
+            }
+            record_path = None
+        self.recorder = ChatRecorder(record_path) if record_path else None
+        # layout process messages by seq, for their duplicate counters
+        self.collapsed = OrderedDict()
+        self.dedupe_window = dedupe_window
         self.bg_color = [0x28, 0x25, 0x38]
         self.txt_color = [0xFF, 0xFF, 0xFF]
-        self.usercolors = {}
-        self.ignore_list = []
+        self.memory = MemoryManager(int(memory_budget_mb * 1024 * 1024), cache_ttl)
+        self.usercolors = self.memory.register("usercolors", ByteLRU())
+        self.message_filter = MessageFilter(
+            banned_patterns=banned_patterns, dedupe_window=dedupe_window
+        )
+        self.surface_cache = self.memory.register(
+            "render_cache", SurfaceCache(int(render_cache_mb * 1024 * 1024))
+        )
+        self.scrollback = None
+        if scrollback_messages:
+            self.scrollback = Scrollback(
+                self.layout_record,
+                scrollback_messages,
+                int(scrollback_mb * 1024 * 1024),
+                group=self.scrollback_group if panes and len(panes) > 1 else None,
+            )
 
         self.size = (screen_width, screen_height)
-        self.chatscreen = ChatScreen(screen_width, screen_height, self.bg_color)
-        self.font_helper = FontHelper()
-        for fontp in FONT_PATHS:
-            self.chatscreen.blit_quicktext(
-                "Loading font {0}".format(fontp), self.txt_color
-            )
-            self.font_helper.load_font(fontp)
-        for fontp in BOLD_FONT_PATHS:
+        self.exporter = None
+        sinks = []
+        if export_pipe:
+            sinks.append(PipeSink(export_pipe))
+        if export_shm:
+            sinks.append(SharedMemorySink(export_shm, self.size))
+        if export_mjpeg_port:
+            sinks.append(MjpegSink(export_mjpeg_port))
+        if sinks:
+            self.exporter = FrameExporter(sinks, export_fps or max_fps)
+        self.chatscreen = ChatScreen(
+            screen_width,
+            screen_height,
+            self.bg_color,
+            max_fps=max_fps,
+            flatten_lines=flatten_lines,
+            panes=panes,
+            pane_layout=pane_layout,
+            offscreen=offscreen,
+            exporter=self.exporter,
+        )
+        self.font_helper = FontHelper(cache_dir)
+        for fontp in FONT_PATHS + BOLD_FONT_PATHS:
+            if not os.path.exists(fontp):
+                self.logger.warning(f"Font {fontp} not found, skipping it")
+                continue
             self.chatscreen.blit_quicktext(
                 "Loading font {0}".format(fontp), self.txt_color
             )
-            self.font_helper.load_font(fontp, bold=True)
+            self.font_helper.load_font(fontp, bold=fontp in BOLD_FONT_PATHS)
 
         self.chatscreen.set_line_height(self.font_helper.font_height)
-        self.twitch_badges = TwitchBadges(
-            height=self.font_helper.font_height, client_id=client_id
+        image_store = None
+        if image_cache_mb:
+            image_store = ImageStore(
+                cache_dir, max_bytes=int(image_cache_mb * 1024 * 1024)
+            )
+        self.atlas = None
+        if flatten_lines:
+            self.atlas = ImageAtlas(self.font_helper.font_height)
+        self.decoder = ImageDecoder(
+            decode_processes,
+            animate=animate_emotes,
+            animation_bytes=int(animation_mb * 1024 * 1024),
+        )
+        self.twitch_badges = badge_source(
+            height=self.font_helper.font_height,
+            client_id=client_id,
+            on_loaded=self.chatscreen.image_loaded,
+            store=image_store,
+            atlas=self.atlas,
+            decoder=self.decoder,
         )
-        self.twitch_emotes = TwitchEmotes(
-            height=self.font_helper.font_height, client_id=client_id
+        self.twitch_emotes = emote_source(
+            height=self.font_helper.font_height,
+            client_id=client_id,
+            on_loaded=self.chatscreen.image_loaded,
+            store=image_store,
+            atlas=self.atlas,
+            decoder=self.decoder,
         )
+        self.memory.register("decoded", self.decoder.images)
+        self.memory.register("animations", self.decoder.animations)
+        self.memory.register("emotes", self.twitch_emotes.images)
+        self.memory.register("badges", self.twitch_badges.images)
+        if hasattr(self.twitch_badges, "badge_map"):
+            self.memory.register("badge_map", self.twitch_badges.badge_map)
+        self.animator = None
+        if animate_emotes:
+            self.animator = Animator(
+                self.chatscreen, self.emote_animation, animation_fps
+            )
+            self.chatscreen.on_frame = self.animator.wake
+        self.metrics = None
+        self.metrics_server = None
+        if metrics_port or debug_overlay:
+            self.enable_metrics(metrics_port, debug_overlay)
+        self.message_queue = None
+        if queue_size and not layout_process:
+            self.message_queue = MessageQueue(
+                self.render_collapsible,
+                self.commit_lines,
+                capacity=queue_size,
+                policy=overload_policy,
+                workers=render_workers,
+                visible=self.queued_pane,
+            )
+            if self.metrics:
+                self.metrics.add_source("queue", self.message_queue.stats)
+
+    def enable_metrics(self, metrics_port=None, debug_overlay=False):
+        # runs before the message queue exists, so it picks up the timed
+        # add_chatlines
+        self.metrics = Metrics()
+        for stage in ("render_prepends", "render_emotes", "wraptext", "render_text"):
+            self.metrics.instrument(self, stage)
+        self.metrics.instrument(self.chatscreen, "add_chatlines")
+        self.metrics.instrument(self.chatscreen, "render_frame", "frame")
+        self.metrics.instrument(self.chatscreen, "update_display", "display.update")
+        self.metrics.instrument(self.twitch_emotes, "load_from_url", "emote_fetch")
+        self.metrics.instrument(self.twitch_badges, "load_from_url", "badge_fetch")
+        self.metrics.instrument(self.decoder, "decode", "image_decode")
+        self.metrics.add_latency("frame_latency", self.chatscreen.frame_latency)
+        self.metrics.add_latency("message_latency", self.chatscreen.message_latency)
+        self.metrics.add_source("render_cache", self.surface_cache.stats)
+        self.metrics.add_source("emotes", self.twitch_emotes.stats)
+        self.metrics.add_source("badges", self.twitch_badges.stats)
+        self.metrics.add_source("decoder", self.decoder.stats)
+        if self.animator:
+            self.metrics.add_source("animator", self.animator.stats)
+        self.metrics.add_source("filter", self.message_filter.stats)
+        self.metrics.add_source("screen", self.chatscreen.surface_stats)
+        self.metrics.add_source("memory", self.memory.stats)
+        if self.scrollback is not None:
+            self.metrics.add_source("scrollback", self.scrollback.stats)
+        if self.exporter:
+            for sink in self.exporter.sinks:
+                if isinstance(sink, PipeSink):
+                    self.metrics.add_source("export_pipe", sink.stats)
+                elif isinstance(sink, MjpegSink):
+                    self.metrics.add_source("export_mjpeg", sink.stats)
+        if metrics_port:
+            self.metrics_server = MetricsServer(self.metrics, metrics_port)
+        if debug_overlay:
+            self.chatscreen.overlay = self.metrics.overlay_lines
 
     def ignore_user(self, username):
-        self.ignore_list.append(username)
+        self.message_filter.ignore_user(username)
+        if self.layout_process:
+            self.layout_process.ignore_user(username)
+
+    def emote_animation(self, span):
+        if isinstance(span, Emote):
+            return self.twitch_emotes.animation(span.emote_id)
+        return None
+
+    def pane_geometry(self):
+        return [
+            (sorted(pane.channels), pane.rect.width, pane.max_lines)
+            for pane in self.chatscreen.panes
+        ]
+
+    def start_layout_process(self, source, verbosity=0):
+        # source is a picklable callable returning a twitch_chat like object;
+        # it is created in the worker, which then lays out everything it
+        # sends and passes the result back through shared memory
+        fonts = [
+            (fontp, fontp in BOLD_FONT_PATHS)
+            for fontp in FONT_PATHS + BOLD_FONT_PATHS
+            if os.path.exists(fontp)
+        ]
+        options = dict(
+            self.layout_options,
+            fonts=fonts,
+            panes=self.pane_geometry(),
+            ignored_users=sorted(self.message_filter.ignored_users),
+            source=source,
+        )
+        self.layout_process = LayoutProcess(self.commit_layout, options, verbosity)
+        if self.metrics:
+            self.metrics.add_source("layout_ring", self.layout_process.stats)
+        self.layout_process.start()
 
     def start(self):
+        self.memory.start()
+        if self.metrics_server:
+            self.metrics_server.start()
         self.chatscreen.start()
+        if self.animator:
+            self.animator.start()
+        if self.message_queue:
+            self.message_queue.start()
         msg = [
-            self.render_text("Loading complete. Waiting for messages..", self.txt_color)
+            self.render_line(
+                [TextRun("Loading complete. Waiting for messages..", self.txt_color)]
+            )
         ]
         self.chatscreen.add_chatlines(msg)
 
     def stop(self):
+        if self.layout_process:
+            self.layout_process.stop()
+        if self.message_queue:
+            self.message_queue.stop()
+        if self.animator:
+            self.animator.stop()
+        self.twitch_emotes.close()
+        self.twitch_badges.close()
+        self.decoder.close()
+        if self.recorder:
+            self.recorder.close()
+        if self.metrics_server:
+            self.metrics_server.stop()
+        self.memory.stop()
         self.chatscreen.stop()
+        if self.exporter:
+            self.exporter.close()
 
     def display_message(self, text):
         self.chatscreen.blit_quicktext(text, self.txt_color)
@@ -309,20 +1215,204 @@ class TwitchChatDisplay(object):
                 int(usercolor[4:], 16),
             )
             return hexcolor
-        elif username not in self.usercolors:
-            self.usercolors[username] = webcolors.name_to_rgb(
-                random.choice(TWITCH_COLORS)
+        color = self.usercolors.lookup(username)
+        if color is MISSING:
+            color = self.usercolors.insert(
+                username, webcolors.name_to_rgb(random.choice(TWITCH_COLORS))
             )
-        return self.usercolors[username]
+        return color
 
     def new_twitchmessage(self, result):
-        if result["username"] not in self.ignore_list:
-            new_lines = self.render_new_twitchmessage(result)
-            self.chatscreen.add_chatlines(new_lines)
+        received = time.monotonic()
+        if self.recorder:
+            self.recorder.record(result)
+        record = self.message_filter.check(result, self.chatscreen.is_visible)
+        if record is None:
+            return
+        if self.scrollback is not None and record.count == 1:
+            record.history = self.scrollback.append(ScrollRecord(result))
+        item = (result, record, received)
+        if record.count > 1:
+            self.update_counter(record)
+        elif self.message_queue:
+            self.message_queue.put(item)
+        else:
+            self.commit_lines(self.render_collapsible(item))
+
+    def queued_pane(self, item):
+        message = item[0]
+        pane = self.chatscreen.pane_for(message["channel"], message["room-id"])
+        return pane, pane.max_lines
+
+    def render_collapsible(self, item):
+        message, record, received = item
+        pane = self.chatscreen.pane_for(message["channel"], message["room-id"])
+        lines = self.render_new_twitchmessage(message, pane.rect.width)
+        for line in lines:
+            line.received = received
+        record.lines = lines
+        return pane, lines, record
+
+    def commit_lines(self, result):
+        pane, lines, record = result
+        self.chatscreen.add_chatlines(lines, pane)
+        record.committed = True
+
+    def commit_layout(self, record):
+        if record[0] == COUNT:
+            _, seq, count = record
+            collapsed = self.collapsed.get(seq)
+            if collapsed is not None:
+                collapsed.count = count
+                self.update_counter(collapsed)
+            return
+        _, seq, pane_index, received, message, lines = record
+        collapsed = Collapsed(seq)
+        if self.scrollback is not None:
+            collapsed.history = self.scrollback.append(ScrollRecord(message))
+        collapsed.lines = self.render_layout(message, lines)
+        for line in collapsed.lines:
+            line.received = received
+        self.collapsed[seq] = collapsed
+        while len(self.collapsed) > max(self.dedupe_window, 1):
+            self.collapsed.popitem(last=False)
+        self.commit_lines(
+            (self.chatscreen.panes[pane_index], collapsed.lines, collapsed)
+        )
+
+    def render_layout(self, message, lines):
+        # spans as laid out by the layout process, only needing their glyphs
+        # and images
+        ucolor = self.get_usercolor(message["username"], message["color"])
+        rendered = []
+        for line in lines:
+            spans = []
+            for kind, text, *extra in line:
+                if kind == BADGE:
+                    surface = self.twitch_badges.get(
+                        channel_id=message["room-id"], badge_type=text
+                    )
+                    spans.append(Badge(surface, text))
+                elif kind == EMOTE:
+                    emote_id = extra[0]
+                    surface = self.twitch_emotes.get(emote_id)
+                    spans.append(Emote(surface, emote_id, text))
+                elif kind == USERNAME:
+                    spans.append(Username(text, ucolor))
+                else:
+                    spans.append(TextRun(text, self.txt_color))
+            rendered.append(self.render_line(spans))
+        return rendered
+
+    def update_counter(self, record):
+        if record.history:
+            record.history.count = record.count
+        if not record.lines:
+            return
+        line = record.lines[-1]
+        spans = [span for span in line if not isinstance(span, Counter)]
+        spans.append(Counter(" ×{0}".format(record.count), self.txt_color))
+        # a longer counter can push the line past the pane's width
+        pane = self.chatscreen.pane_showing(line) or self.chatscreen.default_pane
+        lines = [
+            self.render_line(wrapped)
+            for wrapped in self.wraptext(spans, pane.rect.width)
+        ]
+        if len(lines) == 1:
+            self.chatscreen.update_line(line, lines[0])
+        else:
+            self.chatscreen.replace_line(line, lines)
+            record.lines[-1:] = lines
+
+    def layout_key(self, pane):
+        # anything that changes how a message wraps or looks
+        return (pane.rect.width, self.font_helper.font_height)
+
+    def layout_record(self, record, layout_key):
+        width, _ = layout_key
+        return self.render_new_twitchmessage(record.message(), width, record.count)
+
+    def page_up(self):
+        if self.scrollback is None:
+            return
+        for pane in self.chatscreen.panes:
+            end = pane.scroll_start
+            if pane.history is None:
+                # the live view is the newest page already
+                _, end = self.scrollback.page(
+                    self.scrollback.end,
+                    pane.max_lines,
+                    self.layout_key(pane),
+                    self.pane_group(pane),
+                )
+            self.show_page(pane, end)
+
+    def page_down(self):
+        for pane in self.chatscreen.panes:
+            if pane.history is None:
+                continue
+            end = self.scrollback.page_end(
+                pane.scroll_end,
+                pane.max_lines,
+                self.layout_key(pane),
+                self.pane_group(pane),
+            )
+            if end >= self.scrollback.end:
+                self.chatscreen.show_live(pane)
+            else:
+                self.show_page(pane, end)
+
+    def scroll_to_live(self):
+        for pane in self.chatscreen.panes:
+            if pane.history is not None:
+                self.chatscreen.show_live(pane)
+
+    def show_page(self, pane, end):
+        lines, start = self.scrollback.page(
+            end, pane.max_lines, self.layout_key(pane), self.pane_group(pane)
+        )
+        if lines:
+            self.chatscreen.show_history(pane, lines, start, end)
+
+    def scrollback_group(self, record):
+        pane = self.chatscreen.pane_for(record.channel, record.room_id)
+        return self.chatscreen.panes.index(pane)
+
+    def pane_group(self, pane):
+        if len(self.chatscreen.panes) == 1:
+            return None
+        return self.chatscreen.panes.index(pane)
+
+    def handle_key(self, key):
+        if key == pygame.K_PAGEUP:
+            self.page_up()
+        elif key == pygame.K_PAGEDOWN:
+            self.page_down()
+        elif key in (pygame.K_END, pygame.K_ESCAPE):
+            self.scroll_to_live()
+
+    def resize(self, screen_width, screen_height):
+        # lay the live view out again from the scrollback, so the history
+        # survives the new width
+        self.size = (screen_width, screen_height)
+        self.chatscreen.resize(screen_width, screen_height)
+        if self.layout_process:
+            self.layout_process.set_panes(self.pane_geometry())
+        if self.scrollback is None:
+            return
+        self.scrollback.invalidate()
+        for pane in self.chatscreen.panes:
+            lines, _ = self.scrollback.page(
+                self.scrollback.end,
+                pane.max_lines,
+                self.layout_key(pane),
+                self.pane_group(pane),
+            )
+            self.chatscreen.show_live(pane, lines)
 
     def new_usernotice(self, args):
         message = args["system-msg"].replace("\\s", " ")
-        new_line = self.render_text(message, self.txt_color)
+        new_line = self.render_line([TextRun(message, self.txt_color)])
         self.chatscreen.add_chatlines([new_line])
 
     def new_followers(self, new_followers, name, total):
@@ -330,7 +1420,7 @@ class TwitchChatDisplay(object):
         self.chatscreen.add_chatlines(new_lines)
 
     def new_viewers(self, viewercount, name):
-        self.chatscreen.viewers[name] = viewercount
+        self.chatscreen.set_viewers(name, viewercount)
 
     def render_new_subscriber(self, channel, subscriber, months):
         if months == 0:
@@ -339,132 +1429,62 @@ class TwitchChatDisplay(object):
             text = " {0} subscribed to {1} for {2} months in a row! ".format(
                 subscriber, channel, months
             )
-        rendered = self.render_text(text, self.txt_color)
-        return rendered
+        return self.render_line([TextRun(text, self.txt_color)])
 
     def render_emotes(self, text, emotes):
-        if emotes:
-            emotelist = emotes.split("/")
-            emoteindxs = self.generate_emoteindex(emotelist)
-            rendered = self.insert_emotesurfs(text, emoteindxs)
-            return rendered
-        else:
-            return list(text)
-
-    def generate_emoteindex(self, emotelist):
-        emoteindxs = {}
-        for emoteinfo in emotelist:
-            emote_id, indexes = emoteinfo.split(":")
-            index_rgx = r"(\d*)-(\d*)"
-            results = re.findall(index_rgx, indexes)
-            for indexes in results:
-                emoteindxs[int(indexes[0])] = (int(indexes[1]), emote_id)
-        return emoteindxs
-
-    def insert_emotesurfs(self, text, emoteindxs):
-        rendered = []
-        i = 0
-        while i < len(text):
-            if i in emoteindxs:
-                start_index = i
-                end_index, emote_id = emoteindxs[start_index]
-                emote = self.twitch_emotes.get(emote_id)
-                if emote:
-                    rendered.append(emote)
-                else:
-                    rendered.append(text[i : end_index + 1])
-                i = end_index + 1
-            else:
-                rendered.append(text[i])
-                i += 1
-        return rendered
+        return tokenize_message(
+            text, parse_emote_index(emotes), self.txt_color, self.twitch_emotes.get
+        )
 
     def render_prepends(self, badges, channel, room_id):
         prepends = []
         if badges:
             for badge in badges.split(","):
-                prepends.append(
-                    self.twitch_badges.get(channel_id=room_id, badge_type=badge)
-                )
+                surface = self.twitch_badges.get(channel_id=room_id, badge_type=badge)
+                if surface:
+                    prepends.append(Badge(surface, badge))
         return prepends
 
-    def render_new_twitchmessage(self, message):
+    def render_new_twitchmessage(self, message, maxwidth=None, count=1):
         try:
-            rendered_line = self.render_prepends(
+            spans = self.render_prepends(
                 message["badges"], message["channel"], message["room-id"]
             )
         except Exception:
             self.logger.exception(f"Error rendering prepends for {message}")
-            rendered_line = []
+            spans = []
         ucolor = self.get_usercolor(message["username"], message["color"])
-        rendered_line.extend(
-            self.render_text(
-                message["display-name"] or message["username"], ucolor, bold=True
-            )
-        )
-        rendered_line.extend(self.render_text(" : ", self.txt_color))
-        rendered_line.extend(self.render_emotes(message["message"], message["emotes"]))
-        wrapped_lines = self.wraptext(rendered_line, self.size[WIDTH])
-        new_lines = []
-        for wrapped_line in wrapped_lines:
-            new_lines.append(self.render_text(wrapped_line, self.txt_color))
-        return new_lines
-
-    def wraptext(self, text, maxwidth):
-        lines = []
-        cut_i = len(text) - 1
-        while text:
-            width = self.get_list_rendered_length(text[: cut_i + 1])
-            if width > maxwidth:
-                cut_i -= 1
-            else:
-                if text[: cut_i + 1]:
-                    lines.append(text[: cut_i + 1])
-                    text = text[cut_i + 1 :]
-                else:
-                    lines.append(text[: cut_i + 2])
-                    text = text[cut_i + 2 :]
-                if text:
-                    cut_i = len(text) - 1
-        return lines
+        spans.append(Username(message["display-name"] or message["username"], ucolor))
+        spans.append(TextRun(" : ", self.txt_color))
+        spans.extend(self.render_emotes(message["message"], message["emotes"]))
+        if count > 1:
+            spans.append(Counter(" ×{0}".format(count), self.txt_color))
+        wrapped_lines = self.wraptext(spans, maxwidth or self.size[WIDTH])
+        return [self.render_line(wrapped_line) for wrapped_line in wrapped_lines]
 
-    def get_list_rendered_length(self, target_list):
-        width = 0
-        for item in target_list:
-            if isinstance(item, string_types):
-                width += self.font_helper.get_text_width(item)
-            else:
-                width += item.get_width()
-        return width
+    def wraptext(self, spans, maxwidth):
+        return self.font_helper.wrap(spans, maxwidth)
+
+    def render_line(self, spans, aa=True):
+        for span in spans:
+            if isinstance(span, TextRun):
+                span.parts = tuple(
+                    self.render_text(span.text, span.color, aa, span.bold)
+                )
+        return Line(spans)
 
     def render_text(self, text, color, aa=True, bold=False):
         surfaces = []
-        if isinstance(text, list):
-            for item in text:
-                surfaces.extend(self.render_text(item, color, aa))
-        elif isinstance(text, string_types):
-            current_font = self.font_helper.required_font("a", bold)
-            i = 0
-            while i < len(text):
-                rq_font = self.font_helper.required_font(text[i], bold)
-                if rq_font != current_font:
-                    if text[:i]:
-                        part = current_font[0].render(text[:i], aa, color)
-                        surfaces.append(part)
-                        text = text[i:]
-                        i = 0
-                    current_font = rq_font
-                else:
-                    i += 1
+        for font, run in self.font_helper.segment(text, bold):
+            key = (run, font[2], aa, tuple(color))
             try:
-                part = current_font[0].render(text, aa, color)
-                surfaces.append(part)
+                surfaces.append(
+                    self.surface_cache.get(key, lambda: font[0].render(run, aa, color))
+                )
             except UnicodeError as e:
                 if (
                     str(e)
                     == "A Unicode character above '\uFFFF' was found; not supported"
                 ):
                     pass
-        else:
-            return [text]
         return surfaces
@@ -0,0 +1,338 @@
+import errno
+import logging
+import os
+import struct
+import sys
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from multiprocessing import shared_memory
+from threading import Condition, Thread
+
+import pygame
+from PIL import Image
+
+EXPORT_HOST = "127.0.0.1"
+SHM_SLOTS = 3
+SHM_MAGIC = b"TCDF"
+# magic, version, width, height, stride, slots, newest frame number
+SHM_HEADER = struct.Struct("<4sIIIIIQ")
+# frame number, written once the slot's pixels are complete
+SHM_SLOT_HEADER = struct.Struct("<Q")
+JPEG_QUALITY = 80
+MJPEG_BOUNDARY = "frame"
+if sys.byteorder == "little":
+    RGBA_MASKS = (0xFF, 0xFF00, 0xFF0000, 0xFF000000)
+else:
+    RGBA_MASKS = (0xFF000000, 0xFF0000, 0xFF00, 0xFF)
+
+
+def rgba_surface(size):
+    # pixels laid out as R, G, B, A bytes, so the raw buffer is RGBA as is
+    surface = pygame.Surface(size, pygame.SRCALPHA, 32, RGBA_MASKS)
+    surface.fill((0, 0, 0, 255))
+    return surface
+
+
+def is_rgba(surface):
+    return (
+        surface.get_bytesize() == 4
+        and surface.get_masks() == RGBA_MASKS
+        and surface.get_pitch() == surface.get_width() * 4
+    )
+
+
+class PipeSink(object):
+    # raw RGBA frames back to back, e.g. for
+    # ffmpeg -f rawvideo -pix_fmt rgba -s WxH -i <path>
+    # The render thread only copies the frame into a single slot, a writer
+    # thread drains it into the pipe. A frame that arrives while the last one
+    # is still waiting replaces it, so a slow reader misses frames instead of
+    # stalling the display
+    def __init__(self, path):
+        self.logger = logging.getLogger(name=__name__)
+        self.path = path
+        self.fd = None
+        self.pending = None
+        self.running = True
+        self.ready = Condition()
+        self.written = 0
+        self.dropped = 0
+        self.thread = Thread(target=self.run, name="export-pipe")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def open(self):
+        if self.path == "-":
+            return sys.stdout.fileno()
+        try:
+            # a fifo without a reader fails here instead of waiting for one,
+            # frames are simply dropped until one shows up
+            fd = os.open(self.path, os.O_WRONLY | os.O_NONBLOCK | os.O_CREAT, 0o644)
+        except OSError as e:
+            if e.errno != errno.ENXIO:
+                self.logger.exception(f"Couldn't open {self.path}")
+            return None
+        # only the writer thread waits on it
+        os.set_blocking(fd, True)
+        self.logger.info(f"Exporting frames to {self.path}")
+        return fd
+
+    def send(self, pixels, size):
+        frame = bytes(memoryview(pixels))
+        with self.ready:
+            if self.pending is not None:
+                self.dropped += 1
+            self.pending = frame
+            self.ready.notify()
+
+    def run(self):
+        while True:
+            with self.ready:
+                while self.running and self.pending is None:
+                    self.ready.wait()
+                if not self.running:
+                    return
+                frame, self.pending = self.pending, None
+            self.write(frame)
+
+    def write(self, frame):
+        if self.fd is None:
+            self.fd = self.open()
+            if self.fd is None:
+                with self.ready:
+                    self.dropped += 1
+                return
+        try:
+            view = memoryview(frame)
+            while view:
+                view = view[os.write(self.fd, view) :]
+            with self.ready:
+                self.written += 1
+        except BrokenPipeError:
+            self.logger.info(f"Reader of {self.path} went away")
+            with self.ready:
+                self.dropped += 1
+            self.close_fd()
+
+    def close_fd(self):
+        if self.fd is not None and self.path != "-":
+            os.close(self.fd)
+        self.fd = None
+
+    def stats(self):
+        with self.ready:
+            return {"written": self.written, "dropped": self.dropped}
+
+    def close(self):
+        with self.ready:
+            self.running = False
+            self.ready.notify()
+        self.thread.join(timeout=1)
+        if not self.thread.is_alive():
+            # otherwise it is stuck writing to a reader that stopped reading,
+            # and the fd goes with the process
+            self.close_fd()
+
+
+class SharedMemorySink(object):
+    # the last few frames in a shared memory ring, readable by mapping
+    # /dev/shm/<name>. Readers take the newest frame number from the header,
+    # copy slot number % slots, and keep the copy if the slot still carries
+    # that number afterwards
+    def __init__(self, name, size, slots=SHM_SLOTS):
+        self.logger = logging.getLogger(name=__name__)
+        width, height = size
+        self.size = tuple(size)
+        self.frame_bytes = width * height * 4
+        self.slot_bytes = SHM_SLOT_HEADER.size + self.frame_bytes
+        self.slots = slots
+        total = SHM_HEADER.size + slots * self.slot_bytes
+        try:
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=total)
+        except FileExistsError:
+            # left behind by a previous run that didn't shut down cleanly
+            shared_memory.SharedMemory(name=name).unlink()
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=total)
+        self.frame = 0
+        SHM_HEADER.pack_into(
+            self.shm.buf, 0, SHM_MAGIC, 1, width, height, width * 4, slots, 0
+        )
+        self.logger.info(f"Exporting frames to shared memory {name}")
+
+    def send(self, pixels, size):
+        if tuple(size) != self.size:
+            # readers size their mapping from the header, a resize can't be
+            # followed without pulling it out from under them
+            return
+        self.frame += 1
+        offset = SHM_HEADER.size + (self.frame % self.slots) * self.slot_bytes
+        start = offset + SHM_SLOT_HEADER.size
+        SHM_SLOT_HEADER.pack_into(self.shm.buf, offset, 0)
+        self.shm.buf[start : start + self.frame_bytes] = memoryview(pixels).cast("B")
+        SHM_SLOT_HEADER.pack_into(self.shm.buf, offset, self.frame)
+        struct.pack_into("<Q", self.shm.buf, SHM_HEADER.size - 8, self.frame)
+
+    def close(self):
+        self.shm.close()
+        self.shm.unlink()
+
+
+class MjpegHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        sink = self.server.sink
+        self.send_response(200)
+        self.send_header(
+            "Content-Type", f"multipart/x-mixed-replace; boundary={MJPEG_BOUNDARY}"
+        )
+        self.end_headers()
+        frame = None
+        with sink.new_frame:
+            sink.clients += 1
+        try:
+            while sink.running:
+                with sink.new_frame:
+                    while sink.running and sink.jpeg is frame:
+                        sink.new_frame.wait()
+                    frame = sink.jpeg
+                if frame is None:
+                    continue
+                self.wfile.write(
+                    f"--{MJPEG_BOUNDARY}\r\nContent-Type: image/jpeg\r\n"
+                    f"Content-Length: {len(frame)}\r\n\r\n".encode()
+                )
+                self.wfile.write(frame)
+                self.wfile.write(b"\r\n")
+        except OSError:
+            pass
+        finally:
+            with sink.new_frame:
+                sink.clients -= 1
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MjpegSink(object):
+    # frames are only encoded while someone is watching, on a thread of their
+    # own. Like PipeSink, the render thread only copies the frame into a
+    # single slot and a newer frame replaces one still waiting
+    def __init__(self, port, host=EXPORT_HOST, quality=JPEG_QUALITY):
+        self.logger = logging.getLogger(name=__name__)
+        self.quality = quality
+        self.jpeg = None
+        self.clients = 0
+        self.running = True
+        self.new_frame = Condition()
+        self.pending = None
+        self.ready = Condition()
+        self.encoded = 0
+        self.dropped = 0
+        self.server = ThreadingHTTPServer((host, port), MjpegHandler)
+        self.server.daemon_threads = True
+        self.server.sink = self
+        self.encoder = Thread(target=self.run, name="mjpeg-encode")
+        self.encoder.daemon = True
+        self.encoder.start()
+        self.thread = Thread(target=self.server.serve_forever, name="mjpeg")
+        self.thread.daemon = True
+        self.thread.start()
+        self.logger.info(f"Serving MJPEG on http://{host}:{port}/")
+
+    def send(self, pixels, size):
+        if not self.clients:
+            return
+        frame = (bytes(memoryview(pixels)), tuple(size))
+        with self.ready:
+            if self.pending is not None:
+                self.dropped += 1
+            self.pending = frame
+            self.ready.notify()
+
+    def encode(self, pixels, size):
+        image = Image.frombuffer("RGBA", size, pixels, "raw", "RGBA", 0, 1)
+        out = BytesIO()
+        image.convert("RGB").save(out, "JPEG", quality=self.quality)
+        return out.getvalue()
+
+    def run(self):
+        while True:
+            with self.ready:
+                while self.running and self.pending is None:
+                    self.ready.wait()
+                if not self.running:
+                    return
+                (pixels, size), self.pending = self.pending, None
+            try:
+                jpeg = self.encode(pixels, size)
+            except Exception:
+                self.logger.exception("Error encoding MJPEG frame")
+                continue
+            with self.new_frame:
+                self.jpeg = jpeg
+                self.new_frame.notify_all()
+            with self.ready:
+                self.encoded += 1
+
+    def stats(self):
+        with self.ready:
+            return {
+                "clients": self.clients,
+                "encoded": self.encoded,
+                "dropped": self.dropped,
+            }
+
+    def close(self):
+        with self.ready:
+            self.running = False
+            self.ready.notify()
+        self.encoder.join(timeout=1)
+        with self.new_frame:
+            self.running = False
+            self.new_frame.notify_all()
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class FrameExporter(object):
+    # hands every frame the screen draws to the sinks, straight from the
+    # surface's pixel buffer. Frames closer together than 1/fps are held
+    # back and the newest one is sent once the interval has passed
+    def __init__(self, sinks, fps):
+        self.logger = logging.getLogger(name=__name__)
+        self.sinks = sinks
+        self.interval = 1.0 / fps if fps else 0
+        self.last_frame = 0.0
+        self.held = False
+        self.staging = None
+
+    def due(self):
+        return self.last_frame + self.interval if self.held else None
+
+    def frame(self, surface):
+        now = time.monotonic()
+        if now - self.last_frame < self.interval:
+            self.held = True
+            return
+        self.last_frame = now
+        self.held = False
+        if not is_rgba(surface):
+            # the display's own format, e.g. 16 bit on a Pi framebuffer
+            if self.staging is None or self.staging.get_size() != surface.get_size():
+                self.staging = rgba_surface(surface.get_size())
+            self.staging.blit(surface, (0, 0))
+            surface = self.staging
+        pixels = surface.get_view("0")
+        try:
+            for sink in self.sinks:
+                try:
+                    sink.send(pixels, surface.get_size())
+                except Exception:
+                    self.logger.exception(f"Error exporting frame to {sink}")
+        finally:
+            # the surface stays locked while a view of it exists
+            del pixels
+
+    def close(self):
+        for sink in self.sinks:
+            sink.close()
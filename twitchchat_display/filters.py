@@ -0,0 +1,82 @@
+import re
+from collections import deque
+from threading import Lock
+
+DEDUPE_WINDOW = 50
+NON_WORD_RGX = re.compile(r"[\W_]+")
+REPEAT_RGX = re.compile(r"(.)\1+")
+
+
+def compile_patterns(patterns):
+    if not patterns:
+        return None
+    return re.compile("|".join(f"(?:{p})" for p in patterns), re.IGNORECASE)
+
+
+def normalize(text):
+    # near duplicates: case, punctuation, spacing and stretched letters
+    # ("LULLLLLL") don't make a copypasta any less of a copypasta
+    key = NON_WORD_RGX.sub(" ", text.lower()).strip()
+    key = REPEAT_RGX.sub(r"\1", key)
+    return key or text
+
+
+class Collapsed(object):
+    __slots__ = ("key", "count", "lines", "history", "committed")
+
+    def __init__(self, key):
+        self.key = key
+        self.count = 1
+        self.lines = None
+        self.history = None
+        # set once the lines reach the screen; a message the queue dropped or
+        # failed to render never gets there and takes no duplicates
+        self.committed = False
+
+
+class MessageFilter(object):
+    def __init__(
+        self, ignored_users=(), banned_patterns=(), dedupe_window=DEDUPE_WINDOW
+    ):
+        self.ignored_users = {username.lower() for username in ignored_users}
+        self.banned = compile_patterns(banned_patterns)
+        self.dedupe_window = dedupe_window
+        self.window = deque()
+        self.recent = {}
+        self.lock = Lock()
+        self.counters = {"ignored": 0, "banned": 0, "collapsed": 0, "passed": 0}
+
+    def ignore_user(self, username):
+        self.ignored_users.add(username.lower())
+
+    def check(self, message, is_visible):
+        # returns None to drop the message, otherwise its Collapsed record;
+        # a count above 1 means it folded into a line already shown
+        if message["username"].lower() in self.ignored_users:
+            self.counters["ignored"] += 1
+            return None
+        if self.banned and self.banned.search(message["message"]):
+            self.counters["banned"] += 1
+            return None
+        if not self.dedupe_window:
+            self.counters["passed"] += 1
+            return Collapsed(None)
+        # the same text in another channel is a different conversation
+        key = (message.get("channel"), normalize(message["message"]))
+        with self.lock:
+            record = self.recent.get(key)
+            if record and record.committed and is_visible(record.lines[-1]):
+                record.count += 1
+                self.counters["collapsed"] += 1
+                return record
+            record = self.recent[key] = Collapsed(key)
+            self.window.append(record)
+            if len(self.window) > self.dedupe_window:
+                expired = self.window.popleft()
+                if self.recent.get(expired.key) is expired:
+                    del self.recent[expired.key]
+            self.counters["passed"] += 1
+            return record
+
+    def stats(self):
+        return dict(self.counters)
@@ -0,0 +1,154 @@
+import hashlib
+import logging
+import mmap
+import os
+from array import array
+from bisect import bisect_right
+from heapq import merge
+from pathlib import Path
+from threading import Lock
+
+import pygame
+
+from .config import CACHE_DIR
+
+COVERAGE_CACHE_VERSION = 1
+# every pygame Font opened so far, by (path, size)
+FONTS = {}
+FONTS_LOCK = Lock()
+
+
+def get_font(path, size):
+    # opening a font reads and parses the whole file, so share one per size
+    key = (str(path), size)
+    with FONTS_LOCK:
+        font = FONTS.get(key)
+        if font is None:
+            font = FONTS[key] = pygame.font.Font(str(path), size)
+        return font
+
+
+def clear_fonts():
+    # fonts don't survive pygame.quit()
+    with FONTS_LOCK:
+        FONTS.clear()
+
+
+def to_ranges(codepoints):
+    # flat [start0, end0, start1, end1, ...] of inclusive codepoint ranges
+    ranges = array("I")
+    for codepoint in sorted(codepoints):
+        if ranges and ranges[-1] == codepoint - 1:
+            ranges[-1] = codepoint
+        else:
+            ranges.extend((codepoint, codepoint))
+    return ranges
+
+
+def iter_ranges(ranges):
+    return zip(ranges[::2], ranges[1::2])
+
+
+def file_digest(path):
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class CoverageCache(object):
+    def __init__(self, cache_dir=None):
+        self.logger = logging.getLogger(name=__name__)
+        self.cache_dir = Path(cache_dir or CACHE_DIR) / "fonts"
+
+    def path_for(self, font_path):
+        digest = file_digest(font_path)
+        return self.cache_dir / f"{digest}.v{COVERAGE_CACHE_VERSION}.ranges"
+
+    def get(self, font_path, build):
+        cache_path = self.path_for(font_path)
+        ranges = self.load(cache_path)
+        if ranges is not None:
+            return ranges, True
+        ranges = to_ranges(build(font_path))
+        self.store(cache_path, ranges)
+        return ranges, False
+
+    def load(self, cache_path):
+        try:
+            with open(cache_path, "rb") as f:
+                if os.fstat(f.fileno()).st_size == 0:
+                    return array("I")
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError):
+            self.logger.exception(f"Unreadable font coverage cache {cache_path}")
+            return None
+        return memoryview(mapped).cast("I")
+
+    def store(self, cache_path, ranges):
+        tmp_path = cache_path.with_suffix(".tmp")
+        try:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            with open(tmp_path, "wb") as f:
+                ranges.tofile(f)
+            os.replace(tmp_path, cache_path)
+        except OSError:
+            self.logger.exception(f"Couldn't write font coverage cache {cache_path}")
+
+
+class FontCoverage(object):
+    def __init__(self):
+        self.font_ranges = []
+        self.starts = []
+        self.ends = []
+        self.font_indexes = []
+        self.lookup = {}
+
+    def add_font(self, ranges):
+        self.font_ranges.append(ranges)
+        self.build()
+
+    def build(self):
+        # sweep every font's ranges at once; earlier fonts win where they overlap
+        events = merge(
+            *(
+                [
+                    (pos, index)
+                    for start, end in iter_ranges(ranges)
+                    for pos in (start, end + 1)
+                ]
+                for index, ranges in enumerate(self.font_ranges)
+            )
+        )
+        active = [False] * len(self.font_ranges)
+        starts, ends, font_indexes = [], [], []
+        prev_pos = None
+        for pos, index in events:
+            if prev_pos is not None and pos > prev_pos and True in active:
+                winner = active.index(True)
+                extends = font_indexes and font_indexes[-1] == winner
+                if extends and ends[-1] == prev_pos - 1:
+                    ends[-1] = pos - 1
+                else:
+                    starts.append(prev_pos)
+                    ends.append(pos - 1)
+                    font_indexes.append(winner)
+            active[index] = not active[index]
+            prev_pos = pos
+        self.starts, self.ends, self.font_indexes = starts, ends, font_indexes
+        self.lookup = {}
+
+    def font_for(self, codepoint):
+        try:
+            return self.lookup[codepoint]
+        except KeyError:
+            i = bisect_right(self.starts, codepoint) - 1
+            if i >= 0 and codepoint <= self.ends[i]:
+                index = self.font_indexes[i]
+            else:
+                index = None
+            self.lookup[codepoint] = index
+            return index
@@ -1,67 +1,691 @@
-from functools import lru_cache
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import weakref
+from bisect import bisect_right
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
 from io import BytesIO
+from itertools import accumulate
+from pathlib import Path
+from threading import Lock, RLock
 
 import pygame
 import requests
+from PIL import Image, ImageSequence
+
+from .cache import MISSING, ByteLRU, surface_bytes
+from .config import CACHE_DIR
+
+FETCH_WORKERS = 4
+# 0 decodes on the fetch threads
+DECODE_PROCESSES = 0
+IMAGE_CACHE_SIZE = 1000
+DECODED_CACHE_SIZE = 500
+ANIMATION_MB = 32
+# gif delays this short are treated as 100ms, as browsers do
+MIN_FRAME_MS = 20
+DEFAULT_FRAME_MS = 100
+IMAGE_STORE_MB = 64
+PLACEHOLDER_COLOR = (255, 255, 255, 40)
+ATLAS_PAGE_WIDTH = 1024
+ATLAS_ROWS = 4
+NOT_MODIFIED = object()
+
+
+def write_atomic(path, data):
+    tmp_path = path.with_suffix(".tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def unlink(path):
+    try:
+        path.unlink()
+    except FileNotFoundError:
+        pass
+
+
+class ImageStore(object):
+    # scaled images as raw RGBA blobs named by content hash, plus a small json
+    # record per image key pointing at its blob and HTTP validators
+    def __init__(self, cache_dir=None, max_bytes=IMAGE_STORE_MB * 1024 * 1024):
+        self.logger = logging.getLogger(name=__name__)
+        root = Path(cache_dir or CACHE_DIR) / "images"
+        self.meta_dir = root / "meta"
+        self.blob_dir = root / "blobs"
+        self.max_bytes = max_bytes
+        self.lock = Lock()
+        # what is on disk is read once, then tracked here: blob -> size with
+        # the least recently used first, and which meta files use each blob
+        self.blobs = None
+        self.blob_metas = {}
+        self.meta_blobs = {}
+        self.current_bytes = 0
+
+    def meta_path(self, key):
+        return self.meta_dir / (hashlib.sha1(key.encode()).hexdigest() + ".json")
+
+    def index(self):
+        # called with the lock held
+        if self.blobs is not None:
+            return
+        self.blobs = OrderedDict()
+        blobs = []
+        for path in self.blob_dir.glob("*.rgba"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            blobs.append((stat.st_mtime, path.name, stat.st_size))
+        for _, name, size in sorted(blobs):
+            self.blobs[name] = size
+            self.current_bytes += size
+        for path in self.meta_dir.glob("*.json"):
+            try:
+                blob = json.loads(path.read_text())["blob"]
+            except (OSError, ValueError, KeyError):
+                blob = None
+            if blob in self.blobs:
+                self.link(path.name, blob)
+            else:
+                unlink(path)
+
+    def link(self, meta_name, blob):
+        old = self.meta_blobs.get(meta_name)
+        if old is not None:
+            self.blob_metas[old].discard(meta_name)
+        self.meta_blobs[meta_name] = blob
+        self.blob_metas.setdefault(blob, set()).add(meta_name)
+
+    def load(self, key):
+        with self.lock:
+            self.index()
+        try:
+            meta = json.loads(self.meta_path(key).read_text())
+            blob_path = self.blob_dir / meta["blob"]
+            data = bytearray(blob_path.read_bytes())
+            # the next run picks up the order from the mtimes
+            os.utime(blob_path)
+        except FileNotFoundError:
+            return None, None
+        except (OSError, ValueError, KeyError):
+            self.logger.exception(f"Unreadable image cache entry {key}")
+            return None, None
+        with self.lock:
+            if meta["blob"] in self.blobs:
+                self.blobs.move_to_end(meta["blob"])
+        size = (meta["width"], meta["height"])
+        if len(data) != size[0] * size[1] * 4:
+            return None, None
+        return pygame.image.frombuffer(data, size, "RGBA"), meta
+
+    def save(self, key, surface, etag=None, last_modified=None):
+        data = pygame.image.tostring(surface, "RGBA")
+        blob = hashlib.sha1(data).hexdigest() + ".rgba"
+        meta = {
+            "blob": blob,
+            "width": surface.get_width(),
+            "height": surface.get_height(),
+            "etag": etag,
+            "last_modified": last_modified,
+        }
+        try:
+            with self.lock:
+                self.index()
+                self.meta_dir.mkdir(parents=True, exist_ok=True)
+                self.blob_dir.mkdir(parents=True, exist_ok=True)
+                if blob in self.blobs:
+                    self.blobs.move_to_end(blob)
+                else:
+                    write_atomic(self.blob_dir / blob, data)
+                    self.blobs[blob] = len(data)
+                    self.current_bytes += len(data)
+                meta_path = self.meta_path(key)
+                write_atomic(meta_path, json.dumps(meta).encode())
+                self.link(meta_path.name, blob)
+                if self.current_bytes > self.max_bytes:
+                    self.trim()
+        except OSError:
+            self.logger.exception(f"Couldn't write image cache entry {key}")
+
+    def trim(self):
+        # oldest blobs first, each along with the meta files pointing at it
+        while self.blobs and self.current_bytes > self.max_bytes:
+            blob, size = self.blobs.popitem(last=False)
+            self.current_bytes -= size
+            unlink(self.blob_dir / blob)
+            for meta_name in self.blob_metas.pop(blob, ()):
+                del self.meta_blobs[meta_name]
+                unlink(self.meta_dir / meta_name)
+
+
+class ImageAtlas(object):
+    # emotes and badges share a few large pages, packed into rows of the
+    # image height, so each image exists once and is referenced by rect. A
+    # slot is only reused once nothing holds its subsurface any more: no
+    # cache, pending fetch or line, flattened or not, in a pane or the
+    # scrollback
+    def __init__(self, row_height, page_width=ATLAS_PAGE_WIDTH, page_rows=ATLAS_ROWS):
+        self.logger = logging.getLogger(name=__name__)
+        self.row_height = row_height
+        self.page_size = (page_width, row_height * page_rows)
+        self.pages = []
+        self.cursor = None
+        self.free = []
+        # the finalizer of a collected slot may run while this is held
+        self.lock = RLock()
+
+    @property
+    def bytes(self):
+        return sum(page.get_pitch() * page.get_height() for page in self.pages)
+
+    def new_page(self):
+        page = pygame.Surface(self.page_size, pygame.SRCALPHA)
+        if pygame.display.get_init():
+            page = page.convert_alpha()
+        page.fill((0, 0, 0, 0))
+        self.pages.append(page)
+        self.cursor = [page, 0, 0]
+
+    def alloc(self, size):
+        width, height = size
+        if width > self.page_size[0] or height > self.row_height:
+            surface = pygame.Surface(size, pygame.SRCALPHA)
+            surface.fill((0, 0, 0, 0))
+            return surface
+        with self.lock:
+            for i, (page, rect) in enumerate(self.free):
+                if rect.size == size:
+                    del self.free[i]
+                    break
+            else:
+                if self.cursor is None:
+                    self.new_page()
+                page, x, y = self.cursor
+                if x + width > self.page_size[0]:
+                    x, y = 0, y + self.row_height
+                    if y + self.row_height > self.page_size[1]:
+                        self.new_page()
+                        page, x, y = self.cursor
+                self.cursor = [page, x + width, y]
+                rect = pygame.Rect(x, y, width, height)
+            slot = page.subsurface(rect)
+        weakref.finalize(slot, self.release, page, rect)
+        return slot
+
+    def add(self, surface):
+        slot = self.alloc(surface.get_size())
+        slot.fill((0, 0, 0, 0))
+        slot.blit(surface, (0, 0), special_flags=pygame.BLEND_RGBA_ADD)
+        return slot
+
+    def release(self, page, rect):
+        # called when a slot's subsurface is collected. Handing the same rect
+        # out twice would draw two images over each other
+        with self.lock:
+            if any(free is page and rect == free_rect for free, free_rect in self.free):
+                self.logger.warning(f"Atlas slot {rect} released twice")
+                return
+            self.free.append((page, rect))
+
+
+def prepare(surface):
+    # converting to the display's format needs the display, so it only ever
+    # happens in the display process
+    if not pygame.display.get_init():
+        return surface
+    return surface.convert_alpha()
+
+
+def scale_image(data, height):
+    surface = pygame.image.load(BytesIO(data))
+    if surface.get_bitsize() < 24:
+        # smoothscale only takes 24 and 32 bit surfaces; a blit keeps the
+        # colorkey of paletted images as transparency
+        rgba = pygame.Surface(surface.get_size(), pygame.SRCALPHA, 32)
+        rgba.fill((0, 0, 0, 0))
+        rgba.blit(surface, (0, 0))
+        surface = rgba
+    size = (max(1, round(surface.get_width() * height / surface.get_height())), height)
+    if size == surface.get_size():
+        return surface
+    return pygame.transform.smoothscale(surface, size)
+
+
+def decode_frames(data, height):
+    # every frame of an animated image scaled to height, as (RGBA bytes,
+    # size, seconds shown); None for a still image
+    image = Image.open(BytesIO(data))
+    if not getattr(image, "is_animated", False):
+        return None
+    frames = []
+    for frame in ImageSequence.Iterator(image):
+        rgba = frame.convert("RGBA")
+        size = (max(1, round(rgba.width * height / rgba.height)), height)
+        if size != rgba.size:
+            rgba = rgba.resize(size, Image.LANCZOS)
+        delay = frame.info.get("duration") or 0
+        if delay < MIN_FRAME_MS:
+            delay = DEFAULT_FRAME_MS
+        frames.append((rgba.tobytes(), size, delay / 1000))
+    return frames
+
+
+def decode_pixels(data, height, animate=True):
+    # runs in a decode process, only plain RGBA bytes come back
+    frames = decode_frames(data, height) if animate else None
+    if frames is None:
+        surface = scale_image(data, height)
+        frames = [(pygame.image.tostring(surface, "RGBA"), surface.get_size(), 0)]
+    return frames
+
+
+class Animation(object):
+    # the frames of an animated image, shared by every copy of it on screen
+    __slots__ = ("frames", "ends", "duration")
+
+    def __init__(self, frames, delays):
+        self.frames = frames
+        self.ends = list(accumulate(delays))
+        self.duration = self.ends[-1]
+
+    @property
+    def bytes(self):
+        return sum(surface_bytes(frame) for frame in self.frames)
+
+    def frame_at(self, clock):
+        # the frame showing clock seconds in, and how long until the next
+        position = clock % self.duration
+        index = bisect_right(self.ends, position)
+        return index, self.ends[index] - position
+
+
+class ImageDecoder(object):
+    # decodes and smoothly scales downloaded images once per url and height,
+    # however many keys share them (every channel's copy of a global badge),
+    # either on the fetch thread asking or in a pool of processes
+    def __init__(
+        self,
+        processes=DECODE_PROCESSES,
+        max_entries=DECODED_CACHE_SIZE,
+        animate=True,
+        animation_bytes=ANIMATION_MB * 1024 * 1024,
+    ):
+        self.logger = logging.getLogger(name=__name__)
+        self.pool = None
+        if processes:
+            self.pool = ProcessPoolExecutor(
+                processes, mp_context=multiprocessing.get_context("spawn")
+            )
+        # surfaces in images; whoever else caches one of them counts it as free
+        self.cached = weakref.WeakSet()
+        self.images = ByteLRU(
+            max_entries=max_entries, sizeof=image_bytes, on_evict=self.cached.discard
+        )
+        self.animate = animate
+        self.animations = ByteLRU(
+            max_bytes=animation_bytes, sizeof=lambda animation: animation.bytes
+        )
+        self.pending = {}
+        self.lock = Lock()
+
+    def lookup(self, url, height):
+        surface = self.images.lookup((url, height))
+        return None if surface is MISSING else surface
+
+    def animation(self, url, height):
+        animation = self.animations.lookup((url, height))
+        return None if animation is MISSING else animation
+
+    def owns(self, surface):
+        return surface in self.cached
+
+    def forget(self, url, height):
+        self.images.remove((url, height))
+        self.animations.remove((url, height))
+
+    def decode(self, url, data, height):
+        key = (url, height)
+        with self.lock:
+            surface = self.images.lookup(key)
+            if surface is not MISSING:
+                return surface
+            waiting = self.pending.get(key)
+            if waiting is None:
+                future = self.pending[key] = Future()
+        if waiting is not None:
+            return waiting.result()
+        try:
+            if self.pool:
+                frames = self.pool.submit(
+                    decode_pixels, data, height, self.animate
+                ).result()
+            else:
+                frames = decode_frames(data, height) if self.animate else None
+            if frames is None:
+                surfaces = [scale_image(data, height)]
+            else:
+                # wraps the bytes that came back from the process as they are
+                surfaces = [
+                    pygame.image.frombuffer(pixels, size, "RGBA")
+                    for pixels, size, _ in frames
+                ]
+            surfaces = [prepare(surface) for surface in surfaces]
+            surface = surfaces[0]
+            if len(surfaces) > 1:
+                delays = [delay for _, _, delay in frames]
+                self.animations.insert(key, Animation(surfaces, delays))
+                # what's on screen gets each frame drawn into it in turn, so
+                # it can't be one of the frames
+                surface = surface.copy()
+            surface = self.images.insert(key, surface)
+            self.cached.add(surface)
+            future.set_result(surface)
+            return surface
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                del self.pending[key]
+
+    def stats(self):
+        stats = self.images.stats()
+        stats["pending"] = len(self.pending)
+        stats["animations"] = len(self.animations)
+        stats["animation_bytes"] = self.animations.current_bytes
+        return stats
+
+    def close(self):
+        if self.pool:
+            self.pool.shutdown(wait=False)
+
+
+def validators(meta):
+    headers = {}
+    if meta:
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+    return headers
 
 
 class ChatImage:
-    def __init__(self, client_id, height=16):
+    # whether animated images are left for the Animator to play
+    ANIMATED = False
+
+    def __init__(
+        self,
+        client_id,
+        height=16,
+        workers=FETCH_WORKERS,
+        on_loaded=None,
+        store=None,
+        atlas=None,
+        decoder=None,
+    ):
+        self.logger = logging.getLogger(name=__name__)
         self.session = requests.Session()
         self.session.headers["Client-ID"] = client_id
         self.session.headers["Accept"] = "application/vnd.twitchtv.v5+json"
         self.img_height = height
+        self.on_loaded = on_loaded
+        self.pool = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix=self.__class__.__name__
+        )
+        self.lock = Lock()
+        self.images = ByteLRU(max_entries=IMAGE_CACHE_SIZE, sizeof=image_bytes)
+        self.pending = {}
+        # key -> the placeholder lines got before its stored copy was shown
+        self.revalidating = {}
+        self.store = store
+        self.atlas = atlas
+        self.decoder = decoder or ImageDecoder()
+        # keys of animated images -> their decoder key, kept as long as the
+        # images themselves would be
+        self.animated = ByteLRU(max_entries=IMAGE_CACHE_SIZE)
+
+    def close(self):
+        self.pool.shutdown(wait=False)
+
+    def decode(self, url, data):
+        return self.decoder.decode(url, data, self.img_height)
+
+    def find_animation(self, key, url, surface):
+        # the decoder hands out one surface per animated image, which the
+        # Animator draws each frame into; anything not animated gets a copy
+        # of the first frame instead. Returns the surface and whether it is
+        # animated
+        animation = self.decoder.animation(url, self.img_height)
+        if animation is None:
+            return surface, False
+        if not self.ANIMATED or key is None:
+            return animation.frames[0].copy(), False
+        self.animated.insert(key, (url, self.img_height))
+        return surface, True
+
+    def animation(self, key):
+        decoded = self.animated.lookup(key, None)
+        if decoded is None:
+            return None
+        animation = self.decoder.animation(*decoded)
+        if animation is None:
+            # its frames were evicted, so the image is fetched and decoded
+            # again the next time it is needed rather than left frozen
+            self.animated.remove(key)
+            self.decoder.forget(*decoded)
+            with self.lock:
+                self.images.remove(key)
+        return animation
+
+    def prepare(self, surface):
+        return prepare(surface)
+
+    def store_key(self, key):
+        return f"{self.__class__.__name__}/{key}/{self.img_height}"
+
+    def cache_image(self, key, surface, shown=None):
+        # shown is whatever callers were handed while the image was pending;
+        # atlas slots that end up unused are freed once nothing holds them
+        size = None
+        if self.atlas and surface is not None:
+            if shown is not None and shown.get_size() == surface.get_size():
+                surface = shown
+            else:
+                surface = self.atlas.add(surface)
+        elif surface is not None and self.decoder.owns(surface):
+            # the decoder's cache already counts these pixels
+            size = 0
+        return self.images.insert(key, surface, size)
+
+    def stats(self):
+        stats = self.images.stats()
+        stats["pending"] = len(self.pending)
+        return stats
 
-    def load_from_url(self, url):
-        resp = self.session.get(url)
-        f = BytesIO(resp.content)
-        surface = pygame.image.load(f)
-        ratio = self.img_height / float(surface.get_height())
-        new_size = (int(surface.get_width() * ratio), self.img_height)
-        resized = pygame.transform.scale(surface, new_size)
-        if not pygame.display.get_init():
-            return resized
+    def placeholder(self):
+        size = (self.img_height, self.img_height)
+        if self.atlas:
+            surface = self.atlas.alloc(size)
         else:
-            return resized.convert_alpha()
+            surface = pygame.Surface(size, pygame.SRCALPHA)
+        surface.fill(PLACEHOLDER_COLOR)
+        return surface
+
+    def fetch(self, key, resolve_url):
+        # returns the cached image, or a placeholder shared by every caller
+        # until the single in-flight download for this key completes
+        with self.lock:
+            surface = self.images.lookup(key)
+            if surface is not MISSING:
+                return surface
+            if key in self.pending:
+                return self.pending[key]
+            surface = self.pending[key] = self.placeholder()
+        self.pool.submit(self._fetch, key, resolve_url)
+        return surface
+
+    def _fetch(self, key, resolve_url):
+        # images found in the on-disk store are shown first and revalidated
+        meta = None
+        if self.store:
+            stored, meta = self.store.load(self.store_key(key))
+            if stored is not None:
+                self.loaded(key, self.prepare(stored), revalidating=True)
+        failed = False
+        try:
+            url = resolve_url()
+            surface = self.load_from_url(url, key, meta) if url else None
+        except Exception:
+            self.logger.exception(f"Error fetching image {key}")
+            surface = None
+            failed = True
+        if meta and (failed or surface is NOT_MODIFIED):
+            # keep showing the stored copy
+            with self.lock:
+                del self.pending[key]
+                self.revalidating.pop(key, None)
+            return
+        self.loaded(key, surface, failed=failed)
+
+    def loaded(self, key, surface, failed=False, revalidating=False):
+        with self.lock:
+            target = self.pending[key]
+            placeholder = None if revalidating else self.revalidating.pop(key, None)
+        # lines laid out before the stored copy was shown hold the placeholder,
+        # those since then the stored copy; a fresh copy is drawn into both
+        targets = [target]
+        if placeholder is not None and placeholder is not target:
+            targets.append(placeholder)
+        for shown in targets:
+            if self.on_loaded:
+                self.on_loaded(shown, surface)
+            else:
+                fill_placeholder(shown, surface)
+        with self.lock:
+            if revalidating:
+                self.revalidating[key] = target
+                self.pending[key] = self.cache_image(key, surface, target)
+                return
+            del self.pending[key]
+            # failed downloads are retried the next time the image is needed
+            if not failed:
+                self.cache_image(key, surface, target)
+
+    def load_from_url(self, url, key=None, meta=None):
+        if not meta:
+            # another key already fetched the same image
+            surface = self.decoder.lookup(url, self.img_height)
+            if surface is not None:
+                return self.find_animation(key, url, surface)[0]
+        resp = self.session.get(url, headers=validators(meta))
+        if resp.status_code == 304:
+            return NOT_MODIFIED
+        if resp.status_code == 404:
+            return None
+        resp.raise_for_status()
+        surface, animated = self.find_animation(
+            key, url, self.decode(url, resp.content)
+        )
+        if animated:
+            # the store holds a single frame, so these are always downloaded
+            return surface
+        if self.store and key is not None:
+            self.store.save(
+                self.store_key(key),
+                surface,
+                resp.headers.get("ETag"),
+                resp.headers.get("Last-Modified"),
+            )
+        return surface
+
+
+def image_bytes(surface):
+    return surface_bytes(surface) if surface is not None else 0
+
+
+def json_bytes(value):
+    return len(json.dumps(value))
+
+
+def fill_placeholder(placeholder, surface):
+    placeholder.fill((0, 0, 0, 0))
+    if surface is None:
+        return
+    box = placeholder.get_rect()
+    if surface.get_width() > box.width or surface.get_height() > box.height:
+        ratio = min(box.width / surface.get_width(), box.height / surface.get_height())
+        surface = pygame.transform.smoothscale(
+            surface,
+            (
+                max(1, int(surface.get_width() * ratio)),
+                max(1, int(surface.get_height() * ratio)),
+            ),
+        )
+    placeholder.blit(surface, surface.get_rect(center=box.center))
 
 
 class TwitchEmotes(ChatImage):
-    def __init__(self, client_id, height):
-        super().__init__(client_id=client_id, height=height)
-        result = self.session.get("https://api.twitch.tv/kraken/chat/emoticons").json()
-        self.emote_map = {str(e["id"]): e["images"]["url"] for e in result["emoticons"]}
+    # emote ids from the irc tags map straight onto the cdn, no catalog needed
+    EMOTE_URL = (
+        "https://static-cdn.jtvnw.net/emoticons/v2/{emote_id}/default/dark/{scale}"
+    )
+    # cdn scale -> pixel height
+    EMOTE_SCALES = [("1.0", 28), ("2.0", 56), ("3.0", 112)]
+
+    ANIMATED = True
+
+    def __init__(self, client_id, height, **kwargs):
+        super().__init__(client_id=client_id, height=height, **kwargs)
+        self.scale_name = next(
+            (name for name, px in self.EMOTE_SCALES if px >= height),
+            self.EMOTE_SCALES[-1][0],
+        )
+
+    def get_url(self, code):
+        return self.EMOTE_URL.format(emote_id=code, scale=self.scale_name)
 
-    @lru_cache(maxsize=1000)
     def get(self, code):
-        url = self.emote_map.get(code)
-        if url:
-            return self.load_from_url(self.emote_map[code])
+        if code:
+            return self.fetch(code, lambda: self.get_url(code))
 
 
 class TwitchBadges(ChatImage):
-    def __init__(self, client_id, height):
-        super().__init__(client_id=client_id, height=height)
-        self.global_badges = self.session.get(
-            "https://badges.twitch.tv/v1/badges/global/display?language=en"
-        ).json()["badge_sets"]
-        self.badge_map = {}
+    GLOBAL_BADGES_URL = "https://badges.twitch.tv/v1/badges/global/display?language=en"
+    CHANNEL_BADGES_URL = "https://api.twitch.tv/kraken/chat/{channel_id}/badges"
+
+    def __init__(self, client_id, height, **kwargs):
+        super().__init__(client_id=client_id, height=height, **kwargs)
+        self.global_badges = self.session.get(self.GLOBAL_BADGES_URL).json()[
+            "badge_sets"
+        ]
+        self.badge_map = ByteLRU(sizeof=json_bytes)
 
     def _get_channel_badges(self, channel_id):
-        if channel_id not in self.badge_map:
-            self.badge_map[channel_id] = self.session.get(
-                f"https://api.twitch.tv/kraken/chat/{channel_id}/badges"
-            ).json()
-            return self.badge_map[channel_id]
-        else:
-            return self.badge_map[channel_id]
+        badges = self.badge_map.lookup(channel_id)
+        if badges is MISSING:
+            badges = self.badge_map.insert(
+                channel_id,
+                self.session.get(
+                    self.CHANNEL_BADGES_URL.format(channel_id=channel_id)
+                ).json(),
+            )
+        return badges
 
-    @lru_cache(maxsize=1000)
-    def get(self, channel_id, badge_type):
+    def get_url(self, channel_id, badge_type):
         badge_map = self._get_channel_badges(channel_id)
         badge, version = badge_type.split("/")
         if badge_map.get(badge):
-            url = badge_map[badge].get("image")
-            return self.load_from_url(url)
+            return badge_map[badge].get("image")
         else:
-            badge_url = self.global_badges[badge]["versions"][version]["image_url_4x"]
-            return self.load_from_url(badge_url)
+            return self.global_badges[badge]["versions"][version]["image_url_4x"]
+
+    def get(self, channel_id, badge_type):
+        return self.fetch(
+            (channel_id, badge_type), lambda: self.get_url(channel_id, badge_type)
+        )
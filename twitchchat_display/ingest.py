@@ -0,0 +1,171 @@
+import logging
+import random
+from collections import deque
+from threading import Condition, Lock, Thread
+
+DROP_OLDEST = "drop_oldest"
+SKIP_OFFSCREEN = "skip_offscreen"
+SAMPLE = "sample"
+OVERLOAD_POLICIES = (DROP_OLDEST, SKIP_OFFSCREEN, SAMPLE)
+QUEUE_SIZE = 500
+RENDER_WORKERS = 1
+
+
+class MessageQueue(object):
+    # sits between the irc thread and layout, so a slow render never backs up
+    # the socket. Workers lay messages out in parallel but hand them to the
+    # screen in arrival order
+    def __init__(
+        self,
+        handler,
+        commit,
+        capacity=QUEUE_SIZE,
+        policy=SKIP_OFFSCREEN,
+        workers=RENDER_WORKERS,
+        visible=None,
+    ):
+        if policy not in OVERLOAD_POLICIES:
+            raise ValueError(
+                f"Unknown overload policy {policy!r}, use one of {OVERLOAD_POLICIES}"
+            )
+        self.logger = logging.getLogger(name=__name__)
+        self.handler = handler
+        self.commit = commit
+        self.capacity = capacity
+        self.policy = policy
+        self.worker_count = workers
+        # visible(message) -> (pane it goes to, lines that pane shows)
+        self.visible = visible
+        # [pane, message] in arrival order, message is None once skipped
+        self.queue = deque()
+        # pane -> its entries still queued, for skip_offscreen
+        self.by_pane = {}
+        self.depth = 0
+        self.lock = Lock()
+        self.not_empty = Condition(self.lock)
+        self.committed = Condition(self.lock)
+        self.next_seq = 0
+        self.commit_seq = 0
+        self.running = False
+        self.workers = []
+        self.received = 0
+        self.processed = 0
+        self.dropped = {DROP_OLDEST: 0, SKIP_OFFSCREEN: 0, SAMPLE: 0}
+        self.max_depth = 0
+
+    def put(self, message):
+        with self.lock:
+            self.received += 1
+            depth = self.depth
+            if self.policy == SAMPLE and depth >= self.capacity // 2:
+                # admit fewer messages the fuller the queue gets
+                room = (self.capacity - depth) / (self.capacity - self.capacity // 2)
+                if random.random() >= room:
+                    self.dropped[SAMPLE] += 1
+                    return
+            if depth >= self.capacity:
+                self.drop_oldest(DROP_OLDEST)
+            entry = [None, message]
+            self.queue.append(entry)
+            self.depth += 1
+            if self.policy == SKIP_OFFSCREEN and self.visible:
+                pane, lines = self.visible(message)
+                entry[0] = pane
+                queued = self.by_pane.setdefault(pane, deque())
+                queued.append(entry)
+                # every message is at least a line, so anything older than the
+                # newest screenful of its pane would scroll off as soon as it
+                # was drawn. Other panes keep theirs however busy this one is
+                while len(queued) > max(lines, 1):
+                    skipped = queued.popleft()
+                    skipped[1] = None
+                    self.depth -= 1
+                    self.dropped[SKIP_OFFSCREEN] += 1
+                if len(self.queue) > 2 * self.depth + self.capacity:
+                    # skipped entries only leave as the queue drains, which a
+                    # long burst may not give them time for
+                    self.queue = deque(
+                        item for item in self.queue if item[1] is not None
+                    )
+            self.max_depth = max(self.max_depth, self.depth)
+            self.not_empty.notify()
+
+    def pop_oldest(self):
+        entry = self.queue.popleft()
+        while entry[1] is None:
+            entry = self.queue.popleft()
+        if entry[0] is not None:
+            # the oldest of all is the oldest of its pane too
+            queued = self.by_pane[entry[0]]
+            queued.popleft()
+            if not queued:
+                del self.by_pane[entry[0]]
+        self.depth -= 1
+        return entry[1]
+
+    def drop_oldest(self, reason):
+        self.pop_oldest()
+        self.dropped[reason] += 1
+
+    def take(self):
+        with self.lock:
+            while self.running and not self.depth:
+                self.not_empty.wait()
+            if not self.running:
+                return None, None
+            seq = self.next_seq
+            self.next_seq += 1
+            return seq, self.pop_oldest()
+
+    def work(self):
+        while self.running:
+            seq, message = self.take()
+            if message is None:
+                break
+            try:
+                result = self.handler(message)
+            except Exception:
+                self.logger.exception(f"Error rendering {message}")
+                result = None
+            with self.lock:
+                while self.running and self.commit_seq != seq:
+                    self.committed.wait()
+            # it's our turn until commit_seq moves on, so commit without the
+            # lock and let the irc thread keep queueing meanwhile
+            try:
+                if result:
+                    self.commit(result)
+            finally:
+                with self.lock:
+                    self.processed += 1
+                    self.commit_seq += 1
+                    self.committed.notify_all()
+
+    def start(self):
+        self.running = True
+        for i in range(self.worker_count):
+            worker = Thread(target=self.work, name=f"render-worker-{i}")
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+
+    def stop(self):
+        with self.lock:
+            self.running = False
+            self.not_empty.notify_all()
+            self.committed.notify_all()
+        for worker in self.workers:
+            worker.join()
+        self.workers = []
+
+    def stats(self):
+        with self.lock:
+            return {
+                "depth": self.depth,
+                "max_depth": self.max_depth,
+                "capacity": self.capacity,
+                "policy": self.policy,
+                "received": self.received,
+                "processed": self.processed,
+                "dropped": dict(self.dropped),
+            }
@@ -0,0 +1,130 @@
+import re
+
+EMOTE_INDEX_RGX = re.compile(r"(\d+)-(\d+)")
+
+
+class Span(object):
+    __slots__ = ("parts",)
+
+    def __init__(self):
+        self.parts = ()
+
+    @property
+    def width(self):
+        return sum(part.get_width() for part in self.parts)
+
+
+class TextRun(Span):
+    __slots__ = ("text", "color", "bold")
+
+    def __init__(self, text, color, bold=False):
+        super().__init__()
+        self.text = text
+        self.color = color
+        self.bold = bold
+
+    def slice(self, start, end):
+        if start == 0 and end == len(self.text):
+            return self
+        return self.__class__(self.text[start:end], self.color, self.bold)
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.text!r})"
+
+
+class Username(TextRun):
+    __slots__ = ()
+
+    def __init__(self, text, color, bold=True):
+        super().__init__(text, color, bold)
+
+
+class Counter(TextRun):
+    __slots__ = ()
+
+
+class ImageSpan(Span):
+    __slots__ = ("text",)
+
+    def __init__(self, surface, text=""):
+        super().__init__()
+        self.parts = (surface,)
+        self.text = text
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.text!r})"
+
+
+class Emote(ImageSpan):
+    __slots__ = ("emote_id",)
+
+    def __init__(self, surface, emote_id, text=""):
+        super().__init__(surface, text)
+        self.emote_id = emote_id
+
+
+class Badge(ImageSpan):
+    __slots__ = ("badge_type",)
+
+    def __init__(self, surface, badge_type):
+        super().__init__(surface, badge_type)
+        self.badge_type = badge_type
+
+
+class Line(list):
+    # a wrapped line of spans, optionally pre-composited into one surface
+    __slots__ = ("surface", "received")
+
+    def __init__(self, spans=()):
+        super().__init__(spans)
+        self.surface = None
+        self.received = None
+
+    def uses(self, surface):
+        return any(part is surface for span in self for part in span.parts)
+
+
+def parse_emote_index(emotes):
+    emoteindxs = {}
+    if emotes:
+        for emoteinfo in emotes.split("/"):
+            emote_id, indexes = emoteinfo.split(":")
+            for start, end in EMOTE_INDEX_RGX.findall(indexes):
+                emoteindxs[int(start)] = (int(end), emote_id)
+    return emoteindxs
+
+
+def tokenize_message(text, emoteindxs, color, get_emote):
+    spans = []
+    run_start = 0
+    for start in sorted(emoteindxs):
+        if start < run_start or start >= len(text):
+            continue
+        end, emote_id = emoteindxs[start]
+        emote = get_emote(emote_id)
+        if not emote:
+            continue
+        if start > run_start:
+            spans.append(TextRun(text[run_start:start], color))
+        spans.append(Emote(emote, emote_id, text[start : end + 1]))
+        run_start = end + 1
+    if run_start < len(text):
+        spans.append(TextRun(text[run_start:], color))
+    return spans
+
+
+def ends_word(span):
+    return not isinstance(span, TextRun) or span.text[-1:].isspace()
+
+
+def find_break(text, start, end, at_word_start=False):
+    # text[start:end] is the longest prefix that fits; prefer the last word
+    # boundary in it and only split inside a word when there is none
+    if text[end].isspace():
+        return end, end + 1
+    space_i = text.rfind(" ", start, end)
+    if space_i >= 0:
+        return space_i + 1, space_i + 1
+    if at_word_start:
+        return start, start
+    return end, end
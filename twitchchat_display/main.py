@@ -5,14 +5,22 @@ import logging.config
 import signal
 import sys
 import time
+from functools import partial
 from pathlib import Path
 
 import click
 import pygame
 from twitchchat import twitch_chat
 
+from .animation import ANIMATION_FPS
+from .cache import MEMORY_BUDGET_MB, MEMORY_TTL
 from .config import get_config, logging_config
-from .display import TwitchChatDisplay
+from .display import COLUMNS, MAX_FPS, RENDER_CACHE_MB, TwitchChatDisplay
+from .filters import DEDUPE_WINDOW
+from .images import ANIMATION_MB, DECODE_PROCESSES, IMAGE_STORE_MB
+from .ingest import QUEUE_SIZE, RENDER_WORKERS, SKIP_OFFSCREEN
+from .replay import REPLAY_SPEED, ChatReplay
+from .scrollback import SCROLLBACK_MB, SCROLLBACK_MESSAGES
 
 logger = logging.getLogger("twitch_monitor")
 
@@ -31,26 +39,84 @@ def signal_term_handler(signal, frame):
     default="config.yaml",
     type=click.Path(exists=True, dir_okay=False, readable=True, writable=True),
 )
-def main(verbosity, config_fp):
+@click.option(
+    "--record",
+    "record_path",
+    type=click.Path(dir_okay=False, writable=True),
+    help="Append every chat message received to this file",
+)
+@click.option(
+    "--replay",
+    "replay_path",
+    type=click.Path(exists=True, dir_okay=False),
+    help="Play back a recording instead of connecting to twitch",
+)
+@click.option(
+    "--replay-speed",
+    type=float,
+    help="Replay speed multiplier, 0 plays as fast as possible",
+)
+def main(verbosity, config_fp, record_path, replay_path, replay_speed):
     logging.config.dictConfig(logging_config(verbosity))
     config_fp = Path(config_fp)
     logger.info(f"Loading {config_fp}")
     config = get_config(config_fp)
+    record_path = record_path or config.get("record_path")
+    replay_path = replay_path or config.get("replay_path")
+    if replay_speed is None:
+        replay_speed = config.get("replay_speed", REPLAY_SPEED)
     signal.signal(signal.SIGTERM, signal_term_handler)
     try:
         logger.info("Loading TwitchChatDisplay")
         console = TwitchChatDisplay(
-            config["screen_width"], config["screen_height"], config["client_id"]
+            config["screen_width"],
+            config["screen_height"],
+            config["client_id"],
+            render_cache_mb=config.get("render_cache_mb", RENDER_CACHE_MB),
+            image_cache_mb=config.get("image_cache_mb", IMAGE_STORE_MB),
+            max_fps=config.get("max_fps", MAX_FPS),
+            flatten_lines=config.get("flatten_lines", False),
+            queue_size=config.get("queue_size", QUEUE_SIZE),
+            overload_policy=config.get("overload_policy", SKIP_OFFSCREEN),
+            render_workers=config.get("render_workers", RENDER_WORKERS),
+            banned_patterns=config.get("banned_patterns", ()),
+            dedupe_window=config.get("dedupe_window", DEDUPE_WINDOW),
+            record_path=record_path,
+            metrics_port=config.get("metrics_port"),
+            debug_overlay=config.get("debug_overlay", False),
+            memory_budget_mb=config.get("memory_budget_mb", MEMORY_BUDGET_MB),
+            cache_ttl=config.get("cache_ttl", MEMORY_TTL),
+            panes=config.get("panes"),
+            pane_layout=config.get("pane_layout", COLUMNS),
+            scrollback_messages=config.get("scrollback_messages", SCROLLBACK_MESSAGES),
+            scrollback_mb=config.get("scrollback_mb", SCROLLBACK_MB),
+            offscreen=config.get("offscreen", False),
+            export_pipe=config.get("export_pipe"),
+            export_shm=config.get("export_shm"),
+            export_mjpeg_port=config.get("export_mjpeg_port"),
+            export_fps=config.get("export_fps"),
+            layout_process=config.get("layout_process", False),
+            decode_processes=config.get("decode_processes", DECODE_PROCESSES),
+            animate_emotes=config.get("animate_emotes", True),
+            animation_mb=config.get("animation_mb", ANIMATION_MB),
+            animation_fps=config.get("animation_fps", ANIMATION_FPS),
         )
         console.display_message("Loading twitch_api manager")
         console.display_message("Loading twitch_message handler")
-        tirc = twitch_chat(
-            config["twitch_username"],
-            config["twitch_oauth"],
-            config["twitch_channels"],
-            config["client_id"],
-        )
-        tirc.subscribeChatMessage(console.new_twitchmessage)
+        if replay_path:
+            source = partial(ChatReplay, replay_path, replay_speed)
+        else:
+            source = partial(
+                twitch_chat,
+                config["twitch_username"],
+                config["twitch_oauth"],
+                config["twitch_channels"],
+                config["client_id"],
+            )
+        tirc = None
+        if not config.get("layout_process", False):
+            tirc = source()
+            tirc.subscribeChatMessage(console.new_twitchmessage)
         if "ignored_users" in config:
             for user in config["ignored_users"]:
                 console.ignore_user(user)
@@ -58,10 +124,15 @@ def main(verbosity, config_fp):
             logger.info("Loaded TwitchChatDisplay")
             console.display_message("Loading complete, awaiting messages")
             console.start()
-            tirc.start()
+            if tirc:
+                tirc.start()
+            else:
+                console.start_layout_process(source, verbosity)
             while True:
                 time.sleep(0.1)
                 if pygame.display.get_init():
+                    for event in pygame.event.get(pygame.KEYDOWN):
+                        console.handle_key(event.key)
                     pygame.event.pump()
         finally:
             console.stop()
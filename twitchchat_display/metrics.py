@@ -0,0 +1,139 @@
+import logging
+import time
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+
+from .stats import LatencyStats
+
+METRICS_HOST = "127.0.0.1"
+METRIC_PREFIX = "twitchchat"
+QUANTILES = ((0.5, "p50"), (0.95, "p95"), (0.99, "p99"))
+
+
+class Metrics(object):
+    # stage timers plus anything else with a stats() dict. Only exists when
+    # the endpoint or overlay is turned on, and stages are timed by wrapping
+    # methods on their instances, so a disabled pipeline runs untouched code
+    def __init__(self):
+        self.logger = logging.getLogger(name=__name__)
+        self.stages = {}
+        self.sources = {}
+
+    def stage(self, name):
+        if name not in self.stages:
+            self.stages[name] = LatencyStats()
+        return self.stages[name]
+
+    def instrument(self, obj, method, stage=None):
+        timings = self.stage(stage or method)
+        func = getattr(obj, method)
+
+        @wraps(func)
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                timings.add(time.perf_counter() - started)
+
+        setattr(obj, method, timed)
+
+    def add_source(self, name, stats):
+        self.sources[name] = stats
+
+    def add_latency(self, name, latency):
+        self.stages[name] = latency
+
+    def collect(self):
+        values = {}
+        for name, stats in self.sources.items():
+            try:
+                values[name] = stats()
+            except Exception:
+                self.logger.exception(f"Error collecting {name} metrics")
+        return values
+
+    def prometheus(self):
+        out = []
+        name = f"{METRIC_PREFIX}_stage_seconds"
+        out.append(f"# TYPE {name} summary")
+        for stage, timings in sorted(self.stages.items()):
+            summary = timings.summary()
+            for quantile, key in QUANTILES:
+                out.append(
+                    f'{name}{{stage="{stage}",quantile="{quantile}"}} {summary[key]}'
+                )
+            out.append(f'{name}_sum{{stage="{stage}"}} {timings.total}')
+            out.append(f'{name}_count{{stage="{stage}"}} {summary["count"]}')
+        for source, values in sorted(self.collect().items()):
+            for key, value in sorted(values.items()):
+                metric = f"{METRIC_PREFIX}_{source}_{key}"
+                if isinstance(value, dict):
+                    out.append(f"# TYPE {metric} gauge")
+                    for label, labelled in sorted(value.items()):
+                        out.append(f'{metric}{{key="{label}"}} {labelled}')
+                elif isinstance(value, (int, float)):
+                    out.append(f"# TYPE {metric} gauge")
+                    out.append(f"{metric} {value}")
+        return "\n".join(out) + "\n"
+
+    def overlay_lines(self):
+        lines = []
+        for stage, timings in sorted(self.stages.items()):
+            summary = timings.summary()
+            if summary["count"]:
+                lines.append(
+                    "{0} p50 {1:.1f}ms p95 {2:.1f}ms n={3}".format(
+                        stage,
+                        summary["p50"] * 1000,
+                        summary["p95"] * 1000,
+                        summary["count"],
+                    )
+                )
+        for source, values in sorted(self.collect().items()):
+            if "hit_rate" in values:
+                lines.append("{0} hit rate {1:.0%}".format(source, values["hit_rate"]))
+            if "depth" in values:
+                lines.append(
+                    "{0} depth {1} dropped {2}".format(
+                        source, values["depth"], sum(values["dropped"].values())
+                    )
+                )
+        return lines
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = self.server.metrics.prometheus().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MetricsServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, metrics, port, host=METRICS_HOST):
+        super().__init__((host, port), MetricsHandler)
+        self.metrics = metrics
+        self.thread = None
+
+    def start(self):
+        self.thread = Thread(target=self.serve_forever, name="metrics")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        if self.thread:
+            self.shutdown()
+            self.thread.join()
+        self.server_close()
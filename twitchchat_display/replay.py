@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+# Record the parsed chat message dicts the display receives and play them back,
+# either straight into the display or through a tiny local irc server
+
+import json
+import logging
+import logging.config
+import socketserver
+import time
+from threading import Event, Lock, Thread
+
+import click
+
+from .config import logging_config
+
+REPLAY_SPEED = 1.0
+# recordings are appended to across runs, don't sit out the downtime between
+MAX_GAP = 5.0
+IRC_HOST = "127.0.0.1"
+IRC_PORT = 6667
+# fields twitch_chat builds from the irc line itself rather than its tags
+PREFIX_FIELDS = ("username", "channel", "message")
+TAG_ESCAPES = [("\\", "\\\\"), (";", "\\:"), (" ", "\\s"), ("\r", "\\r"), ("\n", "\\n")]
+
+
+class ChatRecorder(object):
+    # one json array per line: [unix time, message dict]
+    def __init__(self, path):
+        self.logger = logging.getLogger(name=__name__)
+        self.path = path
+        self.lock = Lock()
+        self.file = open(path, "a", encoding="utf-8")
+        self.logger.info(f"Recording chat to {path}")
+
+    def record(self, message):
+        line = json.dumps(
+            [round(time.time(), 3), message], ensure_ascii=False, separators=(",", ":")
+        )
+        with self.lock:
+            if self.file:
+                self.file.write(line + "\n")
+                self.file.flush()
+
+    def close(self):
+        with self.lock:
+            if self.file:
+                self.file.close()
+                self.file = None
+
+
+def read_log(path):
+    logger = logging.getLogger(name=__name__)
+    with open(path, encoding="utf-8") as f:
+        for number, line in enumerate(f, 1):
+            try:
+                timestamp, message = json.loads(line)
+            except ValueError:
+                # a recording cut off mid-write ends in a partial line
+                logger.warning(f"Skipping unreadable line {number} of {path}")
+                continue
+            yield timestamp, message
+
+
+def paced(path, speed=REPLAY_SPEED, stopped=None, max_gap=MAX_GAP):
+    # yields messages from a recording spaced out as they arrived, divided by
+    # speed; a speed of 0 yields them as fast as they can be consumed
+    stopped = stopped or Event()
+    started = time.monotonic()
+    offset = 0.0
+    previous = None
+    for timestamp, message in read_log(path):
+        if speed and previous is not None:
+            offset += min(max(timestamp - previous, 0), max_gap) / speed
+            delay = started + offset - time.monotonic()
+            if delay > 0 and stopped.wait(delay):
+                return
+        previous = timestamp
+        if stopped.is_set():
+            return
+        yield message
+
+
+class ChatReplay(object):
+    # stands in for twitch_chat, feeding a recording to the same callbacks
+    def __init__(self, path, speed=REPLAY_SPEED, loop=False):
+        self.logger = logging.getLogger(name=__name__)
+        self.path = path
+        self.speed = speed
+        self.loop = loop
+        self.chat_subscribers = []
+        self.stopped = Event()
+        self.thread = None
+        self.replayed = 0
+
+    def subscribeChatMessage(self, callback):
+        self.chat_subscribers.append(callback)
+
+    def run(self):
+        while not self.stopped.is_set():
+            for message in paced(self.path, self.speed, self.stopped):
+                for callback in self.chat_subscribers:
+                    callback(message)
+                self.replayed += 1
+            if not self.loop:
+                break
+        self.logger.info(f"Replay of {self.path} finished after {self.replayed}")
+
+    def start(self):
+        self.logger.info(f"Replaying {self.path} at {self.speed or 'max'} speed")
+        self.thread = Thread(target=self.run, name="chat-replay")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread:
+            self.thread.join()
+
+
+def escape_tag(value):
+    value = str(value)
+    for raw, escaped in TAG_ESCAPES:
+        value = value.replace(raw, escaped)
+    return value
+
+
+def to_privmsg(message):
+    tags = ";".join(
+        f"{key}={escape_tag(value)}"
+        for key, value in message.items()
+        if key not in PREFIX_FIELDS and value is not None
+    )
+    user = message["username"]
+    channel = message["channel"]
+    if not channel.startswith("#"):
+        channel = "#" + channel
+    prefix = f"{user}!{user}@{user}.tmi.twitch.tv"
+    return f"@{tags} :{prefix} PRIVMSG {channel} :{message['message']}"
+
+
+class IrcHandler(socketserver.StreamRequestHandler):
+    # just enough of twitch's irc dialect to get a client logged in and joined;
+    # the recording starts playing once the first channel is joined
+    def setup(self):
+        super().setup()
+        self.send_lock = Lock()
+
+    def send(self, line):
+        with self.send_lock:
+            self.wfile.write((line + "\r\n").encode("utf-8"))
+
+    def handle(self):
+        server = self.server
+        nick = "justinfan"
+        replaying = None
+        for raw in self.rfile:
+            line = raw.decode("utf-8", "replace").strip()
+            command, _, args = line.partition(" ")
+            command = command.upper()
+            if command == "NICK":
+                nick = args.strip()
+                self.send(f":tmi.twitch.tv 001 {nick} :Welcome, GLHF!")
+                self.send(f":tmi.twitch.tv 376 {nick} :>")
+            elif command == "CAP":
+                self.send(f":tmi.twitch.tv CAP * ACK :{args.partition(':')[2]}")
+            elif command == "PING":
+                self.send(f":tmi.twitch.tv PONG tmi.twitch.tv {args}")
+            elif command == "JOIN":
+                for channel in args.split(","):
+                    self.send(f":{nick}!{nick}@{nick}.tmi.twitch.tv JOIN {channel}")
+                if replaying is None:
+                    replaying = Thread(target=self.replay, name="irc-replay")
+                    replaying.daemon = True
+                    replaying.start()
+            elif command == "QUIT":
+                break
+        server.logger.info(f"{nick} disconnected")
+
+    def replay(self):
+        server = self.server
+        try:
+            for message in paced(server.path, server.speed, server.stopped):
+                self.send(to_privmsg(message))
+        except OSError:
+            return
+        server.logger.info(f"Finished replaying {server.path}")
+
+
+class IrcStandIn(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, path, speed=REPLAY_SPEED, host=IRC_HOST, port=IRC_PORT):
+        super().__init__((host, port), IrcHandler)
+        self.logger = logging.getLogger(name=__name__)
+        self.path = path
+        self.speed = speed
+        self.stopped = Event()
+
+    def shutdown(self):
+        self.stopped.set()
+        super().shutdown()
+
+
+@click.command()
+@click.option("-v", "--verbosity", count=True)
+@click.option("--host", default=IRC_HOST, show_default=True)
+@click.option("--port", default=IRC_PORT, show_default=True)
+@click.option(
+    "--speed",
+    default=REPLAY_SPEED,
+    show_default=True,
+    help="Playback speed multiplier, 0 to send as fast as possible",
+)
+@click.argument("recording", type=click.Path(exists=True, dir_okay=False))
+def main(verbosity, host, port, speed, recording):
+    logging.config.dictConfig(logging_config(verbosity))
+    server = IrcStandIn(recording, speed, host, port)
+    server.logger.info(f"Serving {recording} as irc on {host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
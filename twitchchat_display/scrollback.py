@@ -0,0 +1,202 @@
+import sys
+from bisect import bisect_left
+from collections import OrderedDict, deque
+from threading import Lock
+
+SCROLLBACK_MESSAGES = 100000
+SCROLLBACK_MB = 16
+# laid out messages kept around for paging back and forth
+LAYOUT_CACHE_SIZE = 256
+# a pointer in the ring or an index
+SLOT_BYTES = 8
+
+
+def intern(value):
+    return sys.intern(value) if value else value
+
+
+class ScrollRecord(object):
+    # a message as it arrived, minus everything that can be rebuilt: the
+    # strings shared between messages are interned and nothing is rendered
+    __slots__ = (
+        "username",
+        "display_name",
+        "color",
+        "badges",
+        "emotes",
+        "channel",
+        "room_id",
+        "text",
+        "count",
+    )
+
+    def __init__(self, message):
+        self.username = intern(message["username"])
+        self.display_name = intern(message["display-name"])
+        self.color = intern(message["color"])
+        self.badges = intern(message["badges"])
+        self.emotes = message["emotes"] or None
+        self.channel = intern(message["channel"])
+        self.room_id = intern(message["room-id"])
+        self.text = message["message"]
+        self.count = 1
+
+    @property
+    def bytes(self):
+        # the interned strings are shared with other records, the text and
+        # emote tags are this record's own
+        size = sys.getsizeof(self) + sys.getsizeof(self.text)
+        if self.emotes:
+            size += sys.getsizeof(self.emotes)
+        return size
+
+    def message(self):
+        return {
+            "username": self.username,
+            "display-name": self.display_name,
+            "color": self.color,
+            "badges": self.badges,
+            "emotes": self.emotes,
+            "channel": self.channel,
+            "room-id": self.room_id,
+            "message": self.text,
+        }
+
+
+class Scrollback(object):
+    # a ring of the most recent messages, capped by count and by bytes, with
+    # the lines for whichever of them were shown recently cached by layout.
+    # group sorts records into groups (e.g. panes), each with an index of its
+    # seqs so paging one never walks the others' messages
+    def __init__(
+        self,
+        layout,
+        max_messages=SCROLLBACK_MESSAGES,
+        max_bytes=SCROLLBACK_MB * 1024 * 1024,
+        group=None,
+    ):
+        self.layout = layout
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self.group = group
+        self.records = deque()
+        self.first_seq = 0
+        self.current_bytes = 0
+        # group -> [seqs, index of the oldest one still in the ring]
+        self.groups = {}
+        self.layouts = OrderedDict()
+        self.lock = Lock()
+
+    def __len__(self):
+        return len(self.records)
+
+    @property
+    def end(self):
+        return self.first_seq + len(self.records)
+
+    def entry_bytes(self, record, seq):
+        size = record.bytes + SLOT_BYTES
+        if self.group is not None:
+            size += sys.getsizeof(seq) + SLOT_BYTES
+        return size
+
+    def append(self, record):
+        group = self.group(record) if self.group is not None else None
+        with self.lock:
+            seq = self.end
+            self.records.append(record)
+            self.current_bytes += self.entry_bytes(record, seq)
+            if self.group is not None:
+                self.groups.setdefault(group, [[], 0])[0].append(seq)
+            while self.records and (
+                len(self.records) > self.max_messages
+                or self.current_bytes > self.max_bytes
+            ):
+                self.drop_oldest()
+        return record
+
+    def drop_oldest(self):
+        record = self.records.popleft()
+        self.current_bytes -= self.entry_bytes(record, self.first_seq)
+        if self.group is not None:
+            index = self.groups[self.group(record)]
+            index[1] += 1
+            if index[1] > len(index[0]) // 2:
+                del index[0][: index[1]]
+                index[1] = 0
+        self.first_seq += 1
+
+    def before(self, end, count, group=None):
+        # up to count records before seq end, oldest first, with their seqs
+        with self.lock:
+            end = min(end, self.end)
+            if group is None:
+                seqs = range(max(self.first_seq, end - count), end)
+            else:
+                seqs, start = self.groups.get(group, ((), 0))
+                i = bisect_left(seqs, end, start)
+                seqs = seqs[max(start, i - count) : i]
+            return [(seq, self.records[seq - self.first_seq]) for seq in seqs]
+
+    def after(self, start, count, group=None):
+        # up to count records from seq start onwards, oldest first
+        with self.lock:
+            start = max(start, self.first_seq)
+            if group is None:
+                seqs = range(start, min(self.end, start + count))
+            else:
+                seqs, first = self.groups.get(group, ((), 0))
+                i = bisect_left(seqs, start, first)
+                seqs = seqs[i : i + count]
+            return [(seq, self.records[seq - self.first_seq]) for seq in seqs]
+
+    def get(self, seq):
+        with self.lock:
+            if self.first_seq <= seq < self.end:
+                return self.records[seq - self.first_seq]
+        return None
+
+    def lines_for(self, record, layout_key):
+        key = (record, record.count, layout_key)
+        lines = self.layouts.get(key)
+        if lines is None:
+            lines = self.layouts[key] = self.layout(record, layout_key)
+            while len(self.layouts) > LAYOUT_CACHE_SIZE:
+                self.layouts.popitem(last=False)
+        else:
+            self.layouts.move_to_end(key)
+        return lines
+
+    def page(self, end, max_lines, layout_key, group=None):
+        # lines of the messages before seq end, newest last, just enough to
+        # fill max_lines; returns them with the seq of the oldest one used.
+        # Every message is at least a line, so max_lines of them will do
+        lines = []
+        seq = end
+        for seq, record in reversed(self.before(end, max_lines, group)):
+            lines[:0] = self.lines_for(record, layout_key)
+            if len(lines) >= max_lines:
+                break
+        return lines[-max_lines:], seq
+
+    def page_end(self, start, max_lines, layout_key, group=None):
+        # the seq just after a page's worth of messages from start onwards
+        count = 0
+        for seq, record in self.after(start, max_lines, group):
+            count += len(self.lines_for(record, layout_key))
+            if count >= max_lines:
+                return seq + 1
+        return self.end
+
+    def invalidate(self):
+        self.layouts.clear()
+
+    def stats(self):
+        with self.lock:
+            return {
+                "messages": len(self.records),
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "layouts": len(self.layouts),
+                "groups": len(self.groups),
+            }
@@ -0,0 +1,46 @@
+from collections import deque
+from threading import Lock
+
+STATS_WINDOW = 1000
+
+
+class LatencyStats(object):
+    def __init__(self, window=STATS_WINDOW):
+        self.samples = deque(maxlen=window)
+        self.count = 0
+        self.total = 0.0
+        self.lock = Lock()
+
+    def add(self, seconds):
+        with self.lock:
+            self.samples.append(seconds)
+            self.count += 1
+            self.total += seconds
+
+    def percentile(self, ordered, pct):
+        if not ordered:
+            return 0.0
+        return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+    def summary(self):
+        with self.lock:
+            ordered = sorted(self.samples)
+            count, total = self.count, self.total
+        return {
+            "count": count,
+            "mean": total / count if count else 0.0,
+            "p50": self.percentile(ordered, 50),
+            "p95": self.percentile(ordered, 95),
+            "p99": self.percentile(ordered, 99),
+            "max": ordered[-1] if ordered else 0.0,
+        }
+
+    def format(self):
+        summary = self.summary()
+        return "n={0} mean={1:.1f}ms p50={2:.1f}ms p95={3:.1f}ms max={4:.1f}ms".format(
+            summary["count"],
+            summary["mean"] * 1000,
+            summary["p50"] * 1000,
+            summary["p95"] * 1000,
+            summary["max"] * 1000,
+        )
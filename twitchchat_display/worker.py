@@ -0,0 +1,349 @@
+import logging
+import logging.config
+import marshal
+import multiprocessing
+import os
+import struct
+import time
+from multiprocessing import shared_memory
+from threading import Thread
+
+import pygame
+
+from .config import logging_config
+from .filters import MessageFilter
+from .layout import (
+    Badge,
+    Emote,
+    TextRun,
+    Username,
+    parse_emote_index,
+    tokenize_message,
+)
+from .replay import ChatRecorder
+from .scrollback import ScrollRecord
+
+RING_MB = 4
+# how long the worker waits for the display to make room before dropping
+RING_WAIT = 1.0
+# write position, read position, records dropped, records written; all only
+# ever grow, and each is only written by one side
+RING_HEADER = struct.Struct("<QQQQ")
+READ_OFFSET = 8
+DROPPED_OFFSET = 16
+WRITTEN_OFFSET = 24
+RECORD_HEADER = struct.Struct("<I")
+WRAP = 0xFFFFFFFF
+# layout record kinds
+MESSAGE = "m"
+COUNT = "c"
+# span kinds
+TEXT = "t"
+USERNAME = "u"
+EMOTE = "e"
+BADGE = "b"
+
+
+class SharedRing(object):
+    # length prefixed records in a shared memory ring, one writer process and
+    # one reader process; the semaphore counts records ready to read
+    def __init__(self, name=None, size=RING_MB * 1024 * 1024, ready=None):
+        create = ready is None
+        if create:
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+            RING_HEADER.pack_into(self.shm.buf, 0, 0, 0, 0, 0)
+            ready = multiprocessing.get_context("spawn").Semaphore(0)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.owner = create
+        self.ready = ready
+        self.capacity = self.shm.size - RING_HEADER.size
+        # records taken out by this side, the writer's counts are in the header
+        self.read = 0
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def positions(self):
+        return self.header()[:2]
+
+    def header(self):
+        return RING_HEADER.unpack_from(self.shm.buf, 0)
+
+    def count(self, offset):
+        (value,) = struct.unpack_from("<Q", self.shm.buf, offset)
+        struct.pack_into("<Q", self.shm.buf, offset, value + 1)
+
+    def put(self, data, wait=RING_WAIT):
+        needed = RECORD_HEADER.size + len(data)
+        # a record never straddles the end, so it may need the tail skipped too
+        if needed * 2 > self.capacity:
+            raise ValueError(f"Record of {len(data)} bytes too big for the ring")
+        deadline = time.monotonic() + wait
+        while True:
+            write, read = self.positions()
+            offset = write % self.capacity
+            skip = self.capacity - offset if offset + needed > self.capacity else 0
+            if write + skip + needed - read <= self.capacity:
+                break
+            if time.monotonic() > deadline:
+                self.count(DROPPED_OFFSET)
+                return False
+            time.sleep(0.001)
+        buf = self.shm.buf
+        if skip:
+            if skip >= RECORD_HEADER.size:
+                RECORD_HEADER.pack_into(buf, RING_HEADER.size + offset, WRAP)
+            write += skip
+            offset = 0
+        start = RING_HEADER.size + offset
+        RECORD_HEADER.pack_into(buf, start, len(data))
+        buf[start + RECORD_HEADER.size : start + needed] = data
+        struct.pack_into("<Q", buf, 0, write + needed)
+        self.count(WRITTEN_OFFSET)
+        self.ready.release()
+        return True
+
+    def get(self, timeout=None):
+        if not self.ready.acquire(timeout=timeout):
+            return None
+        _, read = self.positions()
+        offset = read % self.capacity
+        if self.capacity - offset >= RECORD_HEADER.size:
+            (length,) = RECORD_HEADER.unpack_from(
+                self.shm.buf, RING_HEADER.size + offset
+            )
+        else:
+            length = WRAP
+        if length == WRAP:
+            read += self.capacity - offset
+            offset = 0
+            (length,) = RECORD_HEADER.unpack_from(self.shm.buf, RING_HEADER.size)
+        start = RING_HEADER.size + offset + RECORD_HEADER.size
+        data = bytes(self.shm.buf[start : start + length])
+        struct.pack_into(
+            "<Q", self.shm.buf, READ_OFFSET, read + RECORD_HEADER.size + length
+        )
+        self.read += 1
+        return data
+
+    def stats(self):
+        write, read, dropped, written = self.header()
+        return {
+            "written": written,
+            "read": self.read,
+            "dropped": dropped,
+            "bytes": write - read,
+            "capacity": self.capacity,
+        }
+
+    def close(self):
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+class LayoutWorker(object):
+    # runs in the worker process: takes chat from the source, filters it and
+    # works out the spans and line breaks of each message, so the display
+    # process only has to render glyphs and blit
+    def __init__(self, ring, control, font_helper, options):
+        self.logger = logging.getLogger(name=__name__)
+        self.ring = ring
+        self.control = control
+        self.font_helper = font_helper
+        self.message_filter = MessageFilter(
+            ignored_users=options["ignored_users"],
+            banned_patterns=options["banned_patterns"],
+            dedupe_window=options["dedupe_window"],
+        )
+        self.recorder = None
+        if options["record_path"]:
+            self.recorder = ChatRecorder(options["record_path"])
+        self.panes = options["panes"]
+        self.pane_lines = [0] * len(self.panes)
+        self.source = options["source"]()
+        self.seq = 0
+
+    def pane_index(self, channel, room_id):
+        if len(self.panes) > 1 and channel is not None:
+            channel = channel.lstrip("#").lower()
+            for i, (channels, _, _) in enumerate(self.panes):
+                if channel in channels or room_id in channels:
+                    return i
+        return next(
+            (i for i, (channels, _, _) in enumerate(self.panes) if "*" in channels),
+            0,
+        )
+
+    def is_visible(self, marker):
+        _, pane, line_number = marker
+        return self.pane_lines[pane] - line_number < self.panes[pane][2]
+
+    def new_twitchmessage(self, message):
+        received = time.monotonic()
+        if self.recorder:
+            self.recorder.record(message)
+        record = self.message_filter.check(message, self.is_visible)
+        if record is None:
+            return
+        if record.count > 1:
+            if record.lines:
+                self.send((COUNT, record.lines[-1][0], record.count))
+            return
+        pane = self.pane_index(message["channel"], message["room-id"])
+        lines = self.layout(message, self.panes[pane][1])
+        self.seq += 1
+        fields = ScrollRecord(message).message()
+        if not self.send((MESSAGE, self.seq, pane, received, fields, lines)):
+            # never shown, so duplicates of it start a record of their own
+            return
+        self.pane_lines[pane] += len(lines)
+        record.lines = [(self.seq, pane, self.pane_lines[pane])]
+        record.committed = True
+
+    def layout(self, message, maxwidth):
+        # images are square at the line height until they are fetched, so
+        # that is the width they are laid out at
+        height = self.font_helper.font_height
+        square = Square(height)
+        badges = message["badges"]
+        spans = [Badge(square, badge) for badge in badges.split(",")] if badges else []
+        spans.append(Username(message["display-name"] or message["username"], None))
+        spans.append(TextRun(" : ", None))
+        spans.extend(
+            tokenize_message(
+                message["message"],
+                parse_emote_index(message["emotes"]),
+                None,
+                lambda emote_id: square if emote_id else None,
+            )
+        )
+        lines = []
+        for line in self.font_helper.wrap(spans, maxwidth):
+            encoded = []
+            for span in line:
+                if isinstance(span, Badge):
+                    encoded.append((BADGE, span.badge_type))
+                elif isinstance(span, Emote):
+                    encoded.append((EMOTE, span.text, span.emote_id))
+                elif isinstance(span, Username):
+                    encoded.append((USERNAME, span.text))
+                else:
+                    encoded.append((TEXT, span.text))
+            lines.append(encoded)
+        return lines
+
+    def send(self, record):
+        try:
+            return self.ring.put(marshal.dumps(record))
+        except ValueError:
+            self.logger.exception("Couldn't send layout record")
+            self.ring.count(DROPPED_OFFSET)
+            return False
+
+    def run(self):
+        self.source.subscribeChatMessage(self.new_twitchmessage)
+        self.source.start()
+        while True:
+            command = self.control.get()
+            if command is None:
+                break
+            name, value = command
+            if name == "panes":
+                self.panes = value
+            elif name == "ignore":
+                self.message_filter.ignore_user(value)
+        stop = getattr(self.source, "stop", None)
+        if stop:
+            stop()
+        if self.recorder:
+            self.recorder.close()
+
+
+class Square(object):
+    # stands in for an image surface, only its width matters for layout
+    def __init__(self, size):
+        self.size = size
+
+    def get_width(self):
+        return self.size
+
+
+def run_worker(ring_name, ready, control, options, verbosity):
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    logging.config.dictConfig(logging_config(verbosity))
+    # display imports this module for LayoutProcess, and switches pygame.font
+    # over to ftfont on import
+    from .display import FontHelper
+
+    pygame.font.init()
+    ring = SharedRing(ring_name, ready=ready)
+    try:
+        font_helper = FontHelper(options["cache_dir"])
+        for font_path, bold in options["fonts"]:
+            font_helper.load_font(font_path, bold=bold)
+        LayoutWorker(ring, control, font_helper, options).run()
+    except Exception:
+        logging.getLogger(name=__name__).exception("Layout worker failed")
+    finally:
+        ring.close()
+
+
+class LayoutProcess(object):
+    # the display side: starts the worker process and hands every layout
+    # record it sends to handler, on a thread of its own
+    def __init__(self, handler, options, verbosity=0, ring_mb=RING_MB):
+        self.logger = logging.getLogger(name=__name__)
+        self.handler = handler
+        self.ring = SharedRing(size=int(ring_mb * 1024 * 1024))
+        context = multiprocessing.get_context("spawn")
+        self.control = context.Queue()
+        self.process = context.Process(
+            target=run_worker,
+            args=(self.ring.name, self.ring.ready, self.control, options, verbosity),
+            name="layout-worker",
+            daemon=True,
+        )
+        self.reader = None
+        self.running = False
+
+    def start(self):
+        self.running = True
+        self.process.start()
+        self.reader = Thread(target=self.read, name="layout-reader")
+        self.reader.daemon = True
+        self.reader.start()
+        self.logger.info(f"Layout worker started as pid {self.process.pid}")
+
+    def read(self):
+        while self.running:
+            data = self.ring.get(timeout=0.1)
+            if data is None:
+                continue
+            try:
+                self.handler(marshal.loads(data))
+            except Exception:
+                self.logger.exception("Error handling layout record")
+
+    def set_panes(self, panes):
+        self.control.put(("panes", panes))
+
+    def ignore_user(self, username):
+        self.control.put(("ignore", username))
+
+    def stats(self):
+        stats = self.ring.stats()
+        stats["alive"] = int(self.process.is_alive())
+        return stats
+
+    def stop(self):
+        self.control.put(None)
+        self.process.join(5)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.running = False
+        if self.reader:
+            self.reader.join()
+        self.ring.close()